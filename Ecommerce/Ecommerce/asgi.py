@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecommerce.settings')
+# serve the catalog and cart endpoints from Shop/async_views.py; SHOP_ASYNC_VIEWS=0 keeps the sync ones
+os.environ.setdefault('SHOP_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -0,0 +1,224 @@
+"""
+Database profiles for the Ecommerce project.
+
+DB_PROFILE picks the backend:
+    sqlite    (default) DB_NAME, tuned through the pragmas below
+    postgres  DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+    mysql     same variables as postgres
+
+Setting DB_REPLICA_NAME (sqlite) or DB_REPLICA_HOST (server profiles) adds a
+'replica' alias; PrimaryReplicaRouter then sends catalog reads there while the
+replica is within SHOP_REPLICA_MAX_LAG seconds of the primary. Requests that
+wrote (and, through a short-lived cookie, the same browser's next requests)
+and cache fills read from the primary instead.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections, router
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),        # readers no longer block the writer
+    ('synchronous', 'NORMAL'),      # safe with WAL, avoids an fsync per commit
+    ('temp_store', 'MEMORY'),
+    ('cache_size', -20000),         # ~20MB page cache per connection
+    ('mmap_size', 134217728),
+    ('foreign_keys', 'ON'),
+)
+
+SERVER_ENGINES = {
+    'postgres': 'django.db.backends.postgresql',
+    'mysql': 'django.db.backends.mysql',
+}
+
+# models whose reads may be served by the replica
+REPLICA_READ_MODELS = {('Shop', 'product')}
+
+# {'pinned': bool, 'wrote': bool} for the current request, set by Shop.middleware.PrimaryReadsMiddleware
+request_state = ContextVar('shop_db_request_state', default=None)
+_primary_only = ContextVar('shop_db_primary_only', default=False)
+
+
+def _sqlite(name):
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'OPTIONS': {
+            # seconds to wait for the write lock instead of failing with "database is locked";
+            # sqlite3 sets it as the busy timeout, so no PRAGMA busy_timeout overrides it
+            'timeout': 20,
+            # take the write lock at BEGIN so two writers never deadlock on a lock upgrade
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+
+
+def _server(engine, env, prefix='DB_'):
+    return {
+        'ENGINE': engine,
+        'NAME': env.get('DB_NAME', 'ecommerce'),
+        'USER': env.get('DB_USER', ''),
+        'PASSWORD': env.get('DB_PASSWORD', ''),
+        'HOST': env.get(prefix + 'HOST', ''),
+        'PORT': env.get(prefix + 'PORT', ''),
+        # persistent connections, re-validated before reuse after an idle period
+        'CONN_MAX_AGE': int(env.get('DB_CONN_MAX_AGE', 300)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+
+
+def database_profile(base_dir, env=os.environ):
+    profile = env.get('DB_PROFILE', 'sqlite')
+    if profile == 'sqlite':
+        databases = {'default': _sqlite(env.get('DB_NAME', base_dir / 'db.sqlite3'))}
+        if env.get('DB_REPLICA_NAME'):
+            databases['replica'] = _sqlite(env['DB_REPLICA_NAME'])
+    elif profile in SERVER_ENGINES:
+        databases = {'default': _server(SERVER_ENGINES[profile], env)}
+        if env.get('DB_REPLICA_HOST'):
+            databases['replica'] = _server(SERVER_ENGINES[profile], env, prefix='DB_REPLICA_')
+    else:
+        raise ValueError('Unknown DB_PROFILE %r' % profile)
+    if 'replica' in databases:
+        # tests run against a single database, the replica alias mirrors it
+        databases['replica']['TEST'] = {'MIRROR': 'default'}
+    return databases
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    # connection_created receiver, connected in ShopConfig.ready()
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in SQLITE_PRAGMAS:
+            cursor.execute('PRAGMA %s = %s' % (pragma, value))
+
+
+def check_databases():
+    # {'default': True, 'replica': False, ...}; a plain round trip on every alias
+    status = {}
+    for alias in connections:
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            status[alias] = True
+        except Exception:
+            status[alias] = False
+    return status
+
+
+def _sqlite_lag(primary, replica):
+    # A file replica is a copy made by sync_sqlite_replica: as fresh as the primary until the
+    # primary (or its WAL) is written again, and behind by the copy's age from then on.
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+    written = [t for t in (mtime(primary), mtime('%s-wal' % primary)) if t is not None]
+    copied = mtime(replica)
+    if copied is None:
+        return None
+    return 0.0 if not written or max(written) <= copied else time.time() - copied
+
+
+def replica_lag(alias='replica'):
+    # seconds the replica is behind the primary; None when that cannot be told
+    connection = connections[alias]
+    try:
+        if connection.vendor == 'sqlite':
+            return _sqlite_lag(connections['default'].settings_dict['NAME'], connection.settings_dict['NAME'])
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # an idle primary sends nothing to replay, so a replica that replayed all it received is current
+                cursor.execute(
+                    'SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+                    'THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+                lag = cursor.fetchone()[0]
+                return None if lag is None else float(lag)
+            if connection.vendor == 'mysql':
+                cursor.execute('SHOW REPLICA STATUS')
+                row = cursor.fetchone()
+                if row is None:
+                    return 0.0
+                lag = dict(zip([column[0] for column in cursor.description], row)).get('Seconds_Behind_Source')
+                return None if lag is None else float(lag)
+    except Exception:
+        return None
+    return None
+
+
+class PrimaryReplicaRouter:
+    def __init__(self):
+        # settings.py imports this module, so the settings are read once the router is created
+        self.max_lag = getattr(settings, 'SHOP_REPLICA_MAX_LAG', 5)
+        self.check_interval = getattr(settings, 'SHOP_REPLICA_LAG_CHECK_INTERVAL', 5)
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._fresh = False
+
+    def _replica_fresh(self):
+        # The lag is measured at most every check_interval seconds per process. The check is
+        # claimed under the lock, so concurrent readers keep the last answer meanwhile.
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return self._fresh
+            self._checked_at = now
+        lag = replica_lag()
+        self._fresh = lag is not None and lag <= self.max_lag
+        return self._fresh
+
+    def _replica(self):
+        if 'replica' not in connections.settings or _primary_only.get():
+            return 'default'
+        state = request_state.get()
+        if state is not None and (state['pinned'] or state['wrote']):
+            return 'default'
+        return 'replica' if self._replica_fresh() else 'default'
+
+    def db_for_read(self, model, **hints):
+        if (model._meta.app_label, model._meta.model_name) in REPLICA_READ_MODELS:
+            return self._replica()
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        state = request_state.get()
+        if state is not None:
+            # this request, and the next few from the same browser, read what it wrote
+            state['wrote'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+@contextmanager
+def primary_reads():
+    # Routes every read in the block to the primary: for results that outlive the request, such
+    # as rendered fragments in the shared cache, which must not be filled from a stale replica.
+    token = _primary_only.set(True)
+    try:
+        yield
+    finally:
+        _primary_only.reset(token)
+
+
+def bulk_upsert(model, objs, unique_fields, update_fields, batch_size=None):
+    # INSERT ... ON CONFLICT (unique_fields) DO UPDATE. MySQL's ON DUPLICATE KEY UPDATE takes no
+    # conflict target (any unique key triggers it) and Django rejects unique_fields there, so they
+    # are only passed to backends that support them.
+    features = connections[router.db_for_write(model)].features
+    kwargs = {'unique_fields': unique_fields} if features.supports_update_conflicts_with_target else {}
+    return model._default_manager.bulk_create(objs, batch_size=batch_size, update_conflicts=True,
+                                              update_fields=update_fields, **kwargs)
@@ -10,8 +10,13 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
+from .database import database_profile
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -41,28 +46,42 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # collected static files are answered before anything else runs (or is measured)
+    'Shop.middleware.StaticFilesMiddleware',
+    'Shop.middleware.PerformanceMiddleware',
+    'Shop.middleware.PrimaryReadsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'Shop.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'Shop.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'Ecommerce.urls'
 
+# 'production' compiles every template once per process (cached loader, restart to pick up
+# template edits); 'development' re-reads them from disk on each render.
+SHOP_TEMPLATE_PROFILE = os.environ.get('SHOP_TEMPLATE_PROFILE', 'development' if DEBUG else 'production')
+SHOP_TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+if SHOP_TEMPLATE_PROFILE == 'production':
+    SHOP_TEMPLATE_LOADERS = [('django.template.loaders.cached.Loader', SHOP_TEMPLATE_LOADERS)]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / "templates"],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            'loaders': SHOP_TEMPLATE_LOADERS,
         },
     },
 ]
@@ -73,12 +92,73 @@ WSGI_APPLICATION = 'Ecommerce.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Selected by DB_PROFILE (sqlite/postgres/mysql), see Ecommerce/database.py
+
+DATABASES = database_profile(BASE_DIR)
+
+# Product reads go to the 'replica' alias when one is configured and no more than
+# SHOP_REPLICA_MAX_LAG seconds behind (measured every SHOP_REPLICA_LAG_CHECK_INTERVAL seconds)
+DATABASE_ROUTERS = ['Ecommerce.database.PrimaryReplicaRouter']
+SHOP_REPLICA_MAX_LAG = 5
+SHOP_REPLICA_LAG_CHECK_INTERVAL = 5
+# after a write, that browser reads from the primary for this long, to see its own changes
+SHOP_REPLICA_PIN_SECONDS = 15
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Holds the versioned homepage catalog fragments (see Shop/catalog.py), cached_db sessions and
+# the users Shop.auth.CachedModelBackend loads. Set SHOP_CACHE_URL (redis://host:6379/0, needs the
+# redis package) once more than one worker process serves the site: a save only clears the cache
+# of the process it ran in, so the other processes see it only through a shared cache.
+SHOP_CACHE_URL = os.environ.get('SHOP_CACHE_URL', '')
+if SHOP_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': SHOP_CACHE_URL,
+        }
     }
-}
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'shop-default',
+        }
+    }
+# Without a shared cache, sessions and users are not cached and catalog entries only live for
+# Shop.catalog.LOCAL_CACHE_TIMEOUT seconds
+SHOP_SHARED_CACHE = bool(SHOP_CACHE_URL)
+
+
+# Request instrumentation (Shop.middleware.PerformanceMiddleware), read at /_metrics/
+SHOP_INSTRUMENTATION = True
+# fraction of requests run under cProfile; the slowest SHOP_PROFILE_KEEP are kept at /_metrics/slow/
+SHOP_PROFILE_SAMPLE_RATE = 0.0
+SHOP_PROFILE_KEEP = 10
+# coroutine catalog and cart views (Shop/async_views.py); asgi.py switches them on
+SHOP_ASYNC_VIEWS = os.environ.get('SHOP_ASYNC_VIEWS', '0') == '1'
+
+
+# Where sessions live: 'cached_db' reads from the cache and writes through to django_session,
+# 'signed_cookies' keeps them client-side with no server storage, 'db' is Django's default.
+# cached_db needs the shared cache: in a per-process one, a logout in one worker leaves the
+# session alive in the others. Expired rows are removed with `manage.py purge_sessions`.
+SHOP_SESSION_MODE = os.environ.get('SHOP_SESSION_MODE', 'cached_db' if SHOP_SHARED_CACHE else 'db')
+if SHOP_SESSION_MODE == 'cached_db' and not SHOP_SHARED_CACHE:
+    raise ImproperlyConfigured('SHOP_SESSION_MODE=cached_db needs a shared cache, set SHOP_CACHE_URL')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[SHOP_SESSION_MODE]
+
+# request.user is loaded from the shared cache when there is one (SHOP_SHARED_CACHE), from the
+# database otherwise. ModelBackend stays listed so sessions created before the switch remain valid.
+AUTHENTICATION_BACKENDS = [
+    'Shop.auth.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
 
 
 # Password validation
@@ -116,11 +196,21 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+# `manage.py collectstatic` output: Shop CSS/JS bundles, content-hashed names and .gz/.br copies,
+# served by Shop.middleware.StaticFilesMiddleware (hashed names cached for a year)
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'Shop.staticfiles.CompressedManifestStaticFilesStorage'},
+}
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR/'media'
 LOGIN_REDIRECT_URL='/profile/'
+# On-disk product search index (see Shop/search.py), rebuilt with `manage.py rebuild_search_index`
+SEARCH_INDEX_PATH = BASE_DIR / 'search_index.pickle'
 #EMAIL_BACKEND='django.core.mail.backends.console.EmailBackend' #for console email testing
-EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend'
+# EMAIL_BACKEND=django.core.mail.backends.locmem.EmailBackend in tests; mail is sent by the run_tasks worker
+EMAIL_BACKEND=os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST='smtp.gmail.com'
 EMAIL_USE_TLS = True
 
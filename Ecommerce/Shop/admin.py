@@ -1,16 +1,181 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.core.exceptions import ValidationError
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Now, Round, Substr
+
+from . import inventory
+from .catalog import invalidate_products
 from .models import (
      Customer,
+    PricingRule,
     Product,
-
+    ProductStock,
+    RecommendationRun,
+    Task,
 )
+from .pricing import reprice
+from .paginator import EstimatedCountPaginator
  
 # Register your models here.
 
 @admin.register(Customer)
 class CustomerModelAdmin(admin.ModelAdmin):
     list_display =['id', 'user', 'name', 'division','district','thana','villorroad','zipcode']
+    list_select_related =['user']
+    list_filter =['division']
+    search_fields =['name', 'user__username', '=zipcode']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class ProductActionForm(ActionForm):
+    percent = forms.DecimalField(required=False, max_digits=5, decimal_places=2, label='Percent',
+                                 help_text='For the price actions, e.g. 10 or -5')
+    units = forms.IntegerField(required=False, min_value=0, label='Units', help_text='For the stock actions')
+    shards = forms.IntegerField(required=False, min_value=1, max_value=64, label='Shards',
+                                help_text='Rows a hot product\'s stock is spread over')
+
+
+def _action_value(modeladmin, request, name):
+    # only the one field; the admin fills in the action choices itself
+    try:
+        value = ProductActionForm.base_fields[name].clean(request.POST.get(name))
+    except ValidationError:
+        value = None
+    if value is None:
+        modeladmin.message_user(request, 'Enter %s for this action.' % name, messages.ERROR)
+    return value
+
+
+def _percent(modeladmin, request):
+    return _action_value(modeladmin, request, 'percent')
+
 
 @admin.register(Product)
 class ProductModelAdmin(admin.ModelAdmin):
-    list_display =['id', 'title','selling_price','discounted_price','description','brand','category','product_image']
\ No newline at end of file
+    list_display =['id', 'sku', 'title','selling_price','discounted_price','effective_price','stock_units','description_excerpt','brand','category','product_image']
+    list_filter =['category', 'brand']
+    search_fields =['=sku', 'title', 'brand']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    action_form = ProductActionForm
+    actions = ['change_prices', 'set_discount', 'add_stock', 'set_stock', 'shard_stock', 'stop_tracking_stock']
+
+    def get_queryset(self, request):
+        # the changelist only shows the first characters of the description, and the stock as one
+        # correlated subquery per listed row
+        queryset = super().get_queryset(request)
+        units = (ProductStock.objects.filter(product=OuterRef('pk')).order_by()
+                 .values('product').annotate(units=Sum('units')).values('units'))
+        return queryset.defer('description').annotate(description_preview=Substr('description', 1, 80),
+                                                      stock_total=Subquery(units))
+
+    @admin.display(description='Stock')
+    def stock_units(self, obj):
+        # blank: not tracked, always purchasable
+        return getattr(obj, 'stock_total', None)
+
+    @admin.display(description='Description')
+    def description_excerpt(self, obj):
+        preview = getattr(obj, 'description_preview', None)
+        if preview is None:
+            preview = obj.description[:80]
+        return preview + '…' if len(preview) == 80 else preview
+
+    # Both actions are one UPDATE over the selection (or every match when "select all" is used),
+    # plus one more that reprices the changed rows
+    @admin.action(description='Change selling and discounted prices by percent')
+    def change_prices(self, request, queryset):
+        percent = _percent(self, request)
+        if percent is None:
+            return
+        factor = 1 + percent / 100
+        if factor < 0:
+            self.message_user(request, 'Prices cannot go below zero.', messages.ERROR)
+            return
+        updated = queryset.order_by().update(selling_price=Round(F('selling_price') * factor, 2),
+                                             discounted_price=Round(F('discounted_price') * factor, 2),
+                                             updated_at=Now())
+        reprice(queryset)
+        invalidate_products()
+        self.message_user(request, 'Changed prices of %d products by %s%%.' % (updated, percent))
+
+    @admin.action(description='Set discounted price to percent off the selling price')
+    def set_discount(self, request, queryset):
+        percent = _percent(self, request)
+        if percent is None:
+            return
+        if not 0 <= percent <= 100:
+            self.message_user(request, 'The discount must be between 0 and 100 percent.', messages.ERROR)
+            return
+        updated = queryset.order_by().update(
+            discounted_price=Round(F('selling_price') * (1 - percent / 100), 2), updated_at=Now())
+        reprice(queryset)
+        invalidate_products()
+        self.message_user(request, 'Set a %s%% discount on %d products.' % (percent, updated))
+
+    # The stock actions go through Shop.inventory product by product; adding is an increment,
+    # so it is safe while customers are reserving
+    @admin.action(description='Add units to stock (starts tracking)')
+    def add_stock(self, request, queryset):
+        units = _action_value(self, request, 'units')
+        if units is None:
+            return
+        pks = list(queryset.values_list('pk', flat=True))
+        for pk in pks:
+            inventory.add_stock(pk, units)
+        self.message_user(request, 'Added %d units to %d products.' % (units, len(pks)))
+
+    @admin.action(description='Set stock to units (overwrites, units in carts stay held)')
+    def set_stock(self, request, queryset):
+        units = _action_value(self, request, 'units')
+        if units is None:
+            return
+        pks = list(queryset.values_list('pk', flat=True))
+        for pk in pks:
+            inventory.set_stock(pk, units)
+        self.message_user(request, 'Set the stock of %d products to %d.' % (len(pks), units))
+
+    @admin.action(description='Spread stock over shards (hot products)')
+    def shard_stock(self, request, queryset):
+        shards = _action_value(self, request, 'shards')
+        if shards is None:
+            return
+        sharded = sum(inventory.reshard(pk, shards) for pk in queryset.values_list('pk', flat=True))
+        self.message_user(request, 'Spread the stock of %d tracked products over %d shards.' % (sharded, shards))
+
+    @admin.action(description='Stop tracking stock')
+    def stop_tracking_stock(self, request, queryset):
+        deleted, _ = ProductStock.objects.filter(product__in=queryset.order_by().values('pk')).delete()
+        self.message_user(request, 'Stopped tracking stock (%d rows removed).' % deleted)
+
+
+@admin.register(PricingRule)
+class PricingRuleModelAdmin(admin.ModelAdmin):
+    # saving or deleting a rule reprices the catalog in one UPDATE (Shop.signals)
+    list_display =['id', 'name', 'kind', 'category', 'percent', 'min_subtotal', 'active']
+    list_filter =['kind', 'active']
+    list_editable =['active']
+
+
+@admin.register(Task)
+class TaskModelAdmin(admin.ModelAdmin):
+    list_display =['id', 'name', 'status', 'attempts', 'max_attempts', 'run_after', 'created_at', 'finished_at']
+    list_filter =['status', 'name']
+    readonly_fields =['claim', 'claimed_at', 'created_at', 'finished_at']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(RecommendationRun)
+class RecommendationRunModelAdmin(admin.ModelAdmin):
+    # written by `manage.py build_recommendations`; shown to check the job keeps up with new orders
+    list_display =['id', 'started_at', 'finished_at', 'last_order_id', 'orders', 'pairs']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Shop'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from Ecommerce.database import apply_sqlite_pragmas
+
+        from . import signals, tasks  # noqa: F401
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='shop-sqlite-pragmas')
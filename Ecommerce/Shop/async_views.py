@@ -0,0 +1,74 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
+from django.views import View
+from django.views.decorators.http import require_POST
+
+from . import cart
+from .catalog import ahomepage_fragments, aproduct_page
+from .inventory import OutOfStock
+from .views import (cart_product_id, category_query, detail_cache_headers, detail_validators, lehenga_query,
+                    listing_context, not_modified, render_detail)
+
+# Coroutine versions of the catalog pages and cart endpoints, wired in by Shop/urls.py when
+# SHOP_ASYNC_VIEWS is on (Ecommerce/asgi.py turns it on). Data is fetched with the async ORM and
+# cache; the page itself is rendered through sync_to_async because base.html reads the lazy
+# request.user, the session and messages, which are only safe to touch from sync code.
+arender = sync_to_async(render)
+
+
+class ProductView(View):
+    async def get(self, request):
+        sliders = await ahomepage_fragments()
+        return await arender(request, 'Shop/home.html', {'sliders': sliders})
+
+
+class ProductDetail(View):
+    async def get(self, request, pk):
+        page = await aproduct_page(pk)
+        if page is None:
+            raise Http404('No such product')
+        user = await request.auser()
+        etag, last_modified = detail_validators(page, user, request)
+        response = await sync_to_async(not_modified)(request, etag, last_modified)
+        if response is None:
+            response = await sync_to_async(render_detail)(request, page, pk, etag, last_modified)
+        return detail_cache_headers(response)
+
+
+async def render_listing(request, query):
+    # the page and the facet counts are independent queries
+    (products, next_cursor), facets = await asyncio.gather(query.aproducts(), query.afacets())
+    return await arender(request, 'Shop/category.html', listing_context(query, products, next_cursor, facets))
+
+
+async def category_listing(request, slug):
+    return await render_listing(request, category_query(slug, request.GET))
+
+
+async def lehenga(request, data=None):
+    return await render_listing(request, lehenga_query(data, request.GET))
+
+
+def cart_update(action):
+    @require_POST
+    async def view(request):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({'error': 'login required'}, status=401)
+        product_id = cart_product_id(request)
+        if product_id is None:
+            return JsonResponse({'error': 'prod_id is required'}, status=400)
+        try:
+            await action(user, product_id)
+        except OutOfStock:
+            return JsonResponse(dict(await cart.asummary(user, product_id), error='Out of stock'), status=409)
+        return JsonResponse(await cart.asummary(user, product_id))
+    return view
+
+
+plus_cart = cart_update(cart.aincrement)
+minus_cart = cart_update(cart.adecrement)
+remove_cart = cart_update(cart.aremove)
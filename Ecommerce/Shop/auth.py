@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+# shop.signals drops the entry whenever the user row is saved or deleted
+USER_CACHE_TIMEOUT = getattr(settings, 'SHOP_USER_CACHE_TIMEOUT', 300)
+
+
+def user_cache_key(user_id):
+    return 'shop:user:%s' % user_id
+
+
+def invalidate_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    # ModelBackend whose get_user (run once per request by AuthenticationMiddleware's lazy
+    # request.user) is answered from the cache instead of an auth_user query. Users changed with
+    # QuerySet.update() skip the signal and stay cached until the timeout. With a per-process
+    # cache the signal could not reach the other processes, so nothing is cached there.
+
+    def get_user(self, user_id):
+        if not getattr(settings, 'SHOP_SHARED_CACHE', False):
+            return super().get_user(user_id)
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, USER_CACHE_TIMEOUT)
+        return user
+
+    async def aget_user(self, user_id):
+        if not getattr(settings, 'SHOP_SHARED_CACHE', False):
+            return await super().aget_user(user_id)
+        key = user_cache_key(user_id)
+        user = await cache.aget(key)
+        if user is None:
+            user = await super().aget_user(user_id)
+            if user is not None:
+                await cache.aset(key, user, USER_CACHE_TIMEOUT)
+        return user
@@ -0,0 +1,352 @@
+import asyncio
+import io
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+from http.cookies import SimpleCookie
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from django.utils.text import slugify
+
+from . import search
+from .catalog import invalidate_products
+from .models import CATEGORY_CHOICES, DIVISION_CHOICES, Cart, Customer, OrderPlaced, Product, STATUS_CHOICE
+from .pricing import effective_price, load_rules
+
+WORDS = ('red silk bridal lehenga saree cotton denim pant borkha baby floral embroidered georgette chiffon '
+         'party wear wedding festive zari net velvet katan jamdani muslin linen slim fit stretch casual '
+         'abaya hijab kids romper frock printed handloom tant half sleeve designer').split()
+BRANDS = ('ponnoala', 'pakija', 'Easy', 'Denim', 'Aarong', 'Yellow', 'Kay Kraft', 'Anjans', 'Sailor', 'Rang')
+BENCH_PASSWORD = 'bench-pass-123'
+
+
+def percentile(sorted_values, p):
+    # nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(samples_ms):
+    values = sorted(samples_ms)
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values), 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'max_ms': round(values[-1], 3) if values else 0.0,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _images():
+    folder = os.path.join(settings.MEDIA_ROOT, 'productimg')
+    try:
+        names = sorted(os.listdir(folder))
+    except FileNotFoundError:
+        names = []
+    return ['productimg/' + name for name in names] or ['productimg/placeholder.jpg']
+
+
+def seed(products=10000, users=100, carts=500, orders=2000, batch_size=5000, seed_value=0, index=True, log=None):
+    # Synthetic catalog, users, carts and orders inserted with bulk_create in fixed-size batches,
+    # so memory stays flat even for a million products. Returns the number of rows created per model.
+    rng = random.Random(seed_value)
+    categories = [code for code, _ in CATEGORY_CHOICES]
+    images = _images()
+    log = log or (lambda message: None)
+
+    rules = load_rules()
+
+    def product_rows():
+        for i in range(products):
+            price = rng.randrange(300, 15000, 50)
+            discounted = price - rng.randrange(0, price // 3 + 1, 10)
+            category = rng.choice(categories)
+            yield Product(
+                title=' '.join(rng.sample(WORDS, 3)).title(),
+                selling_price=price,
+                discounted_price=discounted,
+                effective_price=effective_price(category, discounted, rules),
+                description=' '.join(rng.choices(WORDS, k=25)),
+                brand=rng.choice(BRANDS),
+                category=category,
+                product_image=images[i % len(images)],
+            )
+
+    created = {'products': 0, 'users': 0, 'customers': 0, 'carts': 0, 'orders': 0}
+    for batch in _batched(product_rows(), batch_size):
+        Product.objects.bulk_create(batch, batch_size=batch_size)
+        created['products'] += len(batch)
+        log('products: %d' % created['products'])
+
+    # hashing once keeps seeding fast, every bench user shares the password
+    password = make_password(BENCH_PASSWORD)
+    prefix = 'bench%d_' % int(time.time())
+    User.objects.bulk_create([User(username='%s%d' % (prefix, i), email='%s%d@example.com' % (prefix, i),
+                                   password=password) for i in range(users)], batch_size=batch_size)
+    user_ids = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+    created['users'] = len(user_ids)
+    divisions = [code for code, _ in DIVISION_CHOICES]
+    Customer.objects.bulk_create([
+        Customer(user_id=uid, name='Customer %d' % uid, division=rng.choice(divisions), district='Dhaka',
+                 thana='Dhanmondi', villorroad='Road %d' % rng.randint(1, 30), zipcode=1205)
+        for uid in user_ids], batch_size=batch_size)
+    customers = dict(Customer.objects.filter(user_id__in=user_ids).values_list('user_id', 'id'))
+    created['customers'] = len(customers)
+
+    product_ids = Product.objects.order_by('-id').values_list('id', flat=True)[:max(products, 1)]
+    product_ids = list(product_ids)
+    if user_ids and product_ids:
+        pairs = {(rng.choice(user_ids), rng.choice(product_ids)) for _ in range(carts)}
+        Cart.objects.bulk_create([Cart(user_id=u, product_id=p, quantity=rng.randint(1, 3)) for u, p in pairs],
+                                 batch_size=batch_size, ignore_conflicts=True)
+        created['carts'] = len(pairs)
+
+        statuses = [value for value, _ in STATUS_CHOICE]
+
+        def order_rows():
+            for _ in range(orders):
+                uid = rng.choice(user_ids)
+                yield OrderPlaced(user_id=uid, customer_id=customers[uid], product_id=rng.choice(product_ids),
+                                  quantity=rng.randint(1, 3), status=rng.choice(statuses))
+
+        for batch in _batched(order_rows(), batch_size):
+            OrderPlaced.objects.bulk_create(batch, batch_size=batch_size)
+            created['orders'] += len(batch)
+
+    # bulk_create skips the model signals that keep these derived structures fresh
+    invalidate_products()
+    if index:
+        search.store.replace(search.build_index())
+    return created
+
+
+# name, method, url name, url args, query string / POST data, client, query budget. The client is
+# True (logged in), False (anonymous, no cookies) or 'returning' (anonymous with a session cookie).
+# The budget is the most queries one warm request may issue with cached_db or signed-cookie sessions
+# and the cached user backend; bench_views fails when it is exceeded. Seeded products are not
+# stock-tracked, so cart changes pay only the stock (or hold) read of Shop.inventory.
+def view_scenarios(product):
+    slug = slugify(dict(CATEGORY_CHOICES)[product.category])
+    return [
+        ('home', 'get', 'home', (), None, False, 0),
+        ('home-returning', 'get', 'home', (), None, 'returning', 0),
+        ('home-logged-in', 'get', 'home', (), None, True, 0),
+        ('product-detail', 'get', 'product-detail', (product.id,), None, False, 0),
+        ('product-detail-returning', 'get', 'product-detail', (product.id,), None, 'returning', 0),
+        ('category', 'get', 'category', (slug,), None, False, 2),
+        ('category-filtered', 'get', 'category', (slug,), {'brand': product.brand, 'sort': 'price-asc'}, False, 2),
+        ('lehenga', 'get', 'lehenga', (), None, False, 2),
+        ('lehengaitem', 'get', 'lehengaitem', ('below',), None, False, 2),
+        ('search', 'get', 'search', (), {'q': product.title.split()[0]}, False, 1),
+        ('search-autocomplete', 'get', 'search-autocomplete', (), {'q': product.title[:3]}, False, 0),
+        ('add-to-cart', 'post', 'add-to-cart', (), {'prod_id': product.id}, True, 3),
+        ('showcart', 'get', 'showcart', (), None, True, 2),
+        ('pluscart', 'post', 'pluscart', (), {'prod_id': product.id}, True, 3),
+        ('minuscart', 'post', 'minuscart', (), {'prod_id': product.id}, True, 3),
+        ('checkout', 'get', 'checkout', (), None, True, 3),
+        ('orders', 'get', 'orders', (), None, True, 2),
+        ('profile', 'get', 'profile', (), None, True, 0),
+        ('address', 'get', 'address', (), None, True, 1),
+        ('customerregistration', 'get', 'customerregistration', (), None, False, 0),
+        ('login', 'get', 'login', (), None, False, 0),
+        ('passwordchange', 'get', 'passwordchange', (), None, True, 0),
+        ('password_reset', 'get', 'password_reset', (), None, False, 0),
+        ('health', 'get', 'health', (), None, False, 2),
+    ]
+
+
+def budget_allowance(client):
+    # Queries the budgets above leave out for this kind of client: the django_session read of
+    # plain database sessions, and the auth_user read when there is no shared cache for users.
+    extra = 0
+    if client:
+        extra += int(settings.SESSION_ENGINE == 'django.contrib.sessions.backends.db')
+    if client is True:
+        extra += int(not getattr(settings, 'SHOP_SHARED_CACHE', False))
+    return extra
+
+
+def returning_visitor():
+    # anonymous test client carrying a session cookie from an earlier visit
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session['returning'] = True
+    session.save()
+    client = Client()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+    return client
+
+
+def client_settings():
+    # the test client's host, and no real mail sent by the password reset scenario
+    return override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver'],
+                             EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+
+
+@contextmanager
+def isolated_database(verbosity=0, on_disk=False):
+    # Runs the block against throwaway test databases and search index, like `manage.py test`.
+    # on_disk puts SQLite test databases in files, so concurrent writers lock like in production
+    # instead of failing on the shared-cache in-memory database.
+    index_dir = tempfile.mkdtemp(prefix='shop-bench-')
+    test_names = {}
+    if on_disk:
+        for alias in connections:
+            test = connections[alias].settings_dict['TEST']
+            if connections[alias].vendor == 'sqlite' and not test.get('MIRROR'):
+                test_names[alias] = test.get('NAME')
+                test['NAME'] = os.path.join(index_dir, '%s.sqlite3' % alias)
+    old_config = setup_databases(verbosity=verbosity, interactive=False)
+    previous_store = search.store
+    search.store = search.IndexStore(os.path.join(index_dir, 'search_index.pickle'))
+    try:
+        yield
+    finally:
+        search.store = previous_store
+        teardown_databases(old_config, verbosity=verbosity)
+        for alias, name in test_names.items():
+            connections[alias].settings_dict['TEST']['NAME'] = name
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+
+def load_report(latencies, errors, duration, **extra):
+    # latencies: {path: [ms, ...]}, errors: {path: count}; the JSON layout shared by the load drivers
+    everything = [ms for samples in latencies.values() for ms in samples]
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+    report.update(extra)
+    report.update({
+        'requests': len(everything),
+        'errors': sum(errors.values()),
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(len(everything) / duration, 2) if duration else 0.0,
+        'latency': latency_summary(everything),
+        'paths': {path: dict(latency_summary(samples), errors=errors[path])
+                  for path, samples in latencies.items()},
+    })
+    return report
+
+
+def _request_parts(url, cookie, method):
+    # (path, query string, body, extra headers); a POST sends the query as form data with the
+    # csrftoken from its cookie in X-CSRFToken, as myscript.js does for the cart endpoints
+    path, _, query = url.partition('?')
+    if method == 'GET':
+        return path, query, b'', []
+    token = SimpleCookie(cookie).get(settings.CSRF_COOKIE_NAME)
+    headers = [('content-type', 'application/x-www-form-urlencoded')]
+    if token:
+        headers.append(('x-csrftoken', token.value))
+    return path, '', query.encode(), headers
+
+
+async def asgi_get(application, url, cookie='', method='GET'):
+    # one request through an ASGI application the way an ASGI server (uvicorn, daphne) calls it; returns the status
+    path, query, body, extra = _request_parts(url, cookie, method)
+    headers = [(b'host', b'testserver')] + [(name.encode(), value.encode()) for name, value in extra]
+    if cookie:
+        headers.append((b'cookie', cookie.encode()))
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': headers, 'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    }
+    pending = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = []
+
+    async def receive():
+        if pending:
+            return pending.pop()
+        # the client never disconnects; Django cancels this wait once the response is sent
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0] if status else 0
+
+
+def wsgi_get(application, url, cookie='', method='GET'):
+    # one request through a WSGI application the way a threaded WSGI server calls it; returns the status
+    path, query, body, extra = _request_parts(url, cookie, method)
+    environ = {
+        'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'testserver',
+        'REMOTE_ADDR': '127.0.0.1', 'wsgi.input': io.BytesIO(body), 'wsgi.errors': io.StringIO(),
+        'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0), 'wsgi.multithread': True,
+        'wsgi.multiprocess': False, 'wsgi.run_once': False, 'CONTENT_LENGTH': str(len(body)),
+    }
+    for name, value in extra:
+        key = name.upper().replace('-', '_')
+        environ[key if key == 'CONTENT_TYPE' else 'HTTP_' + key] = value
+    if cookie:
+        environ['HTTP_COOKIE'] = cookie
+    status = []
+
+    def start_response(status_line, headers, exc_info=None):
+        status.append(int(status_line.split()[0]))
+
+    body = application(environ, start_response)
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return status[0] if status else 0
+
+
+class QueryCounter:
+    # counts queries on every database alias while active
+    def __init__(self):
+        self.count = 0
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.count = 0
+        self._stack = ExitStack()
+        for conn in connections.all():
+            self._stack.enter_context(conn.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
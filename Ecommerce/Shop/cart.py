@@ -0,0 +1,97 @@
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from . import inventory
+from .models import Cart
+from .pricing import ZERO, aactive_rules, active_rules, cart_discount, money
+
+# flat delivery charge added to a non-empty cart
+SHIPPING_CHARGE = Decimal('70.00')
+
+
+def _line(user, product_id):
+    return Cart.objects.filter(user=user, product_id=product_id)
+
+
+# Every unit added to a cart is reserved in Shop.inventory first (raising inventory.OutOfStock),
+# every unit taken out is given back afterwards. No transaction spans both: a hold stranded by a
+# failure in between expires and goes back to stock, and a product whose stock is not tracked
+# only costs one extra read.
+
+def add_item(user, product_id):
+    # single UPDATE when the line exists, INSERT otherwise; the (user, product)
+    # constraint turns a racing duplicate insert into an increment
+    inventory.reserve(user, product_id)
+    if _line(user, product_id).update(quantity=F('quantity') + 1):
+        return
+    try:
+        with transaction.atomic():
+            Cart.objects.create(user=user, product_id=product_id)
+    except IntegrityError:
+        _line(user, product_id).update(quantity=F('quantity') + 1)
+
+
+def increment(user, product_id):
+    held = inventory.reserve(user, product_id)
+    updated = _line(user, product_id).update(quantity=F('quantity') + 1)
+    if held and not updated:
+        inventory.release(user, product_id, held)
+    return updated
+
+
+def decrement(user, product_id):
+    # never below one, removing a line is an explicit action
+    updated = _line(user, product_id).filter(quantity__gt=1).update(quantity=F('quantity') - 1)
+    if updated:
+        inventory.release(user, product_id, 1)
+    return updated
+
+
+def remove(user, product_id):
+    deleted = _line(user, product_id).delete()[0]
+    if deleted:
+        inventory.release(user, product_id)
+    return deleted
+
+
+# reservations run in a transaction, which the async ORM has no API for
+aincrement = sync_to_async(increment)
+adecrement = sync_to_async(decrement)
+aremove = sync_to_async(remove)
+
+
+def _totals(product_id):
+    # every line priced in the same aggregate, at the precomputed effective price
+    return {
+        'amount': Sum(F('quantity') * F('product__effective_price')),
+        'quantity': Sum('quantity', filter=Q(product_id=product_id)),
+        'lines': Count('id'),
+    }
+
+
+def _summary(totals, rules):
+    # SQLite sums decimals as floats, back to cents here
+    amount = money(totals['amount'] or ZERO)
+    discount, promotion = cart_discount(amount, rules)
+    shipping = SHIPPING_CHARGE if totals['lines'] else ZERO
+    return {
+        'quantity': totals['quantity'] or 0,
+        'amount': amount,
+        'discount': discount,
+        'promotion': promotion,
+        'shipping': shipping,
+        'totalamount': amount - discount + shipping,
+        'lines': totals['lines'],
+    }
+
+
+def summary(user, product_id=None):
+    # cart totals and the quantity of one line in a single aggregate query
+    return _summary(Cart.objects.filter(user=user).aggregate(**_totals(product_id)), active_rules())
+
+
+async def asummary(user, product_id=None):
+    return _summary(await Cart.objects.filter(user=user).aaggregate(**_totals(product_id)), await aactive_rules())
@@ -0,0 +1,234 @@
+import asyncio
+import hashlib
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.urls import get_script_prefix, reverse
+
+from Ecommerce.database import primary_reads
+
+from .models import CoPurchase, Product, ProductRecommendations
+
+# Homepage sliders, in the order they appear on home.html
+HOMEPAGE_CATEGORIES = ('GP', 'S', 'BK', 'L', 'BF')
+# Only the columns the carousel cards actually use
+CARD_FIELDS = ('id', 'title', 'effective_price', 'product_image', 'image_digest', 'image_width', 'category')
+
+CATALOG_VERSION_KEY = 'shop:catalog:version'
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+# Product detail fragments; bumping the epoch drops every page at once after bulk updates
+PRODUCT_PAGES_EPOCH_KEY = 'shop:product-pages:epoch'
+PRODUCT_PAGE_TIMEOUT = 60 * 60 * 24
+# how long an unknown pk is answered from cache with a 404
+MISSING_PRODUCT_TIMEOUT = 60 * 5
+# Without a shared cache (SHOP_SHARED_CACHE) the signals only clear the copy of the process that
+# saved, so entries are kept no longer than this and the other processes catch up within it
+LOCAL_CACHE_TIMEOUT = 60
+
+
+# stands in for the pk when the product-detail URL is reversed once
+_PK_MARKER = '2147480011'
+
+
+@lru_cache(maxsize=8)
+def _product_url_template(script_prefix):
+    return reverse('product-detail', args=[_PK_MARKER])
+
+
+def product_url(pk):
+    # the product-detail URL with one string replace instead of a reverse() per card
+    return _product_url_template(get_script_prefix()).replace(_PK_MARKER, str(pk), 1)
+
+
+def _timeout(seconds):
+    return seconds if getattr(settings, 'SHOP_SHARED_CACHE', False) else min(seconds, LOCAL_CACHE_TIMEOUT)
+
+
+def _stamp(key):
+    stamp = cache.get(key)
+    if stamp is None:
+        # a fresh stamp (not 1) so entries left over from before an eviction are never reused
+        cache.add(key, time.time_ns(), None)
+        stamp = cache.get(key)
+    return stamp
+
+
+async def _astamp(key):
+    stamp = await cache.aget(key)
+    if stamp is None:
+        await cache.aadd(key, time.time_ns(), None)
+        stamp = await cache.aget(key)
+    return stamp
+
+
+def catalog_version():
+    return _stamp(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    cache.set(CATALOG_VERSION_KEY, time.time_ns(), None)
+
+
+def _page_key(pk):
+    return 'shop:product:%s:page' % pk
+
+
+def _missing_key(pk):
+    return 'shop:product:%s:missing' % pk
+
+
+def invalidate_products(pks=None):
+    # call after products change; pks=None when a bulk UPDATE may have touched any of them
+    bump_catalog_version()
+    if pks is None:
+        cache.set(PRODUCT_PAGES_EPOCH_KEY, time.time_ns(), None)
+    else:
+        invalidate_product_pages(pks)
+
+
+def invalidate_product_pages(pks):
+    # only the detail pages, for changes that do not show on the homepage cards
+    cache.delete_many([_page_key(pk) for pk in pks] + [_missing_key(pk) for pk in pks])
+
+
+def pages_listing(pk):
+    # Products whose "customers also bought" strip shows pk, so their cached pages go when pk
+    # changes. Pairs are counted both ways, so pk's own partners (an index range) are the only
+    # candidates; those whose top-k kept pk are picked in Python.
+    partners = CoPurchase.objects.filter(product_id=pk).values('other_id')
+    rows = ProductRecommendations.objects.filter(product_id__in=partners).values_list('product_id', 'items')
+    return [product_id for product_id, items in rows if pk in items]
+
+
+def _also_bought_cards(ids, cards):
+    return [cards[pk] for pk in ids if pk in cards]
+
+
+def also_bought(pk):
+    # ("customers also bought" cards in ranked order, when they were computed); a primary key
+    # lookup of the precomputed row plus one query for the cards, only on a cold product page
+    row = ProductRecommendations.objects.filter(product_id=pk).values_list('items', 'updated_at').first()
+    if not row or not row[0]:
+        return [], None
+    cards = Product.objects.only(*CARD_FIELDS).in_bulk(row[0])
+    return _also_bought_cards(row[0], cards), row[1]
+
+
+async def aalso_bought(pk):
+    row = await ProductRecommendations.objects.filter(product_id=pk).values_list('items', 'updated_at').afirst()
+    if not row or not row[0]:
+        return [], None
+    cards = await Product.objects.only(*CARD_FIELDS).ain_bulk(row[0])
+    return _also_bought_cards(row[0], cards), row[1]
+
+
+def _page_entry(product, epoch, recommended=([], None)):
+    html = render_to_string('Shop/product_info.html', {'product': product})
+    cards, recommended_at = recommended
+    strip = render_to_string('Shop/also_bought.html', {'products': cards}) if cards else ''
+    last_modified = max(filter(None, (product.updated_at, recommended_at)))
+    return {
+        'epoch': epoch,
+        'html': html,
+        'also_bought': strip,
+        'etag': hashlib.md5((html + strip).encode(), usedforsecurity=False).hexdigest()[:20],
+        'last_modified': last_modified.timestamp(),
+    }
+
+
+def product_page(pk):
+    # Rendered product fragment with its ETag and Last-Modified, or None for a missing pk.
+    # Warm entries and known-missing pks are answered without touching the database.
+    key, missing_key = _page_key(pk), _missing_key(pk)
+    cached = cache.get_many([key, missing_key, PRODUCT_PAGES_EPOCH_KEY])
+    if missing_key in cached:
+        return None
+    epoch = cached.get(PRODUCT_PAGES_EPOCH_KEY) or _stamp(PRODUCT_PAGES_EPOCH_KEY)
+    entry = cached.get(key)
+    if entry is not None and entry['epoch'] == epoch:
+        return entry
+
+    # the entry outlives this request, so it is never filled from a lagging replica
+    with primary_reads():
+        product = Product.objects.filter(pk=pk).first()
+        if product is None:
+            cache.set(missing_key, True, _timeout(MISSING_PRODUCT_TIMEOUT))
+            return None
+        entry = _page_entry(product, epoch, also_bought(pk))
+    cache.set(key, entry, _timeout(PRODUCT_PAGE_TIMEOUT))
+    return entry
+
+
+async def aproduct_page(pk):
+    key, missing_key = _page_key(pk), _missing_key(pk)
+    cached = await cache.aget_many([key, missing_key, PRODUCT_PAGES_EPOCH_KEY])
+    if missing_key in cached:
+        return None
+    epoch = cached.get(PRODUCT_PAGES_EPOCH_KEY) or await _astamp(PRODUCT_PAGES_EPOCH_KEY)
+    entry = cached.get(key)
+    if entry is not None and entry['epoch'] == epoch:
+        return entry
+
+    with primary_reads():
+        product = await Product.objects.filter(pk=pk).afirst()
+        if product is None:
+            await cache.aset(missing_key, True, _timeout(MISSING_PRODUCT_TIMEOUT))
+            return None
+        entry = _page_entry(product, epoch, await aalso_bought(pk))
+    await cache.aset(key, entry, _timeout(PRODUCT_PAGE_TIMEOUT))
+    return entry
+
+
+def _fragment_keys(version):
+    return {code: 'shop:home:%s:%s' % (version, code) for code in HOMEPAGE_CATEGORIES}
+
+
+def _render_sliders(grouped):
+    return {code: render_to_string('Shop/product_slider.html', {'products': products})
+            for code, products in grouped.items()}
+
+
+# Rendered slider items per category code; a warm cache never touches the database
+def homepage_fragments():
+    keys = _fragment_keys(catalog_version())
+    cached = cache.get_many(keys.values())
+    fragments = {code: cached[key] for code, key in keys.items() if key in cached}
+
+    missing = [code for code in HOMEPAGE_CATEGORIES if code not in fragments]
+    if missing:
+        grouped = {code: [] for code in missing}
+        with primary_reads():
+            products = list(Product.objects.filter(category__in=missing)
+                            .only(*CARD_FIELDS).order_by('category', 'id'))
+        for product in products:
+            grouped[product.category].append(product)
+        rendered = _render_sliders(grouped)
+        cache.set_many({keys[code]: html for code, html in rendered.items()}, _timeout(FRAGMENT_TIMEOUT))
+        fragments.update(rendered)
+    return fragments
+
+
+async def _slider_products(code):
+    return [product async for product in Product.objects.filter(category=code).only(*CARD_FIELDS).order_by('id')]
+
+
+async def ahomepage_fragments():
+    # Same fragments and keys as homepage_fragments(). The missing categories are fetched as
+    # concurrent per-category queries instead of one grouped query; the async ORM still runs
+    # them one after another on the request's worker thread.
+    keys = _fragment_keys(await _astamp(CATALOG_VERSION_KEY))
+    cached = await cache.aget_many(keys.values())
+    fragments = {code: cached[key] for code, key in keys.items() if key in cached}
+
+    missing = [code for code in HOMEPAGE_CATEGORIES if code not in fragments]
+    if missing:
+        with primary_reads():
+            rows = await asyncio.gather(*(_slider_products(code) for code in missing))
+        rendered = _render_sliders(dict(zip(missing, rows)))
+        await cache.aset_many({keys[code]: html for code, html in rendered.items()}, _timeout(FRAGMENT_TIMEOUT))
+        fragments.update(rendered)
+    return fragments
@@ -0,0 +1,202 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from Ecommerce.database import bulk_upsert
+
+from . import search
+from .catalog import invalidate_products
+from .models import CATEGORY_CHOICES, Product
+from .pricing import effective_price, load_rules, money
+from .taskqueue import enqueue_many
+
+# Column order of CSV files, both ways; JSONL objects use the same keys
+FIELDS = ('sku', 'title', 'selling_price', 'discounted_price', 'description', 'brand', 'category', 'product_image')
+IMPORT_FIELDS = FIELDS[1:]
+FORMATS = ('csv', 'jsonl')
+BATCH_SIZE = 1000
+# only the first few bad rows are kept, the rest are counted
+MAX_REPORTED_ERRORS = 100
+# DecimalField(max_digits=10, decimal_places=2)
+MAX_PRICE = Decimal('99999999.99')
+
+# accepts the code ('L') or the label ('Lehenga', any case)
+_CATEGORIES = {code.lower(): code for code, _ in CATEGORY_CHOICES}
+_CATEGORIES.update({label.lower(): code for code, label in CATEGORY_CHOICES})
+
+
+class RowError(ValueError):
+    def __init__(self, line, message):
+        super().__init__('line %s: %s' % (line, message))
+        self.line = line
+
+
+def guess_format(name):
+    return 'jsonl' if str(name).endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def read_rows(stream, fmt):
+    # (line number, dict) pairs, one at a time however large the file is
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                raise RowError(line_no, 'invalid JSON (%s)' % exc)
+            if not isinstance(row, dict):
+                raise RowError(line_no, 'expected a JSON object')
+            yield line_no, row
+
+
+def _text(row, line, field, max_length, required=True):
+    value = row.get(field)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(line, '%s is required' % field)
+    if len(value) > max_length:
+        raise RowError(line, '%s is longer than %d characters' % (field, max_length))
+    return value
+
+
+def _price(row, line, field):
+    try:
+        value = Decimal(str(row.get(field)).strip())
+    except InvalidOperation:
+        raise RowError(line, '%s must be a number' % field)
+    if not value.is_finite() or value < 0:
+        raise RowError(line, '%s must be zero or more' % field)
+    if value > MAX_PRICE:
+        raise RowError(line, '%s is above %s' % (field, MAX_PRICE))
+    return money(value)
+
+
+def clean_row(row, line):
+    category = _CATEGORIES.get(str(row.get('category') or '').strip().lower())
+    if category is None:
+        raise RowError(line, 'unknown category %r' % row.get('category'))
+    cleaned = {
+        'sku': _text(row, line, 'sku', 64),
+        'title': _text(row, line, 'title', 100),
+        'selling_price': _price(row, line, 'selling_price'),
+        'discounted_price': _price(row, line, 'discounted_price'),
+        'description': _text(row, line, 'description', 100000, required=False),
+        'brand': _text(row, line, 'brand', 100),
+        'category': category,
+        'product_image': _text(row, line, 'product_image', 100, required=False),
+    }
+    if cleaned['discounted_price'] > cleaned['selling_price']:
+        raise RowError(line, 'discounted_price is above selling_price')
+    return cleaned
+
+
+def _batches(rows, size):
+    batch = []
+    for item in rows:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _write_batch(rows, rules):
+    # Upserts one batch on sku with a SELECT and a single INSERT ... ON CONFLICT DO UPDATE
+    # (bulk_update's per-row CASE expressions cost seconds per thousand rows).
+    # Returns (created, updated, ids of products with a new image).
+    by_sku = {row['sku']: row for row in rows}  # a repeated sku in the batch: the last row wins
+    existing = dict(Product.objects.filter(sku__in=by_sku).values_list('sku', 'product_image'))
+    image_skus = [sku for sku, row in by_sku.items() if row['product_image'] and row['product_image'] != existing.get(sku)]
+    now = timezone.now()
+    # bulk_create skips the pre_save signal that prices a product, so price the rows here
+    products = [Product(updated_at=now, effective_price=effective_price(row['category'], row['discounted_price'], rules),
+                        **row) for row in by_sku.values()]
+    with transaction.atomic():
+        bulk_upsert(Product, products, ['sku'], IMPORT_FIELDS + ('effective_price', 'updated_at'))
+    image_ids = list(Product.objects.filter(sku__in=image_skus).values_list('id', flat=True)) if image_skus else []
+    updated = sum(1 for sku in by_sku if sku in existing)
+    return len(by_sku) - updated, updated, image_ids
+
+
+def _count_batch(rows, planned):
+    # (created, updated) that _write_batch would report, from the same sku lookup and no writes
+    skus = {row['sku'] for row in rows}
+    existing = set(Product.objects.filter(sku__in=skus).values_list('sku', flat=True)) | (skus & planned)
+    planned |= skus
+    return len(skus) - len(existing), len(existing)
+
+
+def import_products(rows, batch_size=BATCH_SIZE, dry_run=False, strict=False, log=None):
+    # Streams (line, dict) rows into Product in batches, so memory does not grow with the file.
+    # Bad rows are skipped and reported, or abort the import with strict=True.
+    log = log or (lambda message: None)
+    stats = {'created': 0, 'updated': 0, 'invalid': 0, 'errors': []}
+
+    def valid_rows():
+        for line, row in rows:
+            try:
+                yield clean_row(row, line)
+            except RowError as exc:
+                if strict:
+                    raise
+                stats['invalid'] += 1
+                if len(stats['errors']) < MAX_REPORTED_ERRORS:
+                    stats['errors'].append(str(exc))
+
+    rules = load_rules()
+    # dry run only: skus an earlier batch would have created, so their repeats count as updates
+    planned = set()
+    for batch in _batches(valid_rows(), batch_size):
+        if dry_run:
+            created, updated = _count_batch(batch, planned)
+            stats['created'] += created
+            stats['updated'] += updated
+            continue
+        created, updated, image_ids = _write_batch(batch, rules)
+        stats['created'] += created
+        stats['updated'] += updated
+        enqueue_many('shop.image_derivatives', [{'product_id': pk} for pk in image_ids])
+        log('%d created, %d updated' % (stats['created'], stats['updated']))
+
+    if not dry_run and (stats['created'] or stats['updated']):
+        # bulk writes skip the model signals that keep caches and the search index fresh
+        invalidate_products()
+        search.store.replace(search.build_index())
+    return stats
+
+
+def export_queryset(category=None):
+    products = Product.objects.order_by('id')
+    if category:
+        products = products.filter(category=category)
+    return products.values_list(*FIELDS)
+
+
+class _Echo:
+    # csv.writer target that hands each formatted line back instead of buffering it
+    def write(self, value):
+        return value
+
+
+def export_lines(queryset, fmt, chunk_size=2000):
+    # Encoded lines for a streaming response or a file; rows are fetched chunk_size at a time
+    rows = queryset.iterator(chunk_size=chunk_size)
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(FIELDS)
+        for row in rows:
+            yield writer.writerow(['' if value is None else value for value in row])
+    else:
+        for row in rows:
+            # prices as strings, exactly as stored
+            yield json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False, cls=DjangoJSONEncoder) + '\n'
@@ -0,0 +1,54 @@
+from django.db import IntegrityError, transaction
+
+from .inventory import OutOfStock, consume
+from .models import Cart, Checkout, Customer, OrderPlaced, Product
+from .pricing import cart_discount
+from .taskqueue import enqueue
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def place_order(user, customer_id, idempotency_key):
+    # Moves the whole cart into OrderPlaced in one transaction with a fixed number of queries
+    # whatever the cart size (plus one per line whose stock hold expired). Returns (checkout,
+    # created); a retried key returns the checkout created by the first attempt and changes nothing.
+    # customer_id comes straight from the form, so anything but one of the user's ids is refused.
+    try:
+        customer_id = int(customer_id)
+    except (TypeError, ValueError):
+        raise CheckoutError('Choose one of your saved addresses.')
+    if not Customer.objects.filter(pk=customer_id, user=user).exists():
+        raise CheckoutError('Choose one of your saved addresses.')
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                checkout = Checkout.objects.create(user=user, idempotency_key=idempotency_key)
+        except IntegrityError:
+            return Checkout.objects.get(user=user, idempotency_key=idempotency_key), False
+
+        # of=self: the joined product rows stay unlocked for everyone else's carts
+        lines = list(Cart.objects.select_for_update(of=('self',)).filter(user=user)
+                     .order_by('id').values_list('id', 'product_id', 'quantity', 'product__effective_price'))
+        if not lines:
+            # rolls the checkout row back too, so the key can be used again
+            raise CheckoutError('Your cart is empty.')
+        try:
+            consume(user, [(product_id, quantity) for _, product_id, quantity, _ in lines])
+        except OutOfStock as e:
+            title = Product.objects.filter(pk=e.product_id).values_list('title', flat=True).first()
+            raise CheckoutError('Sorry, %s is out of stock.' % (title or 'a product in your cart'))
+        OrderPlaced.objects.bulk_create([
+            OrderPlaced(user=user, checkout=checkout, customer_id=customer_id, product_id=product_id, quantity=quantity,
+                        unit_price=price)
+            for _, product_id, quantity, price in lines
+        ])
+        # the cart promotion is fixed at the prices the order was placed at
+        checkout.discount, _ = cart_discount(sum(quantity * price for _, _, quantity, price in lines))
+        if checkout.discount:
+            checkout.save(update_fields=['discount'])
+        Cart.objects.filter(pk__in=[line_id for line_id, *_ in lines]).delete()
+        # confirmation mail goes out from the task worker, queued atomically with the order
+        enqueue('shop.order_confirmation', {'checkout_id': checkout.id})
+    return checkout, True
@@ -1,9 +1,13 @@
 from django import forms 
 from django.contrib.auth.forms import UserCreationForm,AuthenticationForm,UsernameField,PasswordChangeForm,PasswordResetForm,SetPasswordForm
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.urls import reverse_lazy
 from django.utils.translation import gettext,gettext_lazy as _
 from django.contrib.auth import password_validation
+from .locations import index as locations
 from .models import Customer
+from .tasks import enqueue_password_reset
  # Registration
  
 class CustomerRegistrationForm(UserCreationForm):
@@ -31,6 +35,12 @@ class MyPasswordChangeForm(PasswordChangeForm):
 #Reset
 class MyPasswordReset(PasswordResetForm):
     email=forms.EmailField(label=_("Email"),max_length=50,widget=forms.EmailInput(attrs={'autocomplete':'email','class':'form-control'}))
+
+    # rendered and delivered by the task worker so SMTP latency never reaches the request; only the
+    # user and the template names are queued, the worker makes the token, so no reset link is stored
+    def send_mail(self, subject_template_name, email_template_name, context, from_email, to_email, html_email_template_name=None):
+        enqueue_password_reset(context['user'].pk, to_email, context, subject_template_name, email_template_name,
+                               html_email_template_name, from_email)
 #Set Password
 class MySetPasswordForm(SetPasswordForm):
     new_password1=forms.CharField(label=_('New password'),widget=forms.PasswordInput(attrs={'autocomplete':'new_password','class':'form-control'}),help_text=password_validation.password_validators_help_text_html())
@@ -45,9 +55,42 @@ class CustomerProfileForm(forms.ModelForm):
         widgets={
             'name':forms.TextInput(attrs={'class':'form-control'}),
             'division':forms.Select(attrs={'class':'form-control'}),
-            'district':forms.TextInput(attrs={'class':'form-control'}),
-            'thana':forms.TextInput(attrs={'class':'form-control'}),
+            # data-lookup: typeahead endpoint used by myscript.js
+            'district':forms.TextInput(attrs={'class':'form-control','autocomplete':'off','data-lookup':reverse_lazy('address-districts')}),
+            'thana':forms.TextInput(attrs={'class':'form-control','autocomplete':'off','data-lookup':reverse_lazy('address-thanas')}),
             'villorroad':forms.TextInput(attrs={'class':'form-control'}),
-            'zipcode':forms.NumberInput(attrs={'class':'form-control'}),
+            'zipcode':forms.NumberInput(attrs={'class':'form-control','data-lookup':reverse_lazy('address-zipcode')}),
         }
+
+    def clean(self):
+        # Checked against the in-memory location index, no queries. Only contradictions the
+        # index can prove are rejected: a thana or post code missing from the bundled data passes
+        # unless SHOP_STRICT_ADDRESSES is set.
+        cleaned_data=super().clean()
+        division=cleaned_data.get('division')
+        district=cleaned_data.get('district')
+        if not division or not district:
+            return cleaned_data
+        found=locations.district(district)
+        if found is None or found[0]!=division:
+            self.add_error('district', _('Choose a district of %(division)s division.') % {'division':division})
+            return cleaned_data
+        district=cleaned_data['district']=found[1]
+        thana=locations.thana(district, cleaned_data.get('thana') or '')
+        if thana:
+            cleaned_data['thana']=thana
+        zipcode=cleaned_data.get('zipcode')
+        if zipcode is None:
+            return cleaned_data
+        known=locations.zipcode(zipcode)
+        if not 1000<=zipcode<=9999:
+            self.add_error('zipcode', _('Enter a four digit post code.'))
+        elif known is None:
+            if getattr(settings, 'SHOP_STRICT_ADDRESSES', False):
+                self.add_error('zipcode', _('Unknown post code.'))
+        elif known[1]!=district:
+            self.add_error('zipcode', _('Post code %(code)d is in %(district)s district.') % {'code':zipcode,'district':known[1]})
+        elif thana and thana not in known[2]:
+            self.add_error('zipcode', _('Post code %(code)d belongs to %(thanas)s.') % {'code':zipcode,'thanas':', '.join(known[2])})
+        return cleaned_data
     
\ No newline at end of file
@@ -0,0 +1,98 @@
+import hashlib
+import io
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .catalog import invalidate_products
+from .models import Product
+
+# Widths generated for every product image; originals narrower than a width are not upscaled
+DERIVATIVE_WIDTHS = getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', (160, 320, 640, 960))
+# extension -> (Pillow format, save options)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+DERIVATIVE_ROOT = 'derivatives'
+# product images whose URLs are kept in memory by picture_urls()
+PICTURE_URLS_CACHE_SIZE = getattr(settings, 'SHOP_PICTURE_URLS_CACHE_SIZE', 20000)
+
+
+def derivative_widths(original_width):
+    widths = [w for w in DERIVATIVE_WIDTHS if w < original_width]
+    if original_width <= DERIVATIVE_WIDTHS[-1]:
+        widths.append(original_width)
+    return widths
+
+
+def derivative_name(digest, width, ext):
+    # content-addressed: identical uploads share one set of files
+    return '%s/%s/%s/%d.%s' % (DERIVATIVE_ROOT, digest[:2], digest, width, ext)
+
+
+def file_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Resize the original bytes into every width/format not stored yet; returns the original width
+def write_derivatives(data, digest):
+    with Image.open(io.BytesIO(data)) as opened:
+        image = ImageOps.exif_transpose(opened)
+        image.load()
+    for width in derivative_widths(image.width):
+        resized = None
+        for ext, (fmt, options) in DERIVATIVE_FORMATS.items():
+            name = derivative_name(digest, width, ext)
+            if default_storage.exists(name):
+                continue
+            if resized is None:
+                height = max(1, round(image.height * width / image.width))
+                resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image
+            variant = resized.convert('RGB') if fmt == 'JPEG' and resized.mode != 'RGB' else resized
+            buffer = io.BytesIO()
+            variant.save(buffer, fmt, **options)
+            saved = default_storage.save(name, ContentFile(buffer.getvalue()))
+            if saved != name:
+                # another worker stored the same content first; keep a single copy
+                default_storage.delete(saved)
+    return image.width
+
+
+def generate_derivatives(product_id, force=False):
+    product = Product.objects.only('id', 'product_image', 'image_digest', 'image_width').get(pk=product_id)
+    if not product.product_image:
+        return False
+    with product.product_image.open('rb') as f:
+        data = f.read()
+    digest = file_digest(data)
+    if digest == product.image_digest and not force:
+        return False
+    width = write_derivatives(data, digest)
+    # queryset update so this does not re-fire post_save; only applies if the image was not replaced meanwhile
+    updated = (Product.objects.filter(pk=product_id, product_image=product.product_image.name)
+               .update(image_digest=digest, image_width=width, updated_at=timezone.now()))
+    if updated:
+        invalidate_products([product_id])
+    return bool(updated)
+
+
+def srcset(digest, original_width, ext):
+    return ', '.join('%s %dw' % (default_storage.url(derivative_name(digest, w, ext)), w)
+                     for w in derivative_widths(original_width))
+
+
+@lru_cache(maxsize=PICTURE_URLS_CACHE_SIZE)
+def picture_urls(image_name, digest, width):
+    # (src, webp srcset, jpg srcset) for one product image, srcsets None until the derivatives
+    # exist. A pure function of its arguments (a new upload brings a new name or digest), so the
+    # memo never needs invalidating and card templates stop building URLs per item.
+    if not digest or not width:
+        return default_storage.url(image_name), None, None
+    widths = derivative_widths(width)
+    fallback = default_storage.url(derivative_name(digest, widths[len(widths) // 2], 'jpg'))
+    return fallback, srcset(digest, width, 'webp'), srcset(digest, width, 'jpg')
@@ -0,0 +1,221 @@
+import contextvars
+import heapq
+import io
+import itertools
+import pstats
+import threading
+import time
+
+from django.template.backends.django import Template
+
+# Histogram bucket upper bounds in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float('inf'))
+# Queries per request: one bucket per count where views are budgeted, coarser above
+QUERY_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50, 100, 200, float('inf'))
+PERCENTILES = (50, 90, 95, 99)
+
+# the sample of the request being served on this thread/task, if any
+current_sample = contextvars.ContextVar('shop_request_sample', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS_MS, discrete=False):
+        self.buckets = buckets
+        # integer observations: a bucket starts one above the previous bound, not at it
+        self.step = 1 if discrete else 0
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value_ms):
+        for i, bound in enumerate(self.buckets):
+            if value_ms <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value_ms
+
+    def percentile(self, p):
+        # linear interpolation inside the bucket holding the p-th observation
+        if not self.count:
+            return 0.0
+        rank = self.count * p / 100.0
+        seen = 0
+        lower = 0.0
+        for bound, n in zip(self.buckets, self.counts):
+            if n and seen + n >= rank:
+                if bound == float('inf'):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / n
+            seen += n
+            lower = bound + self.step
+        return lower
+
+    def summary(self):
+        data = {'count': self.count, 'mean': round(self.total / self.count, 3) if self.count else 0.0}
+        data.update({'p%d' % p: round(self.percentile(p), 3) for p in PERCENTILES})
+        return data
+
+
+class RequestSample:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = {}
+
+    # connection.execute_wrapper() callable
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            key = (sql, repr(params))
+            self.statements[key] = self.statements.get(key, 0) + 1
+
+    @property
+    def duplicate_queries(self):
+        return sum(n - 1 for n in self.statements.values() if n > 1)
+
+    def duplicated_sql(self, limit=5):
+        repeated = [(n, sql) for (sql, _), n in self.statements.items() if n > 1]
+        return [sql for _, sql in heapq.nlargest(limit, repeated)]
+
+
+class ViewStats:
+    def __init__(self):
+        self.wall = Histogram()
+        self.db = Histogram()
+        self.templates = Histogram()
+        self.queries = Histogram(QUERY_BUCKETS, discrete=True)
+        self.query_total = 0
+        self.duplicate_total = 0
+        self.duplicated_sql = []
+
+    def record(self, wall_ms, sample):
+        self.wall.observe(wall_ms)
+        self.db.observe(sample.db_time * 1000)
+        self.templates.observe(sample.template_time * 1000)
+        self.queries.observe(sample.queries)
+        self.query_total += sample.queries
+        if sample.duplicate_queries:
+            self.duplicate_total += sample.duplicate_queries
+            self.duplicated_sql = sample.duplicated_sql()
+
+    def summary(self):
+        return {
+            'requests': self.wall.count,
+            'wall_ms': self.wall.summary(),
+            'db_ms': self.db.summary(),
+            'template_ms': self.templates.summary(),
+            'queries': self.queries.summary(),
+            'queries_total': self.query_total,
+            'duplicate_queries_total': self.duplicate_total,
+            'duplicated_sql': self.duplicated_sql,
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view_name, wall_ms, sample):
+        with self.lock:
+            self.views.setdefault(view_name, ViewStats()).record(wall_ms, sample)
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+    def snapshot(self):
+        with self.lock:
+            return {name: stats.summary() for name, stats in sorted(self.views.items())}
+
+    def prometheus(self):
+        lines = [
+            '# HELP shop_request_duration_seconds Wall time per resolved view.',
+            '# TYPE shop_request_duration_seconds histogram',
+        ]
+        with self.lock:
+            views = sorted(self.views.items())
+            for name, stats in views:
+                cumulative = 0
+                for bound, n in zip(stats.wall.buckets, stats.wall.counts):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound / 1000)
+                    lines.append('shop_request_duration_seconds_bucket{view="%s",le="%s"} %d' % (name, le, cumulative))
+                lines.append('shop_request_duration_seconds_sum{view="%s"} %f' % (name, stats.wall.total / 1000))
+                lines.append('shop_request_duration_seconds_count{view="%s"} %d' % (name, stats.wall.count))
+            for metric, kind, help_text, value in (
+                ('shop_db_queries_total', 'counter', 'Database queries issued per view.', lambda s: s.query_total),
+                ('shop_db_duplicate_queries_total', 'counter', 'Repeated identical queries per view.',
+                 lambda s: s.duplicate_total),
+                ('shop_db_seconds_total', 'counter', 'Time spent in the database per view.',
+                 lambda s: s.db.total / 1000),
+                ('shop_template_seconds_total', 'counter', 'Time spent rendering templates per view.',
+                 lambda s: s.templates.total / 1000),
+            ):
+                lines.append('# HELP %s %s' % (metric, help_text))
+                lines.append('# TYPE %s %s' % (metric, kind))
+                for name, stats in views:
+                    lines.append('%s{view="%s"} %s' % (metric, name, value(stats)))
+        return '\n'.join(lines) + '\n'
+
+
+class SlowRequestProfiles:
+    # keeps the cProfile output of the slowest N profiled requests
+    def __init__(self, keep=10):
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.heap = []
+        self.counter = itertools.count()
+
+    def add(self, wall_ms, view_name, path, profiler):
+        with self.lock:
+            if len(self.heap) >= self.keep and wall_ms <= self.heap[0][0]:
+                return
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(30)
+        entry = (wall_ms, next(self.counter), {'view': view_name, 'path': path,
+                                                'wall_ms': round(wall_ms, 3), 'profile': out.getvalue()})
+        with self.lock:
+            if len(self.heap) < self.keep:
+                heapq.heappush(self.heap, entry)
+            else:
+                heapq.heappushpop(self.heap, entry)
+
+    def slowest(self):
+        with self.lock:
+            return [entry[2] for entry in sorted(self.heap, reverse=True)]
+
+
+registry = MetricsRegistry()
+slow_profiles = SlowRequestProfiles()
+
+
+_original_render = Template.render
+_install_lock = threading.Lock()
+
+
+def _timed_render(self, context=None, request=None):
+    sample = current_sample.get()
+    if sample is None or sample.template_depth:
+        # nested renders are already inside the outer timing
+        return _original_render(self, context, request)
+    sample.template_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_render(self, context, request)
+    finally:
+        sample.template_time += time.perf_counter() - start
+        sample.template_depth -= 1
+
+
+def install_template_timer():
+    with _install_lock:
+        if Template.render is not _timed_render:
+            Template.render = _timed_render
@@ -0,0 +1,202 @@
+import random
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import ProductStock, StockHold
+
+# how long units put in a cart stay reserved for it
+HOLD_MINUTES = getattr(settings, 'SHOP_STOCK_HOLD_MINUTES', 15)
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id):
+        super().__init__('Product %s is out of stock' % product_id)
+        self.product_id = product_id
+
+
+def shards(product_id):
+    # {shard: units} as last committed, read without a lock; empty when the product is not tracked
+    return dict(ProductStock.objects.filter(product_id=product_id).values_list('shard', 'units'))
+
+
+def available(product_id):
+    return ProductStock.objects.filter(product_id=product_id).aggregate(units=Sum('units'))['units']
+
+
+def _plan(known, quantity):
+    # shards to try, in random order to spread the writers: those that cover quantity alone
+    # first (one UPDATE in the usual case), then the rest, fullest first
+    whole = [shard for shard, units in known.items() if units >= quantity]
+    random.shuffle(whole)
+    rest = sorted((shard for shard, units in known.items() if 0 < units < quantity), key=lambda s: -known[s])
+    return whole + rest
+
+
+def take(product_id, quantity, known):
+    # Takes quantity units, from several shards when no single one has them all, and returns
+    # [(shard, units)]. Each step is a single conditional UPDATE (units >= what it takes), so
+    # concurrent buyers never read-then-write and never oversell. known is a snapshot of
+    # shards(); when it turns out stale the shards are read again, and OutOfStock is raised
+    # only once they hold fewer units than asked for in total. Call it inside a transaction,
+    # which the exception rolls back together with whatever was taken before it.
+    taken, missing = [], quantity
+    while missing:
+        progress = False
+        for shard in _plan(known, missing):
+            units = min(known[shard], missing)
+            if (ProductStock.objects.filter(product_id=product_id, shard=shard, units__gte=units)
+                    .update(units=F('units') - units)):
+                taken.append((shard, units))
+                missing -= units
+                progress = True
+                if not missing:
+                    break
+        if missing:
+            known = shards(product_id)
+            if not progress and sum(known.values()) < missing:
+                raise OutOfStock(product_id)
+    return taken
+
+
+def give_back(product_id, shard, quantity):
+    # returns units to the shard they came from, or to the first one left after a re-shard
+    if ProductStock.objects.filter(product_id=product_id, shard=shard).update(units=F('units') + quantity):
+        return
+    first = ProductStock.objects.filter(product_id=product_id).order_by('shard').values_list('shard', flat=True)[:1]
+    ProductStock.objects.filter(product_id=product_id, shard__in=first).update(units=F('units') + quantity)
+
+
+def reserve(user, product_id, quantity=1):
+    # Holds quantity units for the user's cart (one hold per shard they came from) and returns
+    # quantity. Raises OutOfStock; a product that is not tracked costs one read and holds nothing (0).
+    known = shards(product_id)
+    if not known:
+        return 0
+    with transaction.atomic():
+        expires_at = timezone.now() + timedelta(minutes=HOLD_MINUTES)
+        StockHold.objects.bulk_create([
+            StockHold(user=user, product_id=product_id, shard=shard, quantity=units, expires_at=expires_at)
+            for shard, units in take(product_id, quantity, known)])
+    return quantity
+
+
+def _release(hold_id, shard, quantity, product_id, part=None):
+    # Gives back a whole hold (or part of it) exactly once: the hold row is deleted or shrunk with
+    # a conditional statement first, and only the caller whose statement matched returns units.
+    holds = StockHold.objects.filter(pk=hold_id, quantity=quantity)
+    if part is None or part >= quantity:
+        done, part = holds.delete()[0], quantity
+    else:
+        done = holds.update(quantity=F('quantity') - part)
+    if done:
+        give_back(product_id, shard, part)
+    return part if done else 0
+
+
+def release(user, product_id, quantity=None):
+    # returns up to quantity (default all) of the user's held units, newest holds first
+    released = 0
+    holds = (StockHold.objects.filter(user=user, product_id=product_id).order_by('-id')
+             .values_list('id', 'shard', 'quantity'))
+    for hold_id, shard, held in holds:
+        if quantity is not None and released >= quantity:
+            break
+        with transaction.atomic():
+            released += _release(hold_id, shard, held, product_id,
+                                 None if quantity is None else quantity - released)
+    return released
+
+
+def consume(user, lines):
+    # Turns the user's holds into the order being placed, inside checkout's transaction. lines
+    # is [(product_id, quantity)]; units whose hold expired and went back are taken again
+    # (raising OutOfStock when they are gone) and surplus holds are given back.
+    product_ids = {product_id for product_id, _ in lines}
+    tracked = defaultdict(dict)
+    for product_id, shard, units in (ProductStock.objects.filter(product_id__in=product_ids)
+                                     .values_list('product_id', 'shard', 'units')):
+        tracked[product_id][shard] = units
+    if not tracked:
+        return
+    # locked, so a sweeper run cannot return these units while the order takes them
+    holds = list(StockHold.objects.select_for_update().filter(user=user, product_id__in=tracked)
+                 .values_list('id', 'product_id', 'shard', 'quantity'))
+    held = Counter()
+    for _, product_id, _, quantity in holds:
+        held[product_id] += quantity
+    StockHold.objects.filter(pk__in=[hold_id for hold_id, *_ in holds]).delete()
+    for product_id, quantity in lines:
+        if product_id not in tracked:
+            continue
+        missing = quantity - held[product_id]
+        if missing > 0:
+            take(product_id, missing, tracked[product_id])
+        elif missing < 0:
+            shard = next(shard for _, pk, shard, _ in reversed(holds) if pk == product_id)
+            give_back(product_id, shard, -missing)
+
+
+def release_expired(batch_size=1000, now=None):
+    # Returns the units of holds that expired before now, batch by batch; returns how many.
+    # The delete matches the quantity read, as in _release, so a hold that checkout or the cart
+    # releases or shrinks meanwhile is skipped here; a shrunk one is swept whole on the next pass.
+    now = now or timezone.now()
+    released = 0
+    while True:
+        holds = list(StockHold.objects.filter(expires_at__lt=now).order_by('expires_at')
+                     .values_list('id', 'product_id', 'shard', 'quantity')[:batch_size])
+        if not holds:
+            return released
+        with transaction.atomic():
+            units = Counter()
+            for hold_id, product_id, shard, quantity in holds:
+                if StockHold.objects.filter(pk=hold_id, quantity=quantity).delete()[0]:
+                    units[product_id, shard] += quantity
+            for (product_id, shard), quantity in units.items():
+                give_back(product_id, shard, quantity)
+        released += sum(units.values())
+
+
+def set_stock(product_id, units, shard_count=None):
+    # Sets the units available to reserve, spread evenly over shard_count rows (default: keep the
+    # current count, one for a product that was not tracked). Held units are not included.
+    # Units=None stops tracking the product. Meant for restocking and re-sharding, not hot paths.
+    with transaction.atomic():
+        rows = ProductStock.objects.select_for_update().filter(product_id=product_id)
+        current = len(rows)
+        rows.delete()
+        if units is None:
+            return
+        count = max(shard_count or current or 1, 1)
+        ProductStock.objects.bulk_create([
+            ProductStock(product_id=product_id, shard=shard, units=units // count + (shard < units % count))
+            for shard in range(count)])
+
+
+def reshard(product_id, shard_count):
+    # spreads what is left of a tracked product over shard_count rows (1 merges them back)
+    with transaction.atomic():
+        units = list(ProductStock.objects.select_for_update().filter(product_id=product_id)
+                     .values_list('units', flat=True))
+        if not units:
+            return False
+        set_stock(product_id, sum(units), shard_count)
+        return True
+
+
+def add_stock(product_id, units):
+    # restocks on top of whatever is left, as increments that never overwrite concurrent reservations
+    known = sorted(shards(product_id))
+    if not known:
+        set_stock(product_id, units)
+        return
+    with transaction.atomic():
+        for i, shard in enumerate(known):
+            extra = units // len(known) + (i < units % len(known))
+            if extra:
+                ProductStock.objects.filter(product_id=product_id, shard=shard).update(units=F('units') + extra)
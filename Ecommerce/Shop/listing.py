@@ -0,0 +1,190 @@
+import base64
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Count, Q
+from django.utils.http import urlencode
+from django.utils.text import slugify
+
+from .models import CATEGORY_CHOICES, Product
+
+PAGE_SIZE = 24
+
+CATEGORY_LABELS = dict(CATEGORY_CHOICES)
+# 'lehenga' -> 'L', 'gents-pant' -> 'GP', ...
+CATEGORY_SLUGS = {slugify(label): code for code, label in CATEGORY_CHOICES}
+
+# slug, label, lower bound (inclusive), upper bound (exclusive)
+PRICE_RANGES = (
+    ('under-1000', 'Under 1000', None, 1000),
+    ('1000-2000', '1000 - 2000', 1000, 2000),
+    ('2000-5000', '2000 - 5000', 2000, 5000),
+    ('over-5000', 'Over 5000', 5000, None),
+)
+
+# sort slug -> (price direction, order_by); every ordering ends on id so the cursor is unique
+SORTS = {
+    'newest': (None, ('-id',)),
+    'price-asc': ('asc', ('effective_price', 'id')),
+    'price-desc': ('desc', ('-effective_price', '-id')),
+}
+DEFAULT_SORT = 'newest'
+
+LISTING_FIELDS = ('id', 'title', 'selling_price', 'effective_price', 'product_image', 'image_digest', 'image_width',
+                  'category', 'brand')
+
+
+def _price_q(min_price=None, max_price=None):
+    q = Q()
+    if min_price is not None:
+        q &= Q(effective_price__gte=min_price)
+    if max_price is not None:
+        q &= Q(effective_price__lt=max_price)
+    return q
+
+
+def _number(value):
+    try:
+        number = Decimal(value) if value not in (None, '') else None
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    return number if number is None or number.is_finite() else None
+
+
+def pack_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def encode_cursor(product, sort):
+    direction, _ = SORTS[sort]
+    return pack_cursor([product.id] if direction is None else [str(product.effective_price), product.id])
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+
+
+def _cursor_id(value):
+    # bool is an int subclass, but never a product id
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def _after_cursor(queryset, sort, cursor):
+    # a cursor that does not decode to [id] or [price, id] is ignored (first page)
+    key = decode_cursor(cursor)
+    direction, _ = SORTS[sort]
+    if not isinstance(key, list) or len(key) != (1 if direction is None else 2):
+        return queryset
+    last_id = _cursor_id(key[-1])
+    if last_id is None:
+        return queryset
+    if direction is None:
+        return queryset.filter(id__lt=last_id)
+    price = _number(key[0]) if isinstance(key[0], (str, int, float)) else None
+    if price is None:
+        return queryset
+    if direction == 'asc':
+        return queryset.filter(Q(effective_price__gt=price) | Q(effective_price=price, id__gt=last_id))
+    return queryset.filter(Q(effective_price__lt=price) | Q(effective_price=price, id__lt=last_id))
+
+
+class ListingQuery:
+    def __init__(self, category, brands=(), min_price=None, max_price=None, sort=DEFAULT_SORT, cursor=None):
+        self.category = category
+        self.brands = sorted(set(brands))
+        self.min_price = min_price
+        self.max_price = max_price
+        self.sort = sort if sort in SORTS else DEFAULT_SORT
+        self.cursor = cursor
+
+    @classmethod
+    def from_params(cls, category, params):
+        return cls(
+            category,
+            brands=[b for b in params.getlist('brand') if b],
+            min_price=_number(params.get('min_price')),
+            max_price=_number(params.get('max_price')),
+            sort=params.get('sort', DEFAULT_SORT),
+            cursor=params.get('cursor') or None,
+        )
+
+    def params(self, **overrides):
+        values = {
+            'brand': self.brands,
+            'min_price': self.min_price,
+            'max_price': self.max_price,
+            'sort': self.sort if self.sort != DEFAULT_SORT else None,
+        }
+        values.update(overrides)
+        return urlencode({k: v for k, v in values.items() if v not in (None, [], '')}, doseq=True)
+
+    def _page_queryset(self, page_size):
+        queryset = Product.objects.filter(category=self.category)
+        if self.brands:
+            queryset = queryset.filter(brand__in=self.brands)
+        queryset = queryset.filter(_price_q(self.min_price, self.max_price))
+        if self.cursor:
+            queryset = _after_cursor(queryset, self.sort, self.cursor)
+        _, ordering = SORTS[self.sort]
+        # fetch one extra row to know whether another page exists
+        return queryset.only(*LISTING_FIELDS).order_by(*ordering)[:page_size + 1]
+
+    def _paginate(self, page, page_size):
+        next_cursor = encode_cursor(page[page_size - 1], self.sort) if len(page) > page_size else None
+        return page[:page_size], next_cursor
+
+    def products(self, page_size=PAGE_SIZE):
+        return self._paginate(list(self._page_queryset(page_size)), page_size)
+
+    async def aproducts(self, page_size=PAGE_SIZE):
+        return self._paginate([product async for product in self._page_queryset(page_size)], page_size)
+
+    def _facet_rows(self):
+        # One GROUP BY brand over the category: each brand count honours the price filter,
+        # each price bucket count honours the brand filter (summed over the selected brands).
+        price_q = _price_q(self.min_price, self.max_price)
+        annotations = {'in_price': Count('id', filter=price_q) if price_q else Count('id')}
+        for i, (_, _, low, high) in enumerate(PRICE_RANGES):
+            annotations['range_%d' % i] = Count('id', filter=_price_q(low, high))
+        return (Product.objects.filter(category=self.category)
+                .values('brand').order_by('brand').annotate(**annotations))
+
+    def facets(self):
+        return self._facets(self._facet_rows())
+
+    async def afacets(self):
+        return self._facets([row async for row in self._facet_rows()])
+
+    def _facets(self, rows):
+        brands = []
+        range_counts = [0] * len(PRICE_RANGES)
+        for row in rows:
+            selected = row['brand'] in self.brands
+            toggled = [b for b in self.brands if b != row['brand']] if selected else self.brands + [row['brand']]
+            brands.append({
+                'name': row['brand'],
+                'count': row['in_price'],
+                'selected': selected,
+                'query': self.params(brand=toggled),
+            })
+            if not self.brands or selected:
+                for i in range(len(PRICE_RANGES)):
+                    range_counts[i] += row['range_%d' % i]
+
+        prices = []
+        for (slug, label, low, high), count in zip(PRICE_RANGES, range_counts):
+            selected = self.min_price == low and self.max_price == high
+            prices.append({
+                'slug': slug,
+                'label': label,
+                'count': count,
+                'selected': selected,
+                'query': self.params(min_price=None, max_price=None) if selected else self.params(min_price=low, max_price=high),
+            })
+
+        sorts = [{'slug': slug, 'selected': slug == self.sort, 'query': self.params(sort=slug)} for slug in SORTS]
+        return {'brands': brands, 'prices': prices, 'sorts': sorts}
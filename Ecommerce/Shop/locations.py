@@ -0,0 +1,87 @@
+import json
+from bisect import bisect_left
+from pathlib import Path
+
+from django.conf import settings
+
+# Bangladesh divisions -> districts -> thanas -> post codes, keyed by the DIVISION_CHOICES values.
+# Every district is listed; thanas and post codes can be extended without code changes.
+DATA_PATH = Path(__file__).resolve().parent / 'data' / 'bd_locations.json'
+
+
+def normalize(name):
+    return ' '.join(str(name).split()).casefold()
+
+
+class Names:
+    # sorted (key, name) pairs for prefix lookups with bisect
+    def __init__(self, names):
+        self.entries = sorted((normalize(name), name) for name in names)
+        self.keys = [key for key, _ in self.entries]
+
+    def __iter__(self):
+        return (name for _, name in self.entries)
+
+    def complete(self, prefix, limit=10):
+        prefix = normalize(prefix)
+        matches = []
+        for key, name in self.entries[bisect_left(self.keys, prefix):]:
+            if not key.startswith(prefix) or len(matches) >= limit:
+                break
+            matches.append(name)
+        return matches
+
+
+class LocationIndex:
+    # Plain dicts built once from the data file; every lookup is a hash probe or a bisect,
+    # never a database query.
+    def __init__(self, data):
+        aliases = {normalize(alias): name for alias, name in data.get('aliases', {}).items()}
+        self.division_districts = {}
+        self.district_thanas = {}
+        self.districts = {}  # key -> (division, district)
+        self.thanas = {}  # (district, key) -> thana
+        self.zipcodes = {}  # code -> (division, district, thanas)
+        for division, districts in data['divisions'].items():
+            self.division_districts[division] = Names(districts)
+            for district, thanas in districts.items():
+                self.districts[normalize(district)] = (division, district)
+                self.district_thanas[district] = Names(thanas)
+                for thana, codes in thanas.items():
+                    self.thanas[district, normalize(thana)] = thana
+                    for code in codes:
+                        _, _, known = self.zipcodes.get(code, (division, district, ()))
+                        self.zipcodes[code] = (division, district, known + (thana,))
+        self.all_districts = Names(district for _, district in self.districts.values())
+        for alias, name in aliases.items():
+            self.districts.setdefault(alias, self.districts[normalize(name)])
+
+    @classmethod
+    def load(cls, path=DATA_PATH):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def district(self, name):
+        # (division, canonical district name), accepting the older spellings, or None
+        return self.districts.get(normalize(name))
+
+    def thana(self, district, name):
+        return self.thanas.get((district, normalize(name)))
+
+    def zipcode(self, code):
+        # (division, district, thanas) for a known post code, or None
+        try:
+            return self.zipcodes.get(int(code))
+        except (TypeError, ValueError):
+            return None
+
+    def complete_districts(self, prefix, division=None, limit=10):
+        names = self.division_districts.get(division) if division else self.all_districts
+        return names.complete(prefix, limit) if names else []
+
+    def complete_thanas(self, prefix, district, limit=10):
+        found = self.district(district)
+        return self.district_thanas[found[1]].complete(prefix, limit) if found else []
+
+
+index = LocationIndex.load(getattr(settings, 'SHOP_LOCATIONS_PATH', DATA_PATH))
@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from Shop.images import generate_derivatives
+from Shop.models import Product
+
+
+def _generate(product_id, force):
+    try:
+        return product_id, generate_derivatives(product_id, force=force), None
+    except Exception as exc:
+        return product_id, False, exc
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG derivatives for existing product images in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Parallel resize workers (Pillow releases the GIL while resizing and encoding).')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate products that already have derivatives.')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(product_image='')
+        if not options['force']:
+            products = products.filter(image_digest='')
+        ids = list(products.values_list('id', flat=True).order_by('id'))
+
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = [pool.submit(_generate, pk, options['force']) for pk in ids]
+            for future in as_completed(futures):
+                pk, updated, error = future.result()
+                if error is not None:
+                    failed += 1
+                    self.stderr.write('Product %s: %s' % (pk, error))
+                elif updated:
+                    done += 1
+        self.stdout.write(self.style.SUCCESS(
+            'Generated derivatives for %d of %d products (%d failed)' % (done, len(ids), failed)))
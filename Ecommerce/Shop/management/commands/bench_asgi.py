@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+from django.utils.text import slugify
+
+from Shop import cart
+from Shop.benchmarks import asgi_get, client_settings, git_revision, isolated_database, load_report, seed, wsgi_get
+from Shop.models import CATEGORY_CHOICES, Customer, Product
+
+STACKS = ('wsgi', 'asgi')
+
+
+class Command(BaseCommand):
+    help = ('Compare serving the shop under ASGI (async views on an event loop, as uvicorn would) with WSGI '
+            '(sync views on a thread pool, as a threaded WSGI server would): requests/sec and p50/p95/p99 '
+            'per path on the same seeded catalog. Each stack runs in its own process since SHOP_ASYNC_VIEWS '
+            'is read when the URLconf is loaded. For a real server use loadtest --base-url.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stack', choices=STACKS + ('both',), default='both')
+        parser.add_argument('--products', type=int, default=5000, help='Catalog size to seed.')
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='In-flight requests: coroutines under ASGI, threads under WSGI.')
+        parser.add_argument('--requests', type=int, default=2000, help='Total requests per stack.')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+
+    def handle(self, *args, **options):
+        if options['stack'] == 'both':
+            stacks = {stack: self.run_child(stack, options) for stack in STACKS}
+            wsgi_rps = stacks['wsgi']['throughput_rps']
+            report = {
+                'revision': git_revision(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'products': options['products'],
+                'concurrency': options['concurrency'],
+                'asgi_vs_wsgi_throughput': round(stacks['asgi']['throughput_rps'] / wsgi_rps, 3) if wsgi_rps else None,
+                'stacks': stacks,
+            }
+        else:
+            report = self.run_stack(options['stack'], options)
+
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text)
+        else:
+            self.stdout.write(text)
+
+    def run_child(self, stack, options):
+        env = dict(os.environ, SHOP_ASYNC_VIEWS='1' if stack == 'asgi' else '0')
+        command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_asgi', '--stack', stack,
+                   '--products', str(options['products']), '--concurrency', str(options['concurrency']),
+                   '--requests', str(options['requests'])]
+        result = subprocess.run(command, env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError('%s run failed:\n%s' % (stack, result.stderr))
+        return json.loads(result.stdout)
+
+    def run_stack(self, stack, options):
+        with client_settings(), isolated_database(on_disk=True):
+            seed(products=options['products'], users=10, carts=50, orders=200)
+            product = Product.objects.order_by('id').first()
+            customer = Customer.objects.select_related('user').order_by('id').first()
+            cart.add_item(customer.user, product.id)
+            client = Client()
+            client.force_login(customer.user)
+            session = '%s=%s' % (settings.SESSION_COOKIE_NAME, client.cookies[settings.SESSION_COOKIE_NAME].value)
+            # the cart endpoints are CSRF-checked POSTs
+            cart_cookie = '%s; %s=%s' % (session, settings.CSRF_COOKIE_NAME, get_random_string(32))
+
+            category = reverse('category', args=(slugify(dict(CATEGORY_CHOICES)[product.category]),))
+            # url -> (method, cookie header)
+            paths = {
+                reverse('home'): ('GET', ''),
+                reverse('product-detail', args=(product.id,)): ('GET', ''),
+                category: ('GET', ''),
+                category + '?sort=price-asc': ('GET', ''),
+                reverse('pluscart') + '?prod_id=%d' % product.id: ('POST', cart_cookie),
+                reverse('minuscart') + '?prod_id=%d' % product.id: ('POST', cart_cookie),
+            }
+            latencies = {path: [] for path in paths}
+            errors = {path: 0 for path in paths}
+            order = list(paths)
+            drive = self.drive_asgi if stack == 'asgi' else self.drive_wsgi
+            # first pass fills the caches, only the second is reported
+            for total, record in ((len(order), False), (options['requests'], True)):
+                duration = drive(paths, order, total, options['concurrency'], latencies, errors, record)
+            return load_report(latencies, errors, duration, stack=stack, async_views=settings.SHOP_ASYNC_VIEWS,
+                               concurrency=options['concurrency'], products=options['products'])
+
+    @staticmethod
+    def _record(latencies, errors, path, status, elapsed):
+        latencies[path].append(elapsed)
+        if not 200 <= status < 400:
+            errors[path] += 1
+
+    def drive_asgi(self, paths, order, total, concurrency, latencies, errors, record):
+        application = ASGIHandler()
+        counter = iter(range(total))
+
+        async def worker():
+            # the coroutines share one iterator; next() never yields to the loop
+            for n in counter:
+                path = order[n % len(order)]
+                start = time.perf_counter()
+                status = await asgi_get(application, path, paths[path][1], paths[path][0])
+                if record:
+                    self._record(latencies, errors, path, status, (time.perf_counter() - start) * 1000)
+
+        async def run():
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+        started = time.perf_counter()
+        asyncio.run(run())
+        return time.perf_counter() - started
+
+    def drive_wsgi(self, paths, order, total, concurrency, latencies, errors, record):
+        application = WSGIHandler()
+        counter = iter(range(total))
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    n = next(counter, None)
+                if n is None:
+                    return
+                path = order[n % len(order)]
+                start = time.perf_counter()
+                status = wsgi_get(application, path, paths[path][1], paths[path][0])
+                if record:
+                    with lock:
+                        self._record(latencies, errors, path, status, (time.perf_counter() - start) * 1000)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(worker) for _ in range(concurrency)]:
+                future.result()
+        return time.perf_counter() - started
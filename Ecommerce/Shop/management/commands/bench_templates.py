@@ -0,0 +1,111 @@
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils.safestring import mark_safe
+
+from Shop import cart, recommendations
+from Shop.benchmarks import client_settings, git_revision, isolated_database, latency_summary, seed
+from Shop.catalog import CARD_FIELDS, homepage_fragments, product_page
+from Shop.listing import ListingQuery
+from Shop.models import Cart, Customer, Product
+from Shop.search import search_products
+from Shop.views import listing_context
+
+
+def reset_template_loaders():
+    # forget every compiled template so the next render pays for loading and compiling again
+    for loader in engines['django'].engine.template_loaders:
+        if hasattr(loader, 'reset'):
+            loader.reset()
+
+
+class Command(BaseCommand):
+    help = ('Time rendering each storefront template on its own (no view code or queries inside the '
+            'timed block), anonymous and logged in. "first" is one render with no compiled templates '
+            'and an empty cache; the summary is steady state under the configured loaders.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000, help='Catalog size to seed.')
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--only', nargs='*', help='Scenario names to run.')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+
+    def handle(self, *args, **options):
+        with client_settings(), isolated_database():
+            seed(products=options['products'], users=5, carts=20, orders=20)
+            recommendations.build()
+            report = self.run(options)
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text)
+        else:
+            self.stdout.write(text)
+
+    def scenarios(self, product, user):
+        # name, template, context, logged in; contexts are built here, outside the timing
+        query = ListingQuery(product.category)
+        products, next_cursor = query.products()
+        cards = list(Product.objects.filter(category=product.category).only(*CARD_FIELDS).order_by('id'))
+        page = product_page(product.id)
+        lines = list(Cart.objects.filter(user=user).select_related('product').order_by('id'))
+        listing = listing_context(query, products, next_cursor, query.facets())
+        home = {'sliders': homepage_fragments()}
+        return [
+            ('home', 'Shop/home.html', home, False),
+            ('home-logged-in', 'Shop/home.html', home, True),
+            ('product-slider', 'Shop/product_slider.html', {'products': cards}, False),
+            ('product-info', 'Shop/product_info.html', {'product': product}, False),
+            ('productdetail', 'Shop/productdetail.html',
+             {'product_html': mark_safe(page['html']), 'also_bought_html': mark_safe(page['also_bought']),
+              'product_id': product.id}, False),
+            ('category', 'Shop/category.html', listing, False),
+            ('category-logged-in', 'Shop/category.html', listing, True),
+            ('search', 'Shop/search.html',
+             {'q': product.title.split()[0], 'products': search_products(product.title.split()[0])}, False),
+            ('addtocart', 'Shop/addtocart.html', {'carts': lines, 'totals': cart.summary(user)}, True),
+        ]
+
+    def run(self, options):
+        # a product with a "customers also bought" strip when there is one
+        product = (Product.objects.filter(recommendations__isnull=False).exclude(recommendations__items=[])
+                   .order_by('id').first()
+                   or Product.objects.order_by('id').first())
+        customer = Customer.objects.select_related('user').order_by('id').first()
+        if product is None or customer is None:
+            raise CommandError('Need at least one product and one customer.')
+        factory = RequestFactory()
+        results = []
+        for name, template_name, context, logged_in in self.scenarios(product, customer.user):
+            if options['only'] and name not in options['only']:
+                continue
+            request = factory.get(reverse('home'))
+            request.user = customer.user if logged_in else AnonymousUser()
+            reset_template_loaders()
+            cache.clear()
+            start = time.perf_counter()
+            html = render_to_string(template_name, context, request)
+            first = (time.perf_counter() - start) * 1000
+            timings = []
+            for _ in range(options['iterations']):
+                start = time.perf_counter()
+                render_to_string(template_name, context, request)
+                timings.append((time.perf_counter() - start) * 1000)
+            results.append(dict(name=name, template=template_name, logged_in=logged_in, bytes=len(html),
+                                first_ms=round(first, 3), **latency_summary(timings)))
+        return {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'template_profile': getattr(settings, 'SHOP_TEMPLATE_PROFILE', 'development'),
+            'products': Product.objects.count(),
+            'iterations': options['iterations'],
+            'templates': results,
+        }
@@ -0,0 +1,86 @@
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from Shop.benchmarks import (QueryCounter, budget_allowance, client_settings, git_revision, isolated_database,
+                             latency_summary, returning_visitor, seed, view_scenarios)
+from Shop.models import Customer, Product
+
+
+class Command(BaseCommand):
+    help = ('Time every Shop view through the test client and check its query count against a budget. '
+            'Runs on a throwaway seeded database unless --use-existing-db is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000, help='Catalog size to seed.')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--only', nargs='*', help='Scenario names to run.')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+        parser.add_argument('--use-existing-db', action='store_true',
+                            help='Benchmark the configured database as-is instead of seeding a test one.')
+
+    def handle(self, *args, **options):
+        with client_settings():
+            if options['use_existing_db']:
+                report = self.run(options)
+            else:
+                with isolated_database():
+                    seed(products=options['products'], users=20, carts=100, orders=500)
+                    report = self.run(options)
+
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text)
+        else:
+            self.stdout.write(text)
+
+        failures = [r for r in report['views'] if r['over_budget']]
+        for r in failures:
+            self.stderr.write('%s: %d queries, budget %d' % (r['name'], r['queries_max'], r['query_budget']))
+        if failures:
+            raise CommandError('%d view(s) exceeded their query budget' % len(failures))
+
+    def run(self, options):
+        product = Product.objects.order_by('id').first()
+        customer = Customer.objects.select_related('user').order_by('id').first()
+        if product is None or customer is None:
+            raise CommandError('Need at least one product and one customer, run seed_catalog first.')
+        logged_in = Client()
+        logged_in.force_login(customer.user if customer else User.objects.first())
+        clients = {False: Client(), True: logged_in, 'returning': returning_visitor()}
+
+        results = []
+        for name, method, url_name, args, data, client, budget in view_scenarios(product):
+            if options['only'] and name not in options['only']:
+                continue
+            budget += budget_allowance(client)
+            client = clients[client]
+            url = reverse(url_name, args=args)
+            request = getattr(client, method)
+            # warm-up request fills caches, only steady-state requests are measured
+            status = request(url, data).status_code
+            timings, queries = [], []
+            for _ in range(options['iterations']):
+                with QueryCounter() as counter:
+                    start = time.perf_counter()
+                    request(url, data)
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries.append(counter.count)
+            results.append(dict(
+                name=name, url=url, status=status, query_budget=budget,
+                queries_min=min(queries), queries_max=max(queries), over_budget=max(queries) > budget,
+                **latency_summary(timings)))
+        return {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'products': Product.objects.count(),
+            'session_engine': settings.SESSION_ENGINE,
+            'iterations': options['iterations'],
+            'views': results,
+        }
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Shop import recommendations
+
+
+class Command(BaseCommand):
+    help = ('Fold the orders placed since the last run into the co-purchase counts and refresh the '
+            '"customers also bought" strip of every product that gained a pair. Run it from cron; '
+            'each run only reads the new orders.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=recommendations.CHUNK_SIZE,
+                            help='Order rows read and committed per step.')
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K,
+                            help='Products kept per strip.')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Drop all counts first and start again from the first order.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['top_k'] < 1:
+            raise CommandError('--chunk-size and --top-k must be positive')
+        if options['rebuild']:
+            recommendations.reset()
+        log = self.stderr.write if options['verbosity'] > 1 else None
+        run, changed = recommendations.build(options['chunk_size'], options['top_k'], log=log)
+        self.stdout.write(self.style.SUCCESS(
+            '%d orders (up to #%d), %d new pairs, %d strips updated'
+            % (run.orders, run.last_order_id, run.pairs, len(changed))))
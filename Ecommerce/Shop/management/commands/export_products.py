@@ -0,0 +1,28 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Shop.catalog_io import FORMATS, export_lines, export_queryset, guess_format
+from Shop.models import CATEGORY_CHOICES
+
+
+class Command(BaseCommand):
+    help = 'Stream the catalog out as CSV or JSON lines, in the layout import_products reads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='File to write; stdout when omitted.')
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the --output extension, else csv.')
+        parser.add_argument('--category', choices=[code for code, _ in CATEGORY_CHOICES])
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at a time.')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        fmt = options['format'] or (guess_format(output) if output else 'csv')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        lines = export_lines(export_queryset(options['category']), fmt, chunk_size=options['chunk_size'])
+        if output:
+            with open(output, 'w', encoding='utf-8', newline='') as f:
+                f.writelines(lines)
+        else:
+            sys.stdout.writelines(lines)
@@ -0,0 +1,39 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Shop.catalog_io import BATCH_SIZE, FIELDS, FORMATS, RowError, guess_format, import_products, read_rows
+
+
+class Command(BaseCommand):
+    help = ('Stream a supplier catalog (CSV with a header row, or JSON lines) into Product, upserting on sku '
+            'in batches. Columns: %s. Memory use does not depend on the file size.' % ', '.join(FIELDS))
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file, '-' for stdin.")
+        parser.add_argument('--format', choices=FORMATS, help='Default: guessed from the file extension, csv for stdin.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Validate every row without writing.')
+        parser.add_argument('--strict', action='store_true', help='Stop at the first invalid row instead of skipping it.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path == '-' else guess_format(path))
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        log = (lambda message: self.stderr.write(message)) if options['verbosity'] > 1 else None
+        try:
+            stats = import_products(read_rows(stream, fmt), batch_size=options['batch_size'],
+                                    dry_run=options['dry_run'], strict=options['strict'], log=log)
+        except RowError as exc:
+            # a malformed JSON line, or any invalid row with --strict; batches before it are kept
+            raise CommandError(str(exc))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in stats['errors']:
+            self.stderr.write(error)
+        self.stdout.write(json.dumps(dict(stats, errors=len(stats['errors'])), indent=2))
+        self.stdout.write(self.style.SUCCESS('%s%d created, %d updated, %d invalid rows skipped' % (
+            'Dry run: ' if options['dry_run'] else '', stats['created'], stats['updated'], stats['invalid'])))
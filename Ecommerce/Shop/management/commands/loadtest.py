@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from Shop.benchmarks import client_settings, load_report
+
+DEFAULT_PATHS = ['/', '/category/lehenga/', '/category/saree/?sort=price-asc', '/search/?q=silk']
+
+
+class Command(BaseCommand):
+    help = ('Concurrent load driver: hits the given paths from N threads and reports throughput and '
+            'p50/p95/p99 latency as JSON. Targets a running server with --base-url, or the in-process '
+            'WSGI handler otherwise.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=DEFAULT_PATHS)
+        parser.add_argument('--base-url', help='e.g. http://127.0.0.1:8000; omitted means in-process.')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=1000, help='Total requests across all threads.')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+
+    def handle(self, *args, **options):
+        paths = options['paths']
+        total = options['requests']
+        base_url = (options['base_url'] or '').rstrip('/')
+        local = threading.local()
+        counter = iter(range(total))
+        lock = threading.Lock()
+        latencies = {path: [] for path in paths}
+        errors = {path: 0 for path in paths}
+
+        def fetch(path):
+            if base_url:
+                try:
+                    with urllib.request.urlopen(base_url + path, timeout=30) as response:
+                        response.read()
+                        return response.status
+                except urllib.error.HTTPError as exc:
+                    return exc.code
+                except OSError:
+                    return 0
+            if not hasattr(local, 'client'):
+                # the test client is not thread-safe, one per worker
+                local.client = Client()
+            return local.client.get(path).status_code
+
+        def worker():
+            while True:
+                with lock:
+                    n = next(counter, None)
+                if n is None:
+                    return
+                path = paths[n % len(paths)]
+                start = time.perf_counter()
+                status = fetch(path)
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies[path].append(elapsed)
+                    if not 200 <= status < 400:
+                        errors[path] += 1
+
+        with client_settings():
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                for future in [pool.submit(worker) for _ in range(options['concurrency'])]:
+                    future.result()
+            duration = time.perf_counter() - started
+
+        if not any(latencies.values()):
+            raise CommandError('No requests were made.')
+        report = load_report(latencies, errors, duration, target=base_url or 'in-process',
+                             concurrency=options['concurrency'])
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text)
+        else:
+            self.stdout.write(text)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from Shop import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the on-disk product search index from the database.'
+
+    def handle(self, *args, **options):
+        index = search.build_index()
+        search.store.replace(index)
+        self.stdout.write(self.style.SUCCESS(
+            'Indexed %d products (%d terms) into %s' % (len(index), len(index.postings), search.store.path)))
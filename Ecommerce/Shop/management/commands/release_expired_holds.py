@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Shop import inventory
+
+
+class Command(BaseCommand):
+    help = ('Return the units of expired cart holds to stock. Run it from cron every minute or so; '
+            'a cart whose hold expired takes its units again at checkout, if they are still there.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        released = inventory.release_expired(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('%d held units returned to stock' % released))
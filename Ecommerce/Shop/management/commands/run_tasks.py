@@ -0,0 +1,57 @@
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from Shop import taskqueue
+
+
+class Command(BaseCommand):
+    help = ('Background task worker: claims due tasks from the Shop task table and runs them on a thread '
+            'pool, retrying failures with exponential backoff. Several workers (processes or hosts) can run '
+            'side by side, a task is only ever claimed by one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Most tasks of one kind handed to a handler at once (one SMTP connection per batch).')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when idle.')
+        parser.add_argument('--once', action='store_true', help='Run every due task, then exit.')
+        parser.add_argument('--keep-days', type=int, default=7, help='Finished tasks older than this are deleted.')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            done, failed = taskqueue.run_pending(options['batch_size'])
+            self.stdout.write('%d done, %d failed for good' % (done, failed))
+            return
+
+        stopping = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stopping.set())
+
+        threads = options['threads']
+        batch_size = options['batch_size']
+        keep = timedelta(days=options['keep_days'])
+        last_housekeeping = 0.0
+        self.stdout.write('Task worker started with %d threads' % threads)
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='shop-task') as pool:
+            while not stopping.is_set():
+                if time.monotonic() - last_housekeeping > 60:
+                    taskqueue.requeue_stale()
+                    taskqueue.purge_finished(keep)
+                    last_housekeeping = time.monotonic()
+                # enough work for every thread; the next claim waits until this round is done
+                claimed = taskqueue.claim(threads * batch_size)
+                if not claimed:
+                    stopping.wait(options['poll_interval'])
+                    continue
+                futures = [pool.submit(taskqueue.run_in_thread, name, group)
+                           for name, group in taskqueue.batches(claimed, batch_size)]
+                for future in futures:
+                    done, failed = future.result()
+                    if failed:
+                        self.stderr.write('%d task(s) failed for good' % failed)
+        self.stdout.write('Task worker stopped')
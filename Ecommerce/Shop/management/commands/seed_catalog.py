@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from Shop.benchmarks import seed
+
+
+class Command(BaseCommand):
+    help = 'Insert a synthetic catalog (plus users, carts and orders) for benchmarking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--carts', type=int, default=500)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same data.')
+        parser.add_argument('--skip-search-index', action='store_true',
+                            help='Do not rebuild the search index afterwards (slow above ~500k products).')
+
+    def handle(self, *args, **options):
+        created = seed(
+            products=options['products'], users=options['users'], carts=options['carts'],
+            orders=options['orders'], batch_size=options['batch_size'], seed_value=options['seed'],
+            index=not options['skip_search_index'],
+            log=lambda message: self.stdout.write(message) if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(', '.join('%d %s' % (n, name) for name, n in created.items())))
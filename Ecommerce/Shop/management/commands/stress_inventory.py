@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.db.models import Sum
+
+from Shop import cart, inventory
+from Shop.benchmarks import client_settings, git_revision, isolated_database, latency_summary, seed
+from Shop.checkout import CheckoutError, place_order
+from Shop.models import Cart, Checkout, Customer, OrderPlaced, Product, StockHold
+
+
+class Command(BaseCommand):
+    help = ('Have many threads buy the same product until it sells out, on a throwaway on-disk database, '
+            'and check that exactly the stocked units were sold: none oversold, none lost. Reports '
+            'purchases/sec and latency per shard count, to see what sharding a hot product buys.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--stock', type=int, default=2000, help='Units stocked before each run.')
+        parser.add_argument('--shards', type=int, nargs='+', default=[1, 8],
+                            help='Shard counts to compare, one run each.')
+        parser.add_argument('--checkout', action='store_true',
+                            help='Place a whole order per unit (cart, checkout) instead of only reserving it.')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['stock'] < 0 or min(options['shards']) < 1:
+            raise CommandError('--threads and --shards must be positive, --stock not negative')
+        with client_settings(), isolated_database(on_disk=True):
+            seed(products=1, users=options['threads'], carts=0, orders=0, index=False)
+            product = Product.objects.get()
+            customers = list(Customer.objects.select_related('user').order_by('id'))
+            runs = [self.run(product, customers, shards, options) for shards in options['shards']]
+
+        report = {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'vendor': connection.vendor,
+            'threads': options['threads'],
+            'stock': options['stock'],
+            'mode': 'checkout' if options['checkout'] else 'reserve',
+            'runs': runs,
+        }
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text)
+        else:
+            self.stdout.write(text)
+
+        failures = [run for run in runs if run['oversold'] or run['lost'] or run['undersold']]
+        for run in failures:
+            self.stderr.write('%d shards: %d oversold, %d lost, %d undersold'
+                              % (run['shards'], run['oversold'], run['lost'], run['undersold']))
+        if failures:
+            raise CommandError('stock accounting broke in %d run(s)' % len(failures))
+
+    def buy(self, customer, product, checkout):
+        # one unit; False once the product is sold out
+        try:
+            if not checkout:
+                inventory.reserve(customer.user, product.id)
+                return True
+            cart.add_item(customer.user, product.id)
+            place_order(customer.user, customer.id, uuid.uuid4().hex)
+            return True
+        except (inventory.OutOfStock, CheckoutError):
+            return False
+
+    def run(self, product, customers, shards, options):
+        for model in (StockHold, Cart, OrderPlaced, Checkout):
+            model.objects.all().delete()
+        inventory.set_stock(product.id, options['stock'], shards)
+
+        latencies, sold, errors = [], [0], [0]
+        lock = threading.Lock()
+
+        def worker(customer):
+            mine = []
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        bought = self.buy(customer, product, options['checkout'])
+                    except OperationalError:
+                        # a lock wait that ran out; counted and tried again
+                        with lock:
+                            errors[0] += 1
+                        continue
+                    mine.append((time.perf_counter() - start) * 1000)
+                    if not bought:
+                        break
+                    with lock:
+                        sold[0] += 1
+            finally:
+                connection.close()
+                with lock:
+                    latencies.extend(mine)
+
+        threads = [threading.Thread(target=worker, args=(customer,)) for customer in customers]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - started
+
+        remaining = inventory.available(product.id) or 0
+        if options['checkout']:
+            taken = OrderPlaced.objects.aggregate(units=Sum('quantity'))['units'] or 0
+        else:
+            taken = StockHold.objects.aggregate(units=Sum('quantity'))['units'] or 0
+        return dict(
+            shards=shards, sold=sold[0], recorded=taken, remaining=remaining, lock_errors=errors[0],
+            oversold=max(sold[0] - options['stock'], 0),
+            # every unit is either still in stock or recorded against exactly one successful buyer
+            lost=abs(options['stock'] - remaining - taken) + abs(taken - sold[0]),
+            # every thread stopped on "sold out", so nothing may be left
+            undersold=remaining,
+            duration_s=round(duration, 3), per_sec=round(sold[0] / duration, 1) if duration else 0.0,
+            **latency_summary(latencies))
@@ -0,0 +1,26 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = ('Copy the primary SQLite database into the replica file with the online backup API, '
+            'so a local two-file setup can stand in for a primary/replica pair.')
+
+    def handle(self, *args, **options):
+        if 'replica' not in connections.settings:
+            raise CommandError('No replica configured, set DB_REPLICA_NAME.')
+        primary, replica = connections['default'], connections['replica']
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('Only SQLite replicas can be synced this way.')
+        replica.close()
+        source = sqlite3.connect(primary.settings_dict['NAME'])
+        target = sqlite3.connect(replica.settings_dict['NAME'])
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        self.stdout.write(self.style.SUCCESS('Replica %s refreshed from %s' % (
+            replica.settings_dict['NAME'], primary.settings_dict['NAME'])))
@@ -0,0 +1,42 @@
+import os
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Shop.staticfiles import VENDOR, integrity
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'static')
+
+
+class Command(BaseCommand):
+    help = ('Download the pinned third-party files in Shop.staticfiles.VENDOR (Bootstrap, jQuery) into '
+            'Shop/static, refusing any whose content does not match its SRI digest. Commit the files, '
+            'then collectstatic bundles them and the CDN links disappear from base.html.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Download files that are already there.')
+        parser.add_argument('--timeout', type=float, default=30)
+
+    def handle(self, *args, **options):
+        failed = []
+        for name, (url, expected) in VENDOR.items():
+            path = os.path.join(STATIC_DIR, *name.split('/'))
+            if os.path.exists(path) and not options['force']:
+                self.stdout.write('%s: already vendored' % name)
+                continue
+            try:
+                with urllib.request.urlopen(url, timeout=options['timeout']) as response:
+                    content = response.read()
+            except OSError as exc:
+                failed.append('%s: %s' % (url, exc))
+                continue
+            actual = integrity(content, expected.split('-', 1)[0])
+            if actual != expected:
+                failed.append('%s: digest %s, expected %s' % (url, actual, expected))
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.stdout.write(self.style.SUCCESS('%s: %d bytes from %s' % (name, len(content), url)))
+        if failed:
+            raise CommandError('not vendored:\n  ' + '\n  '.join(failed))
@@ -0,0 +1,296 @@
+import cProfile
+import json
+import mimetypes
+import os
+import random
+import time
+from contextlib import ExitStack
+from functools import partial
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import SESSION_KEY, middleware as auth_middleware
+from django.contrib.sessions import middleware as sessions
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date
+
+from Ecommerce.database import request_state
+
+from .instrumentation import RequestSample, current_sample, install_template_timer, registry, slow_profiles
+
+# anonymous GET/HEAD requests to these url names never write a session
+SESSIONLESS_VIEWS = ('home', 'product-detail', 'category', 'lehenga', 'lehengaitem', 'search', 'search-autocomplete',
+                     'address-districts', 'address-thanas', 'address-zipcode')
+
+
+class PerformanceMiddleware:
+    # Per-view wall, DB and template timings with Server-Timing headers; keep it first in MIDDLEWARE
+    # so session and auth queries are counted too. Aggregates are served by the /_metrics/ views.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SHOP_INSTRUMENTATION', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.profile_rate = getattr(settings, 'SHOP_PROFILE_SAMPLE_RATE', 0.0)
+        slow_profiles.keep = getattr(settings, 'SHOP_PROFILE_KEEP', slow_profiles.keep)
+        install_template_timer()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _profiler(self):
+        return cProfile.Profile() if self.profile_rate and random.random() < self.profile_rate else None
+
+    @staticmethod
+    def _watch_connections(sample):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(sample))
+        return stack
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        sample = RequestSample()
+        token = current_sample.set(sample)
+        profiler = self._profiler()
+        start = time.perf_counter()
+        try:
+            with self._watch_connections(sample):
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            current_sample.reset(token)
+        return self._finish(request, response, sample, profiler, start)
+
+    async def __acall__(self, request):
+        sample = RequestSample()
+        token = current_sample.set(sample)
+        profiler = self._profiler()
+        start = time.perf_counter()
+        try:
+            # Connections are per thread and the ORM runs on the request's sync worker thread,
+            # so the query wrappers are installed (and removed) from that thread.
+            stack = await sync_to_async(self._watch_connections)(sample)
+            try:
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = await self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+            finally:
+                await sync_to_async(stack.close)()
+        finally:
+            current_sample.reset(token)
+        return self._finish(request, response, sample, profiler, start)
+
+    def _finish(self, request, response, sample, profiler, start):
+        wall_ms = (time.perf_counter() - start) * 1000
+
+        match = request.resolver_match
+        view_name = (match.view_name or match._func_path) if match else 'unresolved'
+        registry.record(view_name, wall_ms, sample)
+        if profiler is not None:
+            slow_profiles.add(wall_ms, view_name, request.path, profiler)
+
+        response['Server-Timing'] = ', '.join([
+            'db;dur=%.2f;desc="%d queries, %d duplicate"' % (sample.db_time * 1000, sample.queries,
+                                                            sample.duplicate_queries),
+            'tpl;dur=%.2f' % (sample.template_time * 1000),
+            'total;dur=%.2f' % wall_ms,
+        ])
+        return response
+
+
+class StaticFilesMiddleware:
+    # Serves collectstatic output from STATIC_ROOT without a separate web server: picks the .br or
+    # .gz sibling the client accepts, and marks content-hashed names (the values of staticfiles.json)
+    # immutable for a year. Unhashed names get a short max-age and Last-Modified revalidation.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        root = getattr(settings, 'STATIC_ROOT', None)
+        if not root or not getattr(settings, 'SHOP_SERVE_STATIC', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.root = os.path.abspath(root)
+        self.prefix = urlsplit(settings.STATIC_URL).path
+        self.max_age = getattr(settings, 'SHOP_STATIC_MAX_AGE', 60)
+        self._files = None
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @property
+    def files(self):
+        # {name: (path, mtime, {encoding: path})} and the hashed names, read once from STATIC_ROOT;
+        # restart the process after collectstatic
+        if self._files is None:
+            self._files = self.scan()
+        return self._files
+
+    def scan(self):
+        files = {}
+        suffixes = {'.br': 'br', '.gz': 'gzip'}
+        for directory, _, names in os.walk(self.root):
+            for filename in names:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if os.path.splitext(name)[1] in suffixes:
+                    continue
+                encoded = {encoding: path + s for s, encoding in suffixes.items() if os.path.exists(path + s)}
+                files[name] = (path, os.path.getmtime(path), encoded)
+        hashed = set()
+        manifest = os.path.join(self.root, 'staticfiles.json')
+        if os.path.exists(manifest):
+            with open(manifest, encoding='utf-8') as f:
+                hashed = set(json.load(f).get('paths', {}).values())
+        return files, hashed
+
+    def lookup(self, request):
+        if request.method not in ('GET', 'HEAD') or not request.path_info.startswith(self.prefix):
+            return None
+        files, hashed = self.files
+        name = request.path_info[len(self.prefix):]
+        if name not in files:
+            return None
+        return name, files[name], name in hashed
+
+    def serve(self, request, match):
+        name, (path, mtime, encoded), immutable = match
+        if not immutable:
+            response = get_conditional_response(request, last_modified=int(mtime))
+            if response is not None:
+                return response
+        accepted = request.headers.get('Accept-Encoding', '')
+        encoding = next((e for e in ('br', 'gzip') if e in encoded and e in accepted), None)
+        content_type, _ = mimetypes.guess_type(name)
+        response = FileResponse(open(encoded[encoding] if encoding else path, 'rb'),
+                                content_type=content_type or 'application/octet-stream')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if encoded:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        if immutable:
+            response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response['Cache-Control'] = 'public, max-age=%d' % self.max_age
+            response['Last-Modified'] = http_date(mtime)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        match = self.lookup(request)
+        if match is not None:
+            return self.serve(request, match)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        match = self.lookup(request)
+        if match is not None:
+            return self.serve(request, match)
+        return await self.get_response(request)
+
+
+class PrimaryReadsMiddleware:
+    # Read-your-writes with a replica: a request that wrote reads from the primary from then on,
+    # and sets a short-lived cookie that keeps that browser's next requests (the page after a
+    # POST redirect, say) on the primary until the replica has caught up. Unused without a replica.
+    sync_capable = True
+    async_capable = True
+    cookie_name = 'shop_primary'
+
+    def __init__(self, get_response):
+        if 'replica' not in connections.settings:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'SHOP_REPLICA_PIN_SECONDS', 15)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _finish(self, state, response):
+        if state['wrote']:
+            response.set_cookie(self.cookie_name, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = {'pinned': self.cookie_name in request.COOKIES, 'wrote': False}
+        token = request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_state.reset(token)
+        return self._finish(state, response)
+
+    async def __acall__(self, request):
+        # the state dict is shared, so writes made on the ORM's worker thread are seen here
+        state = {'pinned': self.cookie_name in request.COOKIES, 'wrote': False}
+        token = request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_state.reset(token)
+        return self._finish(state, response)
+
+
+class SessionMiddleware(sessions.SessionMiddleware):
+    # Django's SessionMiddleware, except that anonymous GET/HEAD requests to the catalog pages
+    # (SHOP_SESSIONLESS_VIEWS) never save a session: no django_session write and no Set-Cookie
+    # for browsing traffic. Flows that need an anonymous session (password reset) are not listed.
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.sessionless = frozenset(getattr(settings, 'SHOP_SESSIONLESS_VIEWS', SESSIONLESS_VIEWS))
+
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        match = request.resolver_match
+        # a modified session is already loaded, so the SESSION_KEY check costs nothing
+        if (session is not None and session.modified and request.method in ('GET', 'HEAD')
+                and match is not None and match.url_name in self.sessionless and SESSION_KEY not in session):
+            session.modified = False
+        return super().process_response(request, response)
+
+
+class AuthenticationMiddleware(auth_middleware.AuthenticationMiddleware):
+    # request.user and request.auser() share one loaded user. Django memoizes them separately,
+    # so an async view awaiting auser() and then rendering a template that reads request.user
+    # loaded the session and the user twice.
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(partial(self.load_user, request))
+        request.auser = partial(self.aload_user, request)
+
+    @staticmethod
+    def load_user(request):
+        if not hasattr(request, '_cached_user'):
+            if hasattr(request, '_acached_user'):
+                request._cached_user = request._acached_user
+            else:
+                request._cached_user = auth.get_user(request)
+        return request._cached_user
+
+    @staticmethod
+    async def aload_user(request):
+        if not hasattr(request, '_acached_user'):
+            if hasattr(request, '_cached_user'):
+                request._acached_user = request._cached_user
+            else:
+                request._acached_user = await auth.aget_user(request)
+        return request._acached_user
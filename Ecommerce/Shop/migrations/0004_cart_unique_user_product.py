@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:44
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # fold duplicate (user, product) rows into the oldest one before the constraint is added
+    Cart = apps.get_model('Shop', 'Cart')
+    duplicates = (Cart.objects.values('user_id', 'product_id')
+                  .annotate(n=Count('id'), keep=Min('id'), total=Sum('quantity')).filter(n__gt=1))
+    for row in duplicates:
+        lines = Cart.objects.filter(user_id=row['user_id'], product_id=row['product_id'])
+        lines.filter(id=row['keep']).update(quantity=row['total'])
+        lines.exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shop', '0003_product_image_derivatives'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_cart_user_product'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def normalise_status(apps, schema_editor):
+    # anything outside STATUS_CHOICE (the old default) becomes the now-valid 'Pending'
+    OrderPlaced = apps.get_model('Shop', 'OrderPlaced')
+    valid = ['Pending', 'Accepted', 'Packed', 'On the Way', 'Delivered', 'Cancel']
+    OrderPlaced.objects.exclude(status__in=valid).update(status='Pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shop', '0005_checkout'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(normalise_status, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderplaced',
+            name='status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Accepted', 'Accepted'), ('Packed', 'Packed'), ('On the Way', 'On the Way'), ('Delivered', 'Delivered'), ('Cancel', 'Cancel')], default='Pending', max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='orderplaced',
+            index=models.Index(fields=['user', '-ordered_date', '-id'], name='order_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderplaced',
+            index=models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:23
+
+import django.core.validators
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def price_catalog(apps, schema_editor):
+    # no category rules exist yet, so every effective price is the discounted price
+    Product = apps.get_model('Shop', 'Product')
+    Product.objects.update(effective_price=F('discounted_price'))
+    # the promotion home.html has always advertised
+    PricingRule = apps.get_model('Shop', 'PricingRule')
+    PricingRule.objects.create(name="10% Instant Discount above 10,000 TK's product buy", kind='cart',
+                               percent=Decimal('10'), min_subtotal=Decimal('10000'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shop', '0010_admin_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PricingRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('kind', models.CharField(choices=[('category', 'Category discount'), ('cart', 'Cart discount')], max_length=10)),
+                ('category', models.CharField(blank=True, choices=[('L', 'Lehenga'), ('S', 'Saree'), ('GP', 'Gents Pant'), ('BK', 'Borkha'), ('BF', 'Baby Fashion')], max_length=2)),
+                ('percent', models.DecimalField(decimal_places=2, max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)])),
+                ('min_subtotal', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('active', models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_category_price_idx',
+        ),
+        migrations.AddField(
+            model_name='checkout',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='orderplaced',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='discounted_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='selling_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'effective_price'], name='product_category_eff_price_idx'),
+        ),
+        migrations.RunPython(price_catalog, migrations.RunPython.noop),
+    ]
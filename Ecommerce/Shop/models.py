@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.utils import timezone
 # Create your models here.
 DIVISION_CHOICES = (
     ('Dhaka','Dhaka'),
@@ -20,7 +23,12 @@ class Customer(models.Model):
     thana = models.CharField(max_length=50)
     villorroad = models.CharField(max_length=50)
     zipcode = models.IntegerField()
-    
+
+    class Meta:
+        indexes = [
+            # admin list_filter
+            models.Index(fields=['division'], name='customer_division_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
@@ -36,29 +44,80 @@ CATEGORY_CHOICES = (
 )
 
 class Product(models.Model):
+    # supplier stock-keeping unit; bulk imports upsert on it, products added by hand may have none
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     title = models.CharField(max_length=100)
-    selling_price = models.FloatField()
-    discounted_price = models.FloatField()
+    selling_price = models.DecimalField(max_digits=10, decimal_places=2)
+    discounted_price = models.DecimalField(max_digits=10, decimal_places=2)
+    # discounted_price after the active category PricingRule; what listings show, sort and filter on
+    # and what carts charge. Kept current by Shop.pricing (on save and in bulk when rules change).
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
     description = models.TextField()
     brand = models.CharField(max_length=100)
     category = models.CharField(choices=CATEGORY_CHOICES,max_length=2)
     product_image = models.ImageField(upload_to='productimg')
+    # set by Shop.images once the resized derivatives of product_image exist
+    image_digest = models.CharField(max_length=64, blank=True, default='', editable=False)
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # category listings filter/facet on brand and sort/range on price
+            models.Index(fields=['category', 'brand'], name='product_category_brand_idx'),
+            models.Index(fields=['category', 'effective_price'], name='product_category_eff_price_idx'),
+            # admin brand filter and search across categories
+            models.Index(fields=['brand'], name='product_brand_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
 
 
+PRICING_RULE_KINDS = (
+    ('category', 'Category discount'),
+    ('cart', 'Cart discount'),
+)
+
+
+class PricingRule(models.Model):
+    # Promotions applied by Shop.pricing. A category rule takes percent off the discounted price of
+    # every product in its category (the best active rule wins); a cart rule takes percent off a
+    # cart subtotal of at least min_subtotal (again the best one that applies).
+    name = models.CharField(max_length=100)
+    kind = models.CharField(max_length=10, choices=PRICING_RULE_KINDS)
+    category = models.CharField(choices=CATEGORY_CHOICES, max_length=2, blank=True)
+    percent = models.DecimalField(max_digits=5, decimal_places=2,
+                                  validators=[MinValueValidator(0), MaxValueValidator(100)])
+    min_subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    active = models.BooleanField(default=True)
+
+    def clean(self):
+        if self.kind == 'category' and not self.category:
+            raise ValidationError({'category': 'A category rule needs a category.'})
+
+    def __str__(self):
+        return self.name
+
+
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            # one line per product, quantity changes go through F() updates
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_cart_user_product'),
+        ]
+
     def __str__(self):
         return str(self.id)
 
 
 
 STATUS_CHOICE = (
+    ('Pending','Pending'),
     ('Accepted','Accepted'),
     ('Packed','Packed'),
     ('On the Way', 'On the Way'),
@@ -66,12 +125,137 @@ STATUS_CHOICE = (
     ('Cancel','Cancel')
 )
 
+class Checkout(models.Model):
+    # one row per placed order; the key makes retried POSTs return the same order
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    idempotency_key = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # cart PricingRule discount taken off the order subtotal
+    discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], name='unique_checkout_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return str(self.id)
+
+
 class OrderPlaced(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    checkout = models.ForeignKey(Checkout, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    # effective price when the order was placed; empty for orders from before pricing rules
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     ordered_date = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=50, choices=STATUS_CHOICE, default='Pending')
 
+    class Meta:
+        indexes = [
+            # order history pages walk (user, ordered_date desc); status filters stay within a user
+            models.Index(fields=['user', '-ordered_date', '-id'], name='order_user_date_idx'),
+            models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+        ]
+
+
+class ProductStock(models.Model):
+    # Units of a product that can still be reserved; units held in carts are already taken off.
+    # A product without rows is not stock-tracked and can always be bought. Hot products are
+    # spread over several shard rows so concurrent reservations update different rows
+    # (see Shop/inventory.py). The CHECK constraint of the positive field is the last guard
+    # against overselling.
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock')
+    shard = models.PositiveSmallIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='productstock_shard_unique'),
+        ]
 
+
+class StockHold(models.Model):
+    # units reserved for a cart until expires_at; checkout turns them into the order and
+    # `manage.py release_expired_holds` returns the expired ones to their shard
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField(default=0)
+    quantity = models.PositiveIntegerField(default=1)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'product'], name='stockhold_user_product_idx'),
+            models.Index(fields=['expires_at'], name='stockhold_expires_idx'),
+        ]
+
+
+class CoPurchase(models.Model):
+    # how many baskets (checkouts) held both products; every pair is stored in both directions so a
+    # product's strongest partners are one range scan of copurchase_top_idx. Built by
+    # `manage.py build_recommendations`.
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='co_purchases')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='copurchase_pair_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-count', 'other'], name='copurchase_top_idx'),
+        ]
+
+
+class ProductRecommendations(models.Model):
+    # top co-purchased product ids, strongest first; the detail page reads this one row
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='recommendations')
+    items = models.JSONField(default=list)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+
+class RecommendationRun(models.Model):
+    # one build_recommendations run; the highest last_order_id is where the next run starts
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_order_id = models.BigIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+    pairs = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return 'Recommendations up to order #%s' % self.last_order_id
+
+
+TASK_STATUS_CHOICES = (
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
+
+
+class Task(models.Model):
+    # background job row, see Shop/taskqueue.py; workers claim queued rows whose run_after has passed
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=TASK_STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    claim = models.CharField(max_length=32, blank=True, default='')
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='task_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return '%s #%s' % (self.name, self.id)
@@ -0,0 +1,47 @@
+from django.db.models import Count, Q
+from django.utils.dateparse import parse_datetime
+
+from .listing import decode_cursor, pack_cursor
+from .models import STATUS_CHOICE, OrderPlaced
+
+PAGE_SIZE = 20
+STATUSES = [value for value, _ in STATUS_CHOICE]
+
+
+def _cursor_key(cursor):
+    # (ordered_date, id) from a cursor made by order_history; None, so the first page is shown,
+    # for anything else
+    key = decode_cursor(cursor)
+    if not isinstance(key, list) or len(key) != 2 or not isinstance(key[0], str):
+        return None
+    if not isinstance(key[1], int) or isinstance(key[1], bool):
+        return None
+    try:
+        ordered_date = parse_datetime(key[0])
+    except ValueError:
+        return None
+    return (ordered_date, key[1]) if ordered_date else None
+
+
+def order_history(user, status=None, cursor=None, page_size=PAGE_SIZE):
+    # newest first, keyset-paginated on (ordered_date, id) along order_user_date_idx
+    orders = OrderPlaced.objects.filter(user=user).select_related('product', 'customer')
+    if status in STATUSES:
+        orders = orders.filter(status=status)
+    key = _cursor_key(cursor) if cursor else None
+    if key:
+        ordered_date, last_id = key
+        orders = orders.filter(Q(ordered_date__lt=ordered_date) | Q(ordered_date=ordered_date, id__lt=last_id))
+    page = list(orders.order_by('-ordered_date', '-id')[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        last = page[page_size - 1]
+        next_cursor = pack_cursor([last.ordered_date.isoformat(), last.id])
+    return page[:page_size], next_cursor
+
+
+def status_counts(user):
+    # every STATUS_CHOICE count in one aggregate query
+    totals = OrderPlaced.objects.filter(user=user).aggregate(
+        **{'s%d' % i: Count('id', filter=Q(status=status)) for i, status in enumerate(STATUSES)})
+    return [(status, totals['s%d' % i]) for i, status in enumerate(STATUSES)]
@@ -0,0 +1,91 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Case, DecimalField, F, Q, When
+from django.db.models.functions import Now, Round
+
+from .catalog import invalidate_products
+from .models import PricingRule, Product
+
+RULES_KEY = 'shop:pricing:rules'
+# every process reloads within this long of a rule change made elsewhere
+RULES_TIMEOUT = 60
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+
+def money(value):
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def load_rules():
+    # {'category': {code: best percent}, 'cart': [(min_subtotal, percent, name)] by threshold}
+    rules = {'category': {}, 'cart': []}
+    for rule in PricingRule.objects.filter(active=True).order_by('id'):
+        if rule.kind == 'category':
+            best = rules['category'].get(rule.category, ZERO)
+            rules['category'][rule.category] = max(best, rule.percent)
+        else:
+            rules['cart'].append((rule.min_subtotal, rule.percent, rule.name))
+    rules['cart'].sort()
+    return rules
+
+
+def active_rules():
+    rules = cache.get(RULES_KEY)
+    if rules is None:
+        rules = load_rules()
+        cache.set(RULES_KEY, rules, RULES_TIMEOUT)
+    return rules
+
+
+async def aactive_rules():
+    rules = await cache.aget(RULES_KEY)
+    if rules is None:
+        rules = await sync_to_async(load_rules)()
+        await cache.aset(RULES_KEY, rules, RULES_TIMEOUT)
+    return rules
+
+
+def effective_price(category, discounted_price, rules=None):
+    percent = (rules or active_rules())['category'].get(category)
+    if not percent:
+        return money(discounted_price)
+    return money(Decimal(discounted_price) * (100 - percent) / 100)
+
+
+def effective_price_expression(rules=None):
+    # Product.effective_price for every row at once: one CASE over the categories with a rule
+    whens = [When(category=category, then=Round(F('discounted_price') * (100 - percent) / 100, 2))
+             for category, percent in sorted((rules or active_rules())['category'].items()) if percent]
+    output = DecimalField(max_digits=10, decimal_places=2)
+    if not whens:
+        return F('discounted_price')
+    return Case(*whens, default=F('discounted_price'), output_field=output)
+
+
+def reprice(queryset=None, rules=None):
+    # One UPDATE that recomputes effective_price wherever it is out of date (rules changed, or
+    # prices written by a bulk path that skips Product.save). Returns the number of rows changed;
+    # callers invalidate the catalog caches when it is not zero.
+    queryset = Product.objects.all() if queryset is None else queryset
+    expression = effective_price_expression(rules or load_rules())
+    return (queryset.order_by().filter(~Q(effective_price=expression))
+            .update(effective_price=expression, updated_at=Now()))
+
+
+def rules_changed():
+    cache.delete(RULES_KEY)
+    if reprice():
+        invalidate_products()
+
+
+def cart_discount(subtotal, rules=None):
+    # best cart rule whose threshold the subtotal reaches, as (amount, rule name)
+    best = (ZERO, '')
+    for min_subtotal, percent, name in (rules or active_rules())['cart']:
+        if subtotal >= min_subtotal:
+            amount = money(subtotal * percent / 100)
+            best = max(best, (amount, name))
+    return best
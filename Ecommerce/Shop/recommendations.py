@@ -0,0 +1,182 @@
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from itertools import combinations
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max
+from django.db.models.functions import RowNumber
+from django.db.models.expressions import Window
+from django.utils import timezone
+
+from Ecommerce.database import bulk_upsert
+
+from .catalog import invalidate_product_pages, invalidate_products
+from .models import CoPurchase, OrderPlaced, ProductRecommendations, RecommendationRun
+
+# products kept per "customers also bought" strip
+TOP_K = getattr(settings, 'SHOP_RECOMMENDATIONS_TOP_K', 8)
+CHUNK_SIZE = 5000
+# ids per IN (...) list, well under SQLite's bound parameter limit
+IN_BATCH = 500
+ORDER_FIELDS = ('id', 'checkout_id', 'user_id', 'ordered_date', 'product_id')
+
+
+def _batches(values, size=IN_BATCH):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def basket_key(row):
+    # the rows of one checkout; orders placed before checkouts were recorded are grouped per
+    # customer and (UTC) day
+    if row['checkout_id'] is not None:
+        return ('checkout', row['checkout_id'])
+    return ('day', row['user_id'], row['ordered_date'].date())
+
+
+def watermark():
+    return RecommendationRun.objects.aggregate(last=Max('last_order_id'))['last'] or 0
+
+
+def _earlier_items(keys, before_id):
+    # {basket: product ids} already counted for the baskets in keys (rows up to before_id)
+    earlier = defaultdict(set)
+    if not before_id:
+        return earlier
+    rows = OrderPlaced.objects.filter(id__lte=before_id).values_list(*ORDER_FIELDS[1:]).order_by()
+    checkouts = [key[1] for key in keys if key[0] == 'checkout']
+    days = [key for key in keys if key[0] == 'day']
+    queries = [rows.filter(checkout_id__in=batch) for batch in _batches(checkouts)]
+    if days:
+        # a plain datetime range, so order_user_date_idx serves it
+        first = datetime.combine(min(day for _, _, day in days), time.min, dt_timezone.utc)
+        last = datetime.combine(max(day for _, _, day in days) + timedelta(days=1), time.min, dt_timezone.utc)
+        users = {user_id for _, user_id, _ in days}
+        queries += [rows.filter(checkout__isnull=True, user_id__in=batch, ordered_date__gte=first,
+                                ordered_date__lt=last) for batch in _batches(users)]
+    for query in queries:
+        for checkout_id, user_id, ordered_date, product_id in query:
+            key = basket_key({'checkout_id': checkout_id, 'user_id': user_id, 'ordered_date': ordered_date})
+            if key in keys:
+                earlier[key].add(product_id)
+    return earlier
+
+
+def count_pairs(rows, before_id):
+    # {(a, b): baskets} with a < b, for the pairs these order rows add. A basket counts a pair once,
+    # however its rows are split across runs and chunks: only pairs with a newly seen product are new.
+    baskets = defaultdict(set)
+    for row in rows:
+        baskets[basket_key(row)].add(row['product_id'])
+    earlier = _earlier_items(baskets.keys(), before_id)
+    pairs = Counter()
+    for key, products in baskets.items():
+        seen = earlier.get(key, set())
+        new = products - seen
+        for a, b in combinations(sorted(new), 2):
+            pairs[a, b] += 1
+        for a in new:
+            for b in seen:
+                pairs[min(a, b), max(a, b)] += 1
+    return pairs
+
+
+def add_pairs(pairs):
+    # adds the counts to CoPurchase in both directions; returns the products whose partners changed
+    directed = Counter()
+    for (a, b), n in pairs.items():
+        directed[a, b] += n
+        directed[b, a] += n
+    by_product = defaultdict(set)
+    for a, b in directed:
+        by_product[a].add(b)
+
+    existing = {}
+    for batch in _batches(by_product):
+        others = set().union(*(by_product[a] for a in batch))
+        for row in CoPurchase.objects.filter(product_id__in=batch, other_id__in=others):
+            if (row.product_id, row.other_id) in directed:
+                existing[row.product_id, row.other_id] = row
+    for key, row in existing.items():
+        row.count += directed[key]
+    CoPurchase.objects.bulk_update(existing.values(), ['count'], batch_size=1000)
+    CoPurchase.objects.bulk_create(
+        [CoPurchase(product_id=a, other_id=b, count=n) for (a, b), n in directed.items() if (a, b) not in existing],
+        batch_size=1000)
+    return set(by_product)
+
+
+def refresh_top(product_ids, k=TOP_K):
+    # rewrites ProductRecommendations for these products from the pair counts, one windowed query
+    # per batch; returns the products whose strip actually changed
+    changed = set()
+    now = timezone.now()
+    for batch in _batches(sorted(product_ids)):
+        ranked = (CoPurchase.objects.filter(product_id__in=batch)
+                  .annotate(rank=Window(RowNumber(), partition_by=F('product_id'),
+                                        order_by=(F('count').desc(), F('other_id').asc())))
+                  .filter(rank__lte=k).order_by('product_id', 'rank').values_list('product_id', 'other_id'))
+        top = defaultdict(list)
+        for product_id, other_id in ranked:
+            top[product_id].append(other_id)
+        current = dict(ProductRecommendations.objects.filter(product_id__in=batch).values_list('product_id', 'items'))
+        rows = [ProductRecommendations(product_id=pk, items=top[pk], updated_at=now)
+                for pk in batch if current.get(pk, []) != top[pk]]
+        bulk_upsert(ProductRecommendations, rows, ['product'], ['items', 'updated_at'])
+        changed.update(row.product_id for row in rows)
+    return changed
+
+
+def _lock_runs():
+    # Row lock on the oldest run, which every build takes before reading the watermark, so
+    # overlapping runs (two cron jobs, say) fold one chunk at a time and never count an order
+    # twice. SQLite has no row locks but takes the database write lock at BEGIN (IMMEDIATE).
+    RecommendationRun.objects.select_for_update().order_by('id').values_list('id', flat=True).first()
+
+
+def build(chunk_size=CHUNK_SIZE, k=TOP_K, log=None):
+    # Folds the orders placed since the last run into the pair counts chunk by chunk, refreshing
+    # the top-k of every product that gained a pair. Each chunk commits together with the run's
+    # new watermark, so an interrupted run loses nothing and the next one resumes after it.
+    # Ids are the watermark: on PostgreSQL and MySQL an id is handed out before its transaction
+    # commits, so an order that commits after a run has moved past its id is never counted.
+    # Checkouts commit within a second, so this is rare; --rebuild (reset()) recounts everything.
+    # orders committed while the run is going wait for the next one
+    end = OrderPlaced.objects.aggregate(last=Max('id'))['last'] or 0
+    run = RecommendationRun.objects.create(last_order_id=watermark())
+    changed = set()
+    while True:
+        with transaction.atomic():
+            _lock_runs()
+            # another run may have folded orders since this one last looked
+            start = max(run.last_order_id, watermark())
+            rows = list(OrderPlaced.objects.filter(id__gt=start, id__lte=end)
+                        .order_by('id').values(*ORDER_FIELDS)[:chunk_size])
+            if not rows:
+                break
+            pairs = count_pairs(rows, start)
+            strips = refresh_top(add_pairs(pairs), k)
+            run.last_order_id = rows[-1]['id']
+            run.orders += len(rows)
+            run.pairs += sum(pairs.values())
+            run.save(update_fields=['last_order_id', 'orders', 'pairs'])
+        invalidate_product_pages(strips)
+        changed |= strips
+        if log:
+            log('orders up to #%d: %d new pairs, %d strips updated' % (run.last_order_id, len(pairs), len(strips)))
+    run.last_order_id = max(run.last_order_id, start)
+    run.finished_at = timezone.now()
+    run.save(update_fields=['last_order_id', 'finished_at'])
+    return run, changed
+
+
+def reset():
+    # Forgets everything so the next build starts from the first order. Counts only ever grow,
+    # so this is also how cancelled or deleted orders leave the recommendations.
+    with transaction.atomic():
+        CoPurchase.objects.all().delete()
+        ProductRecommendations.objects.all().delete()
+        RecommendationRun.objects.all().delete()
+    invalidate_products()
@@ -0,0 +1,292 @@
+import heapq
+import math
+import os
+import pickle
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only writers within one process are serialised
+    fcntl = None
+
+from django.conf import settings
+
+from Ecommerce.database import primary_reads
+
+from .models import Product
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+# a title hit counts three times a description hit
+FIELD_WEIGHTS = (('title', 3), ('brand', 2), ('description', 1))
+INDEX_FIELDS = ('id',) + tuple(field for field, _ in FIELD_WEIGHTS)
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Postings are scored in impact order and cut off here, so very common terms stay cheap
+MAX_POSTINGS_PER_TERM = 1000
+# the trailing query term matches at most this many indexed terms as a prefix
+MAX_PREFIX_EXPANSIONS = 10
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class TrieNode:
+    __slots__ = ('children', 'is_term')
+
+    def __init__(self):
+        self.children = {}
+        self.is_term = False
+
+
+class Trie:
+    def __init__(self):
+        self.root = TrieNode()
+
+    def insert(self, term):
+        node = self.root
+        for char in term:
+            node = node.children.setdefault(char, TrieNode())
+        node.is_term = True
+
+    def discard(self, term):
+        path = [self.root]
+        for char in term:
+            node = path[-1].children.get(char)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].is_term = False
+        # prune the now-empty tail of the branch
+        for depth in range(len(term), 0, -1):
+            node = path[depth]
+            if node.children or node.is_term:
+                break
+            del path[depth - 1].children[term[depth - 1]]
+
+    def terms(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return
+        stack = [(node, prefix)]
+        while stack:
+            node, term = stack.pop()
+            if node.is_term:
+                yield term
+            for char, child in node.children.items():
+                stack.append((child, term + char))
+
+
+class SearchIndex:
+    def __init__(self):
+        self.postings = {}     # term -> {product id: weighted term frequency}
+        self.doc_lengths = {}  # product id -> weighted document length
+        self.doc_terms = {}    # product id -> terms, so a product can be removed without a scan
+        self.total_length = 0
+        self.trie = Trie()
+        self._norms = None     # BM25 length normalisation per product, rebuilt lazily after changes
+        self._impacts = {}     # term -> [(tf / (tf + norm), product id)] best first, rebuilt lazily
+
+    def __getstate__(self):
+        # the trie and norms are derived data, rebuild them on load instead of pickling them
+        return {k: v for k, v in self.__dict__.items() if k not in ('trie', '_norms', '_impacts')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._norms = None
+        self._impacts = {}
+        self.trie = Trie()
+        for term in self.postings:
+            self.trie.insert(term)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc_id, fields):
+        self.remove(doc_id)
+        self._changed()
+        frequencies = {}
+        for field, weight in FIELD_WEIGHTS:
+            for term in tokenize(fields.get(field)):
+                frequencies[term] = frequencies.get(term, 0) + weight
+        for term, tf in frequencies.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                self.trie.insert(term)
+            self.postings[term][doc_id] = tf
+        length = sum(frequencies.values())
+        self.doc_lengths[doc_id] = length
+        self.doc_terms[doc_id] = tuple(frequencies)
+        self.total_length += length
+
+    def remove(self, doc_id):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._changed()
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        for term in terms:
+            docs = self.postings[term]
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+                self.trie.discard(term)
+
+    def _changed(self):
+        self._norms = None
+        self._impacts = {}
+
+    def norms(self):
+        if self._norms is None:
+            # an index of empty documents has total_length 0; every norm is then just K1 * (1 - B)
+            avg_length = (self.total_length / len(self.doc_lengths)) or 1
+            self._norms = {doc_id: K1 * (1 - B + B * length / avg_length)
+                           for doc_id, length in self.doc_lengths.items()}
+        return self._norms
+
+    def impacts(self, term):
+        impacts = self._impacts.get(term)
+        if impacts is None:
+            norms = self.norms()
+            impacts = sorted(((tf / (tf + norms[doc_id]), doc_id) for doc_id, tf in self.postings[term].items()),
+                             reverse=True)[:MAX_POSTINGS_PER_TERM]
+            self._impacts[term] = impacts
+        return impacts
+
+    def search(self, query, limit=50):
+        # BM25 over the union of the query terms; the last term also matches as a prefix
+        terms = tokenize(query)
+        if not terms or not self.doc_lengths:
+            return []
+        expanded = {term for term in terms[:-1] if term in self.postings}
+        if len(terms[-1]) > 1:
+            expanded.update(self.complete(terms[-1], MAX_PREFIX_EXPANSIONS))
+        if terms[-1] in self.postings:
+            expanded.add(terms[-1])
+
+        n = len(self.doc_lengths)
+        scores = {}
+        get = scores.get
+        for term in expanded:
+            df = len(self.postings[term])
+            weight = math.log(1 + (n - df + 0.5) / (df + 0.5)) * (K1 + 1)
+            for impact, doc_id in self.impacts(term):
+                scores[doc_id] = get(doc_id, 0.0) + weight * impact
+        return [doc_id for doc_id, _ in heapq.nlargest(limit, scores.items(), key=lambda item: item[1])]
+
+    def complete(self, prefix, limit=8):
+        # most common indexed terms starting with prefix
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        return heapq.nlargest(limit, self.trie.terms(prefix), key=lambda term: len(self.postings[term]))
+
+
+# Process-wide index, loaded from SEARCH_INDEX_PATH and reloaded when another process rewrites it.
+# Writers (the shop.index_products task, rebuilds, imports) hold an exclusive lock on a sibling
+# .lock file while they reload, change and rename the index, so two processes never lose each
+# other's changes; readers only ever see a whole file thanks to the rename.
+class IndexStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self._index = None
+        self._mtime = None
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def _file_lock(self):
+        with self.lock, open(os.fspath(self.path) + '.lock', 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _stale(self):
+        return self._index is None or self._file_mtime() != self._mtime
+
+    def _load(self):
+        # under _file_lock: the file as last renamed into place, built from the database if missing
+        if self._file_mtime() is None:
+            self._index = build_index()
+            self._save()
+        else:
+            with open(self.path, 'rb') as f:
+                self._index = pickle.load(f)
+            self._mtime = self._file_mtime()
+
+    def _save(self):
+        directory = os.path.dirname(os.fspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.search-index-')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(self._index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+        self._mtime = self._file_mtime()
+
+    def get(self):
+        with self.lock:
+            if self._stale():
+                with self._file_lock():
+                    self._load()
+            return self._index
+
+    def replace(self, index):
+        with self._file_lock():
+            self._index = index
+            self._save()
+
+    def apply(self, rows, removed=()):
+        # Adds (or re-adds) the products in rows, as dicts of INDEX_FIELDS, and drops the ids in
+        # removed that rows does not bring back; one rewrite of the file for the whole batch.
+        with self._file_lock():
+            if self._stale():
+                self._load()
+            added = set()
+            for row in rows:
+                self._index.add(row['id'], row)
+                added.add(row['id'])
+            for pk in set(removed) - added:
+                self._index.remove(pk)
+            self._save()
+
+    def update(self, product):
+        self.apply([{field: getattr(product, field) for field in INDEX_FIELDS}])
+
+    def remove(self, pk):
+        self.apply([], [pk])
+
+
+def build_index():
+    index = SearchIndex()
+    with primary_reads():
+        for row in Product.objects.values(*INDEX_FIELDS).order_by().iterator(chunk_size=2000):
+            index.add(row['id'], row)
+    return index
+
+
+store = IndexStore(getattr(settings, 'SEARCH_INDEX_PATH', settings.BASE_DIR / 'search_index.pickle'))
+
+
+def search_products(query, limit=50):
+    ids = store.get().search(query, limit)
+    found = Product.objects.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
+
+
+def autocomplete(prefix, limit=8):
+    return store.get().complete(prefix, limit)
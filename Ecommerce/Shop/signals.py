@@ -0,0 +1,94 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .auth import invalidate_user
+from .catalog import CARD_FIELDS, invalidate_product_pages, invalidate_products, pages_listing
+from .models import PricingRule, Product
+from .pricing import effective_price, rules_changed
+from .search import INDEX_FIELDS
+from .taskqueue import enqueue
+
+
+@receiver(pre_save, sender=Product)
+def set_effective_price(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'category', 'discounted_price'} & set(update_fields):
+        return
+    instance.effective_price = effective_price(instance.category, instance.discounted_price)
+
+
+INDEXED_FIELDS = tuple(field for field in INDEX_FIELDS if field != 'id')
+# fields whose changes queue background work
+WATCHED_FIELDS = INDEXED_FIELDS + ('product_image',)
+
+
+@receiver(pre_save, sender=Product)
+def remember_stored_row(sender, instance, using=None, update_fields=None, **kwargs):
+    # the post_save receivers compare against this, so a save that leaves these fields alone
+    # queues nothing
+    fields = [field for field in WATCHED_FIELDS if update_fields is None or field in update_fields]
+    instance._stored = {}
+    if instance.pk is not None and fields:
+        instance._stored = Product.objects.using(using).filter(pk=instance.pk).values(*fields).first() or {}
+
+
+def _changed(instance, created, fields):
+    if created:
+        return True
+    stored = getattr(instance, '_stored', {})
+    return any(field in stored and stored[field] != getattr(instance, field) for field in fields)
+
+
+@receiver([post_save, post_delete], sender=PricingRule)
+def reprice_catalog(sender, instance, **kwargs):
+    # one bulk UPDATE of effective_price once the rule change is committed
+    transaction.on_commit(rules_changed)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_catalog(sender, instance, **kwargs):
+    invalidate_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def invalidate_also_bought(sender, instance, update_fields=None, **kwargs):
+    # other products' pages embed this one as an "also bought" card
+    if update_fields is not None and not set(CARD_FIELDS) & set(update_fields):
+        return
+    invalidate_product_pages(pages_listing(instance.pk))
+
+
+@receiver(pre_delete, sender=Product)
+def drop_also_bought(sender, instance, **kwargs):
+    # the pairs are deleted with the product, so the pages are looked up first and dropped once it
+    # is gone for good; a strip rendered after that leaves the deleted card out
+    pks = pages_listing(instance.pk)
+    if pks:
+        transaction.on_commit(lambda: invalidate_product_pages(pks))
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # password, is_active and last_login changes reach the cached copy on the next request
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, created=False, **kwargs):
+    # the worker batches these into one rewrite of the index file, off the request path
+    if _changed(instance, created, INDEXED_FIELDS):
+        enqueue('shop.index_products', {'product_id': instance.pk})
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    enqueue('shop.index_products', {'product_id': instance.pk})
+
+
+@receiver(post_save, sender=Product)
+def queue_image_derivatives(sender, instance, created=False, **kwargs):
+    if not _changed(instance, created, ['product_image']):
+        return
+    # same transaction as the save, so the worker only ever sees committed products
+    enqueue('shop.image_derivatives', {'product_id': instance.pk})
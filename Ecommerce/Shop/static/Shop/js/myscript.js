@@ -1,4 +1,4 @@
-$("#slider1, #slider2, #slider3").owlCarousel({
+$(".product-slider").owlCarousel({
   loop: true,
   margin: 20,
   responsiveClass: true,
@@ -22,14 +22,21 @@ $("#slider1, #slider2, #slider3").owlCarousel({
   },
 });
 
+// Django's csrftoken cookie, sent back as X-CSRFToken on the cart POSTs
+function getCookie(name) {
+  var match = document.cookie.match("(?:^|;\\s*)" + name + "=([^;]*)");
+  return match ? decodeURIComponent(match[1]) : null;
+}
+
 //cart plus
 $(".plus-cart").click(function () {
   var id = $(this).attr("pid").toString();
   var eml = this.parentNode.children[2];
   // console.log(id);
   $.ajax({
-    type: "GET",
+    type: "POST",
     url: "/pluscart",
+    headers: { "X-CSRFToken": getCookie("csrftoken") },
     data: {
       prod_id: id,
     },
@@ -37,6 +44,13 @@ $(".plus-cart").click(function () {
       eml.innerText = data.quantity;
       document.getElementById("amount").innerText = data.amount;
       document.getElementById("totalamount").innerText = data.totalamount;
+      document.getElementById("discount").innerText = data.discount;
+    },
+    error: function (xhr) {
+      // 409: no unit left to reserve, the quantity stays as it was
+      if (xhr.responseJSON && xhr.responseJSON.error) {
+        alert(xhr.responseJSON.error);
+      }
     },
   });
 });
@@ -47,8 +61,9 @@ $(".minus-cart").click(function () {
   var eml = this.parentNode.children[2];
   // console.log(id);
   $.ajax({
-    type: "GET",
+    type: "POST",
     url: "/minuscart",
+    headers: { "X-CSRFToken": getCookie("csrftoken") },
     data: {
       prod_id: id,
     },
@@ -56,6 +71,7 @@ $(".minus-cart").click(function () {
       eml.innerText = data.quantity;
       document.getElementById("amount").innerText = data.amount;
       document.getElementById("totalamount").innerText = data.totalamount;
+      document.getElementById("discount").innerText = data.discount;
     },
   });
 });
@@ -66,15 +82,67 @@ $(".remove-cart").click(function () {
   var eml = this;
   // console.log(id);
   $.ajax({
-    type: "GET",
+    type: "POST",
     url: "/removecart",
+    headers: { "X-CSRFToken": getCookie("csrftoken") },
     data: {
       prod_id: id,
     },
     success: function (data) {
       document.getElementById("amount").innerText = data.amount;
       document.getElementById("totalamount").innerText = data.totalamount;
+      document.getElementById("discount").innerText = data.discount;
       eml.parentNode.parentNode.parentNode.parentNode.remove();
     },
   });
 });
+
+//search autocomplete
+$("input[data-autocomplete-url]").on("input", function () {
+  var input = $(this);
+  var list = $("#" + input.attr("list"));
+  var term = input.val();
+  if (term.length < 2) {
+    return;
+  }
+  $.ajax({
+    type: "GET",
+    url: input.data("autocomplete-url"),
+    data: {
+      q: term,
+    },
+    success: function (data) {
+      list.empty();
+      data.suggestions.forEach(function (s) {
+        list.append($("<option>").attr("value", s));
+      });
+    },
+  });
+});
+
+//Address typeahead: district and thana suggestions into a datalist
+$("input[data-lookup]").not("[name=zipcode]").each(function () {
+  var input = $(this);
+  var list = $("<datalist>").attr("id", input.attr("id") + "-options").insertAfter(input);
+  input.attr("list", list.attr("id"));
+  input.on("input", function () {
+    var data = { q: input.val() };
+    if (input.attr("name") === "district") data.division = $("#id_division").val();
+    if (input.attr("name") === "thana") data.district = $("#id_district").val();
+    $.getJSON(input.data("lookup"), data, function (result) {
+      list.empty();
+      result.suggestions.forEach(function (name) {
+        list.append($("<option>").attr("value", name));
+      });
+    });
+  });
+});
+
+//Zipcode: fill in division and district for a known post code
+$("input[name=zipcode][data-lookup]").change(function () {
+  $.getJSON($(this).data("lookup"), { code: $(this).val() }, function (data) {
+    $("#id_division").val(data.division);
+    $("#id_district").val(data.district);
+    if (data.thanas.length === 1 && !$("#id_thana").val()) $("#id_thana").val(data.thanas[0]);
+  });
+});
@@ -0,0 +1,141 @@
+import base64
+import gzip
+import hashlib
+import os
+from functools import lru_cache
+
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # optional: only .gz siblings are written without it
+    brotli = None
+
+# Third-party files pinned to the versions and SRI digests base.html used to load from their
+# CDNs. `manage.py vendor_static` downloads them into Shop/static, checking each digest; they are
+# then bundled and served like our own files. Until a file is vendored, base.html keeps loading
+# that one from its CDN.
+VENDOR = {
+    'Shop/vendor/bootstrap-5.0.0-beta1.min.css': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.0.0-beta1/dist/css/bootstrap.min.css',
+        'sha384-giJF6kkoqNQ00vy+HMDP7azOuL0xtbfIcaT9wjKHr8RbDVddVHyTfAAsrekwKmP1'),
+    'Shop/vendor/jquery-3.5.1.min.js': (
+        'https://code.jquery.com/jquery-3.5.1.min.js',
+        'sha256-9/aliU8dGd2tb6OSsuzixeV4y/faTqgFtohetphbbj0='),
+    'Shop/vendor/bootstrap-5.0.0-beta1.bundle.min.js': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.0.0-beta1/dist/js/bootstrap.bundle.min.js',
+        'sha384-ygbV9kiqUc6oa4msXn9868pTtWMgiQaeYH7/t7LECLbyPA2x65Kgf80OJFdroafW'),
+}
+
+# One file per type for base.html, concatenated in this order by collectstatic. Each bundle sits
+# in the directory of its sources so relative url()s in the CSS keep resolving.
+BUNDLES = {
+    'css': ('Shop/css/bundle.css', (
+        'Shop/vendor/bootstrap-5.0.0-beta1.min.css',
+        'Shop/css/owl.carousel.min.css',
+        'Shop/css/all.min.css',
+        'Shop/css/style.css',
+    )),
+    'js': ('Shop/js/bundle.js', (
+        'Shop/vendor/jquery-3.5.1.min.js',
+        'Shop/vendor/bootstrap-5.0.0-beta1.bundle.min.js',
+        'Shop/js/owl.carousel.min.js',
+        'Shop/js/all.min.js',
+        'Shop/js/myscript.js',
+    )),
+}
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.map', '.xml', '.html', '.ttf', '.eot')
+# smaller files gain nothing once the encoding headers are counted
+MIN_COMPRESS_SIZE = 512
+
+
+def integrity(content, algorithm='sha384'):
+    # Subresource Integrity value of content, as in VENDOR and integrity="" attributes
+    return '%s-%s' % (algorithm, base64.b64encode(hashlib.new(algorithm, content).digest()).decode())
+
+
+@lru_cache(maxsize=None)
+def vendored(name):
+    # whether a VENDOR file is there to serve: collected, or found in an app's static directory.
+    # Checked once per process, restart after running vendor_static.
+    return name in getattr(staticfiles_storage, 'hashed_files', {}) or finders.find(name) is not None
+
+
+def compress(content):
+    # {suffix: bytes} of every encoding that actually shrinks the content
+    encoded = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded['.br'] = brotli.compress(content, quality=11)
+    return {suffix: data for suffix, data in encoded.items() if len(data) < len(content)}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # collectstatic writes the Shop bundles, content-hashed copies of every file (staticfiles.json
+    # maps the names) and .gz/.br siblings that Shop.middleware.StaticFilesMiddleware serves.
+
+    def url_converter(self, name, hashed_files, template=None):
+        # the vendored CSS points at files that were never shipped (font-awesome webfonts);
+        # leave those url()s as they are instead of failing the whole collectstatic
+        converter = super().url_converter(name, hashed_files, template)
+
+        def tolerant(matchobj):
+            try:
+                return converter(matchobj)
+            except ValueError:
+                return matchobj.group('matched')
+        return tolerant
+
+    def stored_name(self, name):
+        # No manifest at all means collectstatic has not run (tests, a fresh checkout with
+        # DEBUG off): fall back to the plain name. A stale manifest still fails loudly.
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def write_bundles(self, paths):
+        for bundle, sources in BUNDLES.values():
+            parts = []
+            for source in sources:
+                if source not in paths and source in VENDOR:
+                    # not vendored yet; base.html links the CDN copy instead
+                    continue
+                storage, path = paths[source]
+                with storage.open(path) as f:
+                    parts.append(f.read().rstrip())
+            # ';' keeps concatenated scripts from running into each other
+            separator = b'\n;\n' if bundle.endswith('.js') else b'\n'
+            if self.exists(bundle):
+                self.delete(bundle)
+            self.save(bundle, ContentFile(separator.join(parts) + b'\n'))
+            paths[bundle] = (self, bundle)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            yield from super().post_process(paths, dry_run, **options)
+            return
+        self.write_bundles(paths)
+        hashed = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed.add(hashed_name)
+            yield name, hashed_name, processed
+        for name in sorted(hashed):
+            self.write_compressed(name)
+        # unhashed originals are served too (short-lived), so compress them as well
+        for name in paths:
+            self.write_compressed(name)
+
+    def write_compressed(self, name):
+        if not name.endswith(COMPRESSIBLE) or not self.exists(name):
+            return
+        with self.open(name) as f:
+            content = f.read()
+        if len(content) < MIN_COMPRESS_SIZE:
+            return
+        for suffix, data in compress(content).items():
+            path = self.path(name + suffix)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
@@ -0,0 +1,163 @@
+import logging
+import random
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# name -> (handler, batch); filled by @task, see Shop/tasks.py
+registry = {}
+
+MAX_ATTEMPTS = getattr(settings, 'SHOP_TASK_MAX_ATTEMPTS', 5)
+# retry n waits RETRY_BASE * 2**(n-1) seconds (+/- 25% jitter), never more than RETRY_MAX
+RETRY_BASE = getattr(settings, 'SHOP_TASK_RETRY_BASE', 30)
+RETRY_MAX = getattr(settings, 'SHOP_TASK_RETRY_MAX', 60 * 60)
+# a running task older than this belongs to a dead worker and is queued again
+CLAIM_TIMEOUT = getattr(settings, 'SHOP_TASK_CLAIM_TIMEOUT', 15 * 60)
+
+
+def task(name, batch=False):
+    # Registers a handler. A plain handler takes one payload; a batch handler takes a list of
+    # payloads and returns a list with one exception (or None) per payload, so one SMTP
+    # connection, say, can serve the whole batch while failures are still retried one by one.
+    def register(func):
+        registry[name] = (func, batch)
+        return func
+    return register
+
+
+def enqueue(name, payload=None, delay=0, max_attempts=None):
+    # Inside a transaction the task commits (or rolls back) together with the data it refers to.
+    if name not in registry:
+        raise KeyError('Unknown task %r' % name)
+    return Task.objects.create(name=name, payload=payload or {}, max_attempts=max_attempts or MAX_ATTEMPTS,
+                               run_after=timezone.now() + timedelta(seconds=delay))
+
+
+def enqueue_many(name, payloads, batch_size=1000):
+    # one INSERT per batch, for bulk jobs such as catalog imports
+    if name not in registry:
+        raise KeyError('Unknown task %r' % name)
+    now = timezone.now()
+    return Task.objects.bulk_create([Task(name=name, payload=payload, max_attempts=MAX_ATTEMPTS, run_after=now)
+                                     for payload in payloads], batch_size=batch_size)
+
+
+def retry_delay(attempts):
+    delay = min(RETRY_BASE * 2 ** max(attempts - 1, 0), RETRY_MAX)
+    return delay * random.uniform(0.75, 1.25)
+
+
+def claim(limit):
+    # Conditional UPDATE from queued to running: of several workers racing for the same rows
+    # each row goes to exactly one, on any database backend.
+    now = timezone.now()
+    ids = list(Task.objects.filter(status='queued', run_after__lte=now)
+               .order_by('run_after', 'id').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    Task.objects.filter(id__in=ids, status='queued').update(
+        status='running', claim=token, claimed_at=now, attempts=F('attempts') + 1)
+    return list(Task.objects.filter(claim=token, status='running').order_by('id'))
+
+
+def requeue_stale(timeout=CLAIM_TIMEOUT):
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return Task.objects.filter(status='running', claimed_at__lt=cutoff).update(status='queued', claim='')
+
+
+def purge_finished(older_than):
+    cutoff = timezone.now() - older_than
+    return Task.objects.filter(status='done', finished_at__lt=cutoff).delete()[0]
+
+
+def _execute(name, tasks):
+    handler, batch = registry[name]
+    if batch:
+        errors = handler([t.payload for t in tasks])
+        if len(errors) != len(tasks):
+            raise RuntimeError('%s returned %d results for %d tasks' % (name, len(errors), len(tasks)))
+        return errors
+    errors = []
+    for t in tasks:
+        try:
+            handler(t.payload)
+            errors.append(None)
+        except Exception as exc:
+            errors.append(exc)
+    return errors
+
+
+def _describe(exc):
+    return ''.join(traceback.format_exception(type(exc), exc, exc.__traceback__))[-4000:]
+
+
+def run(name, tasks):
+    # Runs claimed tasks of one name and records the outcome; returns (done, failed) counts.
+    if name not in registry:
+        errors = [KeyError('Unknown task %r' % name)] * len(tasks)
+    else:
+        try:
+            errors = _execute(name, tasks)
+        except Exception as exc:
+            errors = [exc] * len(tasks)
+
+    now = timezone.now()
+    done = [t.id for t, error in zip(tasks, errors) if error is None]
+    if done:
+        Task.objects.filter(id__in=done).update(status='done', finished_at=now, last_error='')
+    failed = 0
+    for t, error in zip(tasks, errors):
+        if error is None:
+            continue
+        logger.warning('Task %s #%s failed (attempt %d of %d): %s', name, t.id, t.attempts, t.max_attempts, error)
+        if t.attempts >= t.max_attempts:
+            failed += 1
+            Task.objects.filter(id=t.id).update(status='failed', finished_at=now, last_error=_describe(error))
+        else:
+            Task.objects.filter(id=t.id).update(
+                status='queued', claim='', last_error=_describe(error),
+                run_after=now + timedelta(seconds=retry_delay(t.attempts)))
+    return len(done), failed
+
+
+def run_in_thread(name, tasks):
+    # pool entry point: worker threads own their connections
+    close_old_connections()
+    try:
+        return run(name, tasks)
+    finally:
+        close_old_connections()
+
+
+def batches(tasks, batch_size):
+    # claimed tasks grouped by name, in chunks of at most batch_size
+    grouped = {}
+    for t in tasks:
+        grouped.setdefault(t.name, []).append(t)
+    for name, group in grouped.items():
+        for i in range(0, len(group), batch_size):
+            yield name, group[i:i + batch_size]
+
+
+def run_pending(batch_size=50):
+    # Drains every due task in the calling thread: the worker's --once mode, and handy in tests
+    # together with the locmem email backend. Returns (done, failed).
+    done = failed = 0
+    while True:
+        claimed = claim(batch_size)
+        if not claimed:
+            return done, failed
+        for name, group in batches(claimed, batch_size):
+            d, f = run(name, group)
+            done += d
+            failed += f
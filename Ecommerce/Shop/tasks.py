@@ -0,0 +1,135 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from Ecommerce.database import primary_reads
+
+from . import search
+from .images import generate_derivatives
+from .models import Checkout, OrderPlaced, Product
+from .taskqueue import enqueue, task
+
+# Handlers run by the run_tasks worker; ShopConfig.ready() imports this module to register them.
+
+
+def deliver(messages):
+    # Sends over one backend connection, one message at a time so a rejected recipient only
+    # fails (and retries) its own task. None entries have nothing to send.
+    errors = [None] * len(messages)
+    if not any(messages):
+        return errors
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as exc:
+        return [exc if message is not None else None for message in messages]
+    try:
+        for i, message in enumerate(messages):
+            if message is None:
+                continue
+            message.connection = connection
+            try:
+                message.send()
+            except Exception as exc:
+                errors[i] = exc
+    finally:
+        connection.close()
+    return errors
+
+
+def _message(subject, body, to, from_email=None, html=None):
+    message = EmailMultiAlternatives(subject, body, from_email or settings.DEFAULT_FROM_EMAIL, to)
+    if html:
+        message.attach_alternative(html, 'text/html')
+    return message
+
+
+def enqueue_mail(subject, body, to, from_email=None, html=None):
+    return enqueue('shop.send_mail', {'subject': subject, 'body': body, 'to': list(to),
+                                      'from_email': from_email, 'html': html})
+
+
+@task('shop.send_mail', batch=True)
+def send_mail(payloads):
+    return deliver([_message(p['subject'], p['body'], p['to'], p.get('from_email'), p.get('html'))
+                    for p in payloads])
+
+
+# context keys of PasswordResetForm that are safe to keep in the task table; uid and token are
+# made by the worker
+RESET_CONTEXT = ('email', 'domain', 'site_name', 'protocol')
+
+
+def enqueue_password_reset(user_id, to_email, context, subject_template, email_template, html_template=None,
+                           from_email=None):
+    return enqueue('shop.password_reset', {
+        'user_id': user_id, 'to': to_email, 'from_email': from_email,
+        'context': {key: context[key] for key in RESET_CONTEXT if key in context},
+        'subject_template': subject_template, 'email_template': email_template, 'html_template': html_template,
+    })
+
+
+@task('shop.password_reset', batch=True)
+def password_reset(payloads):
+    # the token covers the password hash and last login, so they are read from the primary
+    with primary_reads():
+        users = get_user_model()._default_manager.in_bulk([p['user_id'] for p in payloads])
+    messages = []
+    for p in payloads:
+        user = users.get(p['user_id'])
+        if user is None or not user.is_active:
+            messages.append(None)
+            continue
+        context = dict(p['context'], user=user, uid=urlsafe_base64_encode(force_bytes(user.pk)),
+                       token=default_token_generator.make_token(user))
+        subject = ''.join(render_to_string(p['subject_template'], context).splitlines())
+        html = render_to_string(p['html_template'], context) if p.get('html_template') else None
+        messages.append(_message(subject, render_to_string(p['email_template'], context), [p['to']],
+                                 p.get('from_email'), html))
+    return deliver(messages)
+
+
+@task('shop.order_confirmation', batch=True)
+def order_confirmation(payloads):
+    orders = OrderPlaced.objects.select_related('product', 'customer').order_by('id')
+    checkouts = Checkout.objects.select_related('user').prefetch_related(Prefetch('orders', queryset=orders))
+    checkouts = checkouts.in_bulk([p['checkout_id'] for p in payloads])
+    messages = []
+    for p in payloads:
+        checkout = checkouts.get(p['checkout_id'])
+        if checkout is None or not checkout.user.email:
+            messages.append(None)
+            continue
+        lines = list(checkout.orders.all())
+        # orders from before unit_price was recorded fall back to the current price
+        subtotal = sum(line.quantity * (line.product.effective_price if line.unit_price is None else line.unit_price)
+                       for line in lines)
+        context = {'checkout': checkout, 'user': checkout.user, 'orders': lines, 'total': subtotal - checkout.discount}
+        subject = ''.join(render_to_string('Shop/email/order_confirmation_subject.txt', context).splitlines())
+        messages.append(_message(subject, render_to_string('Shop/email/order_confirmation.txt', context),
+                                 [checkout.user.email]))
+    return deliver(messages)
+
+
+@task('shop.image_derivatives')
+def image_derivatives(payload):
+    try:
+        generate_derivatives(payload['product_id'], force=payload.get('force', False))
+    except Product.DoesNotExist:
+        # deleted before the worker got to it
+        pass
+
+
+@task('shop.index_products', batch=True)
+def index_products(payloads):
+    # saved and deleted products alike: whatever the database holds now is indexed, the rest removed
+    ids = {p['product_id'] for p in payloads}
+    with primary_reads():
+        rows = list(Product.objects.filter(id__in=ids).values(*search.INDEX_FIELDS).order_by('id'))
+    search.store.apply(rows, ids)
+    return [None] * len(payloads)
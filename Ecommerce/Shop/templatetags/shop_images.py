@@ -0,0 +1,30 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from Shop.catalog import product_url
+from Shop.images import picture_urls
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_picture(product, sizes='200px', **attrs):
+    # <picture> with WebP and JPEG srcsets once derivatives exist, the original upload until then
+    if not product.product_image:
+        # imported rows may come without an image
+        return format_html('<img{}>', flatatt(dict({'alt': ''}, **attrs)))
+    src, webp, jpg = picture_urls(product.product_image.name, product.image_digest, product.image_width)
+    if webp is None:
+        return format_html('<img src="{}"{}>', src, flatatt(attrs))
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" loading="lazy"{}></picture>',
+        webp, sizes, src, jpg, sizes, flatatt(attrs),
+    )
+
+
+@register.filter
+def detail_url(product):
+    # {{ product|detail_url }} in card loops, in place of {% url 'product-detail' product.id %}
+    return product_url(product.id)
@@ -0,0 +1,33 @@
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from Shop.staticfiles import BUNDLES, VENDOR, vendored
+
+register = template.Library()
+
+_TAGS = {
+    'css': '<link rel="stylesheet" href="{}">',
+    'js': '<script src="{}"></script>',
+}
+_CDN_TAGS = {
+    'css': '<link rel="stylesheet" href="{}" integrity="{}" crossorigin="anonymous">',
+    'js': '<script src="{}" integrity="{}" crossorigin="anonymous"></script>',
+}
+
+
+@register.simple_tag
+def static_bundle(kind):
+    # The collected bundle once collectstatic has hashed it; the separate source files while
+    # developing (DEBUG) or before the first collectstatic. VENDOR files that were never
+    # fetched are left out of the bundle, so they are linked from their CDN, ahead of it.
+    bundle, sources = BUNDLES[kind]
+    missing = [name for name in sources if name in VENDOR and not vendored(name)]
+    sources = [name for name in sources if name not in missing]
+    if not settings.DEBUG and bundle in getattr(staticfiles_storage, 'hashed_files', {}):
+        sources = (bundle,)
+    cdn = format_html_join('\n    ', _CDN_TAGS[kind], (VENDOR[name] for name in missing))
+    local = format_html_join('\n    ', _TAGS[kind], ((static(name),) for name in sources))
+    return format_html('{}\n    {}', cdn, local) if cdn else local
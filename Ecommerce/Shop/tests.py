@@ -1,3 +1,1006 @@
-from django.test import TestCase
+import importlib
+import inspect
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core import mail
+from django.core.files.storage import default_storage
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.templatetags.static import static
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from asgiref.sync import async_to_sync
+from django.utils import timezone
+from django.utils.text import slugify
+from PIL import Image
+
+from Ecommerce.database import PrimaryReplicaRouter, _sqlite_lag, primary_reads, request_state
+
+from . import cart, catalog, images, inventory, paginator, recommendations, search, taskqueue, tasks, urls
+from .auth import user_cache_key
+from .benchmarks import budget_allowance, client_settings, returning_visitor, seed, view_scenarios
+from .catalog import HOMEPAGE_CATEGORIES, homepage_fragments, product_page, product_url
+from .catalog_io import import_products
+from .checkout import CheckoutError, place_order
+from .forms import CustomerProfileForm
+from .instrumentation import Histogram, ViewStats, registry
+from .listing import CATEGORY_LABELS, ListingQuery, pack_cursor
+from .locations import index as locations
+from .management.commands import stress_inventory
+from .middleware import SessionMiddleware, StaticFilesMiddleware
+from .models import Cart, Checkout, CoPurchase, Customer, OrderPlaced, PricingRule, Product, StockHold, Task
+from .orders import order_history
+from .pricing import cart_discount, money
+from .staticfiles import VENDOR, integrity, vendored
+from .templatetags.shop_images import product_picture
+
+
+class ShopTestCase(TestCase):
+    # A small seeded catalog with its own search index and an empty cache for every test.
+    products = 40
+
+    @classmethod
+    def setUpClass(cls):
+        cls._settings = client_settings()
+        cls._settings.enable()
+        cls._index_dir = tempfile.mkdtemp(prefix='shop-test-')
+        cls._previous_store = search.store
+        search.store = search.IndexStore(cls._index_dir + '/search_index.pickle')
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        search.store = cls._previous_store
+        shutil.rmtree(cls._index_dir, ignore_errors=True)
+        cls._settings.disable()
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(products=cls.products, users=3, carts=10, orders=20)
+        cls.customer = Customer.objects.select_related('user').order_by('id').first()
+        cls.user = cls.customer.user
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def logged_in(self):
+        client = Client()
+        client.force_login(self.user)
+        return client
+
+
+class QueryBudgetTests(ShopTestCase):
+    # The budgets of Shop.benchmarks.view_scenarios, enforced on every `manage.py test` run and
+    # not only when bench_views is run by hand.
+
+    def test_views_stay_within_query_budget(self):
+        product = Product.objects.order_by('id').first()
+        clients = {False: Client(), True: self.logged_in(), 'returning': returning_visitor()}
+        for name, method, url_name, args, data, client, budget in view_scenarios(product):
+            with self.subTest(name):
+                budget += budget_allowance(client)
+                request = getattr(clients[client], method)
+                url = reverse(url_name, args=args)
+                # the warm-up request fills the caches, as in bench_views
+                self.assertLess(request(url, data).status_code, 400)
+                with CaptureQueriesContext(connection) as queries:
+                    response = request(url, data)
+                self.assertLess(response.status_code, 400)
+                self.assertLessEqual(len(queries), budget, '\n'.join(q['sql'] for q in queries.captured_queries))
+
+
+class ListingCursorTests(ShopTestCase):
+
+    def test_tampered_cursor_shows_first_page(self):
+        category = Product.objects.order_by('id').first().category
+        for sort, key in [('price-asc', ['abc', 1]), ('price-asc', [{'x': 1}, 2]), ('price-asc', ['1.5', 'x']),
+                          ('price-desc', ['NaN', 1]), ('newest', ['abc']), ('newest', [[1]]),
+                          ('newest', [True]), ('newest', 'not a list')]:
+            with self.subTest(sort=sort, key=key):
+                first, _ = ListingQuery(category, sort=sort).products()
+                page, _ = ListingQuery(category, sort=sort, cursor=pack_cursor(key)).products()
+                self.assertEqual(page, first)
+        self.assertEqual(ListingQuery(category, cursor='%%%').products()[0],
+                         ListingQuery(category).products()[0])
+
+    def test_cursor_pages_through_listing(self):
+        category = Product.objects.values_list('category', flat=True).order_by('id').first()
+        for sort in ('newest', 'price-asc', 'price-desc'):
+            with self.subTest(sort=sort):
+                seen, cursor = [], None
+                while True:
+                    page, cursor = ListingQuery(category, sort=sort, cursor=cursor).products(page_size=2)
+                    seen += [product.id for product in page]
+                    if not cursor:
+                        break
+                self.assertEqual(sorted(seen), list(Product.objects.filter(category=category)
+                                                    .order_by('id').values_list('id', flat=True)))
+
+
+class SearchIndexTests(ShopTestCase):
+
+    def test_product_changes_reach_the_index_through_the_task_queue(self):
+        product = Product.objects.order_by('id').first()
+        product.title = 'Zanzibar Kaftan'
+        product.save()
+        gone = Product.objects.order_by('-id').first()
+        gone_title = gone.title
+        gone.delete()
+        # nothing is rewritten on the request path
+        self.assertNotIn(product.id, search.store.get().search('zanzibar'))
+        taskqueue.run_pending()
+        self.assertEqual(search.store.get().search('zanzibar'), [product.id])
+        self.assertNotIn(gone.pk, search.store.get().search(gone_title))
+
+    def test_saves_that_leave_the_indexed_fields_alone_queue_nothing(self):
+        product = Product.objects.order_by('id').first()
+        Task.objects.all().delete()
+        product.selling_price += 1
+        product.save()
+        product.save(update_fields=['title'])
+        self.assertFalse(Task.objects.filter(name='shop.index_products').exists())
+        product.brand = 'Renamed'
+        product.save()
+        self.assertEqual(Task.objects.filter(name='shop.index_products').count(), 1)
+
+    def test_documents_without_terms_score_without_dividing_by_zero(self):
+        index = search.SearchIndex()
+        index.add(1, {'title': '', 'brand': '', 'description': ''})
+        self.assertEqual(index.norms(), {1: search.K1 * (1 - search.B)})
+
+    def test_writers_in_other_processes_are_not_lost(self):
+        first, second = Product.objects.order_by('id')[:2]
+        other = search.IndexStore(search.store.path)
+        search.store.get()
+        other.apply([{'id': first.id, 'title': 'Quokka', 'brand': '', 'description': ''}])
+        # this store still holds the older copy in memory, and must reload it before writing
+        search.store.apply([{'id': second.id, 'title': 'Quokka', 'brand': '', 'description': ''}])
+        self.assertEqual(sorted(other.get().search('quokka')), sorted([first.id, second.id]))
+
+
+class CheckoutTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Cart.objects.filter(user=self.user).delete()
+        self.product = Product.objects.order_by('id').first()
+        Cart.objects.create(user=self.user, product=self.product, quantity=2)
+
+    def test_retried_key_places_the_order_once(self):
+        checkout, created = place_order(self.user, self.customer.id, 'key-1')
+        self.assertTrue(created)
+        again, created = place_order(self.user, str(self.customer.id), 'key-1')
+        self.assertFalse(created)
+        self.assertEqual(again, checkout)
+        self.assertEqual(list(checkout.orders.values_list('product_id', 'quantity')), [(self.product.id, 2)])
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_bad_address_is_refused(self):
+        stranger = Customer.objects.exclude(user=self.user).first()
+        for custid in ('x', '', None, '1.5', stranger.id):
+            with self.subTest(custid=custid):
+                with self.assertRaisesMessage(CheckoutError, 'Choose one of your saved addresses.'):
+                    place_order(self.user, custid, 'key-2')
+        response = self.logged_in().post(reverse('checkout'), {'custid': 'x', 'idempotency_key': 'key-3'})
+        self.assertRedirects(response, reverse('checkout'), fetch_redirect_response=False)
+        self.assertTrue(Cart.objects.filter(user=self.user).exists())
+
+
+class OrderHistoryTests(ShopTestCase):
+
+    def test_cursor_pages_through_orders(self):
+        seen, cursor = [], None
+        while True:
+            page, cursor = order_history(self.user, cursor=cursor, page_size=3)
+            seen += [order.id for order in page]
+            if not cursor:
+                break
+        self.assertEqual(seen, list(OrderPlaced.objects.filter(user=self.user)
+                                    .order_by('-ordered_date', '-id').values_list('id', flat=True)))
+
+    def test_bad_cursor_shows_first_page(self):
+        first, _ = order_history(self.user)
+        for key in (['2024-13-45T00:00:00', 1], ['2024-01-01T00:00:00+00:00', 'x'], ['nonsense', 1],
+                    [None, 1], ['2024-01-01T00:00:00+00:00', True], 'x'):
+            with self.subTest(key=key):
+                self.assertEqual(order_history(self.user, cursor=pack_cursor(key))[0], first)
+        response = self.logged_in().get(reverse('orders'), {'cursor': pack_cursor(['2024-13-45T00:00:00', 1])})
+        self.assertEqual(response.status_code, 200)
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def route(self, lag, model=Product):
+        router = PrimaryReplicaRouter()
+        with mock.patch.dict(connections.settings, {'replica': {}}), \
+                mock.patch('Ecommerce.database.replica_lag', return_value=lag):
+            return router.db_for_read(model)
+
+    def test_catalog_reads_use_a_fresh_replica_only(self):
+        self.assertEqual(self.route(0.5), 'replica')
+        self.assertEqual(self.route(60), 'default')
+        self.assertEqual(self.route(None), 'default')
+        self.assertEqual(self.route(0.5, model=Cart), 'default')
+
+    def test_writes_and_cache_fills_read_from_the_primary(self):
+        state = {'pinned': False, 'wrote': False}
+        token = request_state.set(state)
+        try:
+            self.assertEqual(self.route(0.5), 'replica')
+            PrimaryReplicaRouter().db_for_write(Cart)
+            self.assertEqual(self.route(0.5), 'default')
+        finally:
+            request_state.reset(token)
+        token = request_state.set({'pinned': True, 'wrote': False})
+        try:
+            self.assertEqual(self.route(0.5), 'default')
+        finally:
+            request_state.reset(token)
+        with primary_reads():
+            self.assertEqual(self.route(0.5), 'default')
+
+    def test_sqlite_copy_lags_once_the_primary_is_written(self):
+        with tempfile.TemporaryDirectory() as folder:
+            primary, copy = os.path.join(folder, 'primary'), os.path.join(folder, 'copy')
+            for path, mtime in ((primary, 100), (copy, 200)):
+                open(path, 'w').close()
+                os.utime(path, (mtime, mtime))
+            self.assertEqual(_sqlite_lag(primary, copy), 0.0)
+            os.utime(primary, (300, 300))
+            self.assertGreater(_sqlite_lag(primary, copy), 60)
+            self.assertIsNone(_sqlite_lag(primary, os.path.join(folder, 'missing')))
+
+
+class ImportProductsTests(ShopTestCase):
+
+    def row(self, sku, title='Imported Saree'):
+        return {'sku': sku, 'title': title, 'selling_price': '1200', 'discounted_price': '1000',
+                'description': '', 'brand': 'Aarong', 'category': 'S', 'product_image': ''}
+
+    def test_dry_run_counts_match_the_import(self):
+        Product.objects.filter(pk=Product.objects.order_by('id').first().pk).update(sku='KNOWN-1')
+        rows = [(i, self.row(sku)) for i, sku in enumerate(['KNOWN-1', 'NEW-1', 'NEW-2', 'NEW-1'], 2)]
+        rows.append((6, self.row('', title='')))
+        dry = import_products(rows, batch_size=2, dry_run=True)
+        self.assertFalse(Product.objects.filter(sku__startswith='NEW-').exists())
+        real = import_products(rows, batch_size=2)
+        self.assertEqual((dry['created'], dry['updated'], dry['invalid']), (2, 2, 1))
+        self.assertEqual((real['created'], real['updated'], real['invalid']), (2, 2, 1))
+
+    def test_mysql_upserts_name_no_conflict_target(self):
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                mock.patch('django.db.models.QuerySet.bulk_create') as bulk_create:
+            import_products([(2, self.row('NEW-1'))])
+        upserts = [call.kwargs for call in bulk_create.call_args_list if call.kwargs.get('update_conflicts')]
+        self.assertEqual(len(upserts), 1)
+        self.assertNotIn('unique_fields', upserts[0])
+
+
+class VendoredStaticTests(SimpleTestCase):
+
+    def setUp(self):
+        vendored.cache_clear()
+        self.addCleanup(vendored.cache_clear)
+
+    def render(self):
+        return Template("{% load shop_static %}{% static_bundle 'css' %}{% static_bundle 'js' %}").render(Context())
+
+    def test_cdn_only_for_files_not_vendored(self):
+        with mock.patch('Shop.staticfiles.finders.find', return_value=None):
+            html = self.render()
+        for url, digest in VENDOR.values():
+            self.assertIn('<script src="%s" integrity="%s"' % (url, digest) if url.endswith('.js') else url, html)
+            self.assertIn(digest, html)
+        with mock.patch('Shop.staticfiles.finders.find', return_value='/somewhere'):
+            vendored.cache_clear()
+            html = self.render()
+        self.assertNotIn('integrity=', html)
+        for name in VENDOR:
+            self.assertIn(static(name), html)
+        self.assertLess(html.index('jquery'), html.index('owl.carousel.min.js'))
+
+    def test_integrity_matches_sri_format(self):
+        self.assertEqual(integrity(b'alert(1)', 'sha256'), 'sha256-bhHHL3z2vDgxUt0W3dWQOrprscmda2Y5pLsLg4GF+pI=')
+
+
+
+class StaticServingTests(SimpleTestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp(prefix='shop-static-')
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        os.makedirs(os.path.join(root, 'Shop'))
+        for name, content in (('Shop/app.css', b'body{}'), ('Shop/app.0123456789ab.css', b'body{}')):
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(content)
+            with open(os.path.join(root, name + '.gz'), 'wb') as f:
+                f.write(gzip.compress(content))
+        with open(os.path.join(root, 'staticfiles.json'), 'w') as f:
+            json.dump({'paths': {'Shop/app.css': 'Shop/app.0123456789ab.css'}}, f)
+        overridden = override_settings(STATIC_ROOT=root)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        self.middleware = StaticFilesMiddleware(lambda request: HttpResponse('view'))
+
+    def get(self, path, **headers):
+        response = self.middleware(RequestFactory().get(settings.STATIC_URL + path, headers=headers))
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_compressed_sibling_when_accepted(self):
+        response, body = self.get('Shop/app.css', accept_encoding='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(body), b'body{}')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        response, body = self.get('Shop/app.css')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(body, b'body{}')
+
+    def test_hashed_names_are_immutable_and_the_rest_revalidate(self):
+        response, _ = self.get('Shop/app.0123456789ab.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        response, _ = self.get('Shop/app.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        response, _ = self.get('Shop/app.css', if_modified_since=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.get('Shop/missing.css')[1], b'view')
+
+
+class PricingTests(ShopTestCase):
+
+    def test_category_rule_reprices_the_catalog(self):
+        category = Product.objects.order_by('id').first().category
+        with self.captureOnCommitCallbacks(execute=True):
+            rule = PricingRule.objects.create(name='Eid', kind='category', category=category, percent=10)
+        for product in Product.objects.all():
+            with self.subTest(product=product.id):
+                expected = money(product.discounted_price * Decimal('0.9')) if product.category == category \
+                    else product.discounted_price
+                self.assertEqual(product.effective_price, expected)
+        product = Product.objects.filter(category=category).first()
+        product.discounted_price = 1000
+        product.save()
+        self.assertEqual(Product.objects.get(pk=product.pk).effective_price, Decimal('900.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            rule.delete()
+        self.assertEqual(Product.objects.get(pk=product.pk).effective_price, Decimal('1000.00'))
+
+    def test_cart_rule_discounts_the_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            # in place of the rule the migrations install
+            PricingRule.objects.filter(kind='cart').delete()
+            PricingRule.objects.create(name='Big basket', kind='cart', percent=5, min_subtotal=1000)
+        Cart.objects.filter(user=self.user).delete()
+        product = Product.objects.order_by('id').first()
+        Cart.objects.create(user=self.user, product=product, quantity=3)
+        subtotal = 3 * product.effective_price
+        checkout, _ = place_order(self.user, self.customer.id, 'pricing')
+        expected = money(subtotal * Decimal('0.05')) if subtotal >= 1000 else Decimal('0.00')
+        self.assertEqual(checkout.discount, expected)
+        self.assertEqual(cart_discount(Decimal('999.99')), (Decimal('0.00'), ''))
+        self.assertEqual(cart_discount(Decimal('2000')), (Decimal('100.00'), 'Big basket'))
+
+
+class AlsoBoughtTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.a, self.b = Product.objects.order_by('id')[:2]
+        checkout = Checkout.objects.create(user=self.user, idempotency_key='also-bought')
+        OrderPlaced.objects.bulk_create([OrderPlaced(user=self.user, customer=self.customer, checkout=checkout,
+                                                     product=product) for product in (self.a, self.b)])
+        recommendations.build()
+
+    def strip(self):
+        return product_page(self.a.id)['also_bought']
+
+    def test_partner_changes_reach_the_cached_strip(self):
+        self.assertIn('href="%s"' % product_url(self.b.id), self.strip())
+        self.b.title = 'Renamed Partner'
+        self.b.save()
+        self.assertIn('Renamed Partner', self.strip())
+
+    def test_deleted_partner_leaves_the_cached_strip(self):
+        url = 'href="%s"' % product_url(self.b.id)
+        self.assertIn(url, self.strip())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.b.delete()
+        self.assertNotIn(url, self.strip())
+
+
+class InventoryTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Cart.objects.filter(user=self.user).delete()
+        self.product = Product.objects.order_by('id').first()
+        inventory.set_stock(self.product.id, 4, 4)
+
+    def test_checkout_takes_expired_units_from_several_shards(self):
+        cart.add_item(self.user, self.product.id)
+        cart.add_item(self.user, self.product.id)
+        self.assertEqual(inventory.release_expired(now=timezone.now() + timedelta(days=1)), 2)
+        self.assertEqual(inventory.available(self.product.id), 4)
+        place_order(self.user, self.customer.id, 'expired-holds')
+        self.assertEqual(inventory.available(self.product.id), 2)
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_reserve_spans_shards_and_releases_every_unit(self):
+        self.assertEqual(inventory.reserve(self.user, self.product.id, 3), 3)
+        self.assertEqual(StockHold.objects.filter(user=self.user).aggregate(units=Sum('quantity'))['units'], 3)
+        self.assertEqual(inventory.available(self.product.id), 1)
+        with self.assertRaises(inventory.OutOfStock):
+            inventory.reserve(self.user, self.product.id, 2)
+        # the failed reservation took nothing
+        self.assertEqual(inventory.available(self.product.id), 1)
+        self.assertEqual(inventory.release(self.user, self.product.id), 3)
+        self.assertEqual(inventory.shards(self.product.id), {0: 1, 1: 1, 2: 1, 3: 1})
+
+    def test_sweeper_skips_a_hold_shrunk_after_it_was_read(self):
+        inventory.set_stock(self.product.id, 4, 1)
+        self.assertEqual(inventory.reserve(self.user, self.product.id, 3), 3)
+        atomic = inventory.transaction.atomic
+        partial = []
+
+        def release_one_first(*args, **kwargs):
+            # the cart gives one unit back between the sweeper's read and its delete
+            if not partial:
+                partial.append(None)
+                partial[0] = inventory.release(self.user, self.product.id, 1)
+            return atomic(*args, **kwargs)
+        with mock.patch.object(inventory.transaction, 'atomic', release_one_first):
+            swept = inventory.release_expired(now=timezone.now() + timedelta(days=1))
+        self.assertEqual((partial, swept), ([1], 2))
+        self.assertEqual(inventory.available(self.product.id), 4)
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_checkout_fails_only_when_the_total_is_short(self):
+        Cart.objects.create(user=self.user, product=self.product, quantity=5)
+        with self.assertRaisesMessage(CheckoutError, 'out of stock'):
+            place_order(self.user, self.customer.id, 'short')
+        self.assertEqual(inventory.available(self.product.id), 4)
+
+
+class ConcurrentInventoryTests(TransactionTestCase):
+    # Threads buy one product until it sells out, through stress_inventory's driver. The shared
+    # in-memory test database answers contention with "table is locked" instead of waiting, so
+    # the driver retries a lot; a hold stranded by such a failure is counted where it sits.
+
+    def test_no_unit_is_oversold_or_lost(self):
+        with client_settings():
+            seed(products=1, users=4, carts=0, orders=0, index=False)
+            product = Product.objects.get()
+            customers = list(Customer.objects.select_related('user').order_by('id'))
+            command = stress_inventory.Command()
+            for checkout in (False, True):
+                for shards in (1, 3):
+                    with self.subTest(checkout=checkout, shards=shards):
+                        run = command.run(product, customers, shards, {'stock': 30, 'checkout': checkout})
+                        held = StockHold.objects.aggregate(units=Sum('quantity'))['units'] or 0
+                        ordered = OrderPlaced.objects.aggregate(units=Sum('quantity'))['units'] or 0
+                        self.assertEqual(run['oversold'], 0)
+                        self.assertEqual(run['remaining'], 0)
+                        self.assertEqual(held + ordered, 30)
+
+
+class HomepageTests(ShopTestCase):
+
+    def test_sliders_are_cached_until_a_product_changes(self):
+        homepage_fragments()
+        with self.assertNumQueries(0):
+            homepage_fragments()
+        product = Product.objects.filter(category__in=HOMEPAGE_CATEGORIES).order_by('id').first()
+        product.title = 'Freshly Renamed'
+        product.save()
+        self.assertIn('Freshly Renamed', homepage_fragments()[product.category])
+        product.delete()
+        self.assertNotIn('Freshly Renamed', homepage_fragments()[product.category])
+
+    def test_every_carousel_has_its_own_id(self):
+        html = Client().get(reverse('home')).content.decode()
+        ids = re.findall(r'class="owl-carousel product-slider" id="([^"]+)"', html)
+        self.assertEqual(len(ids), len(HOMEPAGE_CATEGORIES))
+        self.assertEqual(len(set(ids)), len(ids))
+
+
+class LehengaPresetTests(ShopTestCase):
+
+    def test_price_presets_split_at_2000_exclusively(self):
+        prices = {'1999.99': 'below', '2000.00': None, '2000.01': 'above'}
+        for price in prices:
+            Product.objects.create(title='Edge %s' % price, selling_price=price, discounted_price=price,
+                                   description='', brand='Edge', category='L', product_image='productimg/x.jpg')
+        for preset in ('below', 'above'):
+            with self.subTest(preset=preset):
+                html = Client().get(reverse('lehengaitem', args=[preset])).content.decode()
+                for price, expected in prices.items():
+                    self.assertEqual('Edge %s' % price in html, expected == preset, price)
+
+
+class ImageDerivativeTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp(prefix='shop-media-')
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        overridden = override_settings(MEDIA_ROOT=media)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+    def upload(self, width, height):
+        buffer = io.BytesIO()
+        Image.new('RGB', (width, height), 'teal').save(buffer, 'PNG')
+        return SimpleUploadedFile('saree.png', buffer.getvalue(), content_type='image/png')
+
+    def test_uploads_get_resized_webp_and_jpeg_srcsets(self):
+        product = Product.objects.order_by('id').first()
+        self.assertIn('<img src="', product_picture(product))
+        product.product_image = self.upload(800, 400)
+        product.save()
+        taskqueue.run_pending()
+        product.refresh_from_db()
+        self.assertEqual(product.image_width, 800)
+        for width in (160, 320, 640, 800):
+            for ext in ('webp', 'jpg'):
+                self.assertTrue(default_storage.exists(images.derivative_name(product.image_digest, width, ext)))
+        html = product_picture(product, sizes='50vw')
+        self.assertIn('<source type="image/webp" srcset="', html)
+        self.assertIn('/160.webp 160w, ', html)
+        self.assertIn('/800.jpg 800w"', html)
+        self.assertIn('sizes="50vw"', html)
+
+    def test_only_a_new_image_queues_derivatives(self):
+        product = Product.objects.order_by('id').first()
+        Task.objects.all().delete()
+        product.title = 'Renamed'
+        product.save()
+        self.assertFalse(Task.objects.filter(name='shop.image_derivatives').exists())
+        product.product_image = self.upload(200, 200)
+        product.save()
+        self.assertEqual(Task.objects.filter(name='shop.image_derivatives').count(), 1)
+
+
+class CartEndpointTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Cart.objects.filter(user=self.user).delete()
+        self.product = Product.objects.order_by('id').first()
+        cart.add_item(self.user, self.product.id)
+
+    def quantity(self):
+        return Cart.objects.get(user=self.user, product=self.product).quantity
+
+    def test_cart_changes_are_csrf_checked_posts(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        for name in ('pluscart', 'minuscart', 'removecart'):
+            with self.subTest(name=name):
+                self.assertEqual(client.get(reverse(name), {'prod_id': self.product.id}).status_code, 405)
+                self.assertEqual(client.post(reverse(name), {'prod_id': self.product.id}).status_code, 403)
+        self.assertEqual(self.quantity(), 1)
+        client.get(reverse('showcart'))
+        token = client.cookies[settings.CSRF_COOKIE_NAME].value
+        response = client.post(reverse('pluscart'), {'prod_id': self.product.id}, HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.json()['quantity'], 2)
+        self.assertEqual(self.quantity(), 2)
+
+    def test_quantities_change_in_place(self):
+        client = self.logged_in()
+        client.post(reverse('pluscart'), {'prod_id': self.product.id})
+        client.post(reverse('minuscart'), {'prod_id': self.product.id})
+        # never below one
+        self.assertEqual(client.post(reverse('minuscart'), {'prod_id': self.product.id}).json()['quantity'], 1)
+        self.assertEqual(client.post(reverse('removecart'), {'prod_id': self.product.id}).status_code, 200)
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_racing_insert_becomes_an_increment(self):
+        # another request inserted the line between this one's UPDATE and INSERT
+        lines = [Cart.objects.none()]
+        with mock.patch.object(cart, '_line', lambda user, product_id: lines.pop() if lines
+                               else Cart.objects.filter(user=user, product_id=product_id)):
+            cart.add_item(self.user, self.product.id)
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(self.quantity(), 2)
+
+
+class InstrumentationTests(SimpleTestCase):
+
+    def test_query_counts_have_their_own_buckets(self):
+        stats = ViewStats()
+        sample = mock.Mock(db_time=0.0, template_time=0.0, duplicate_queries=0)
+        for queries in (3, 3, 3, 4):
+            sample.queries = queries
+            stats.record(1.0, sample)
+        summary = stats.summary()['queries']
+        # exact at small counts, not smeared across the millisecond buckets (2, 5]
+        self.assertEqual((summary['p50'], summary['p99']), (3, 4))
+        self.assertEqual(stats.queries.counts[:5], [0, 0, 0, 3, 1])
+
+    def test_millisecond_percentiles_interpolate_inside_a_bucket(self):
+        histogram = Histogram()
+        for value in (3, 4):
+            histogram.observe(value)
+        self.assertEqual(histogram.percentile(50), 3.5)
+        self.assertEqual(histogram.percentile(100), 5)
+
+
+class SQLiteSettingsTests(TestCase):
+
+    def test_lock_wait_is_the_configured_timeout(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.DATABASES['default']['OPTIONS']['timeout'] * 1000)
+
+
+class RequestMetricsTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.addCleanup(registry.reset)
+
+    def test_responses_carry_server_timing_and_feed_the_registry(self):
+        product = Product.objects.order_by('id').first()
+        response = Client().get(product_url(product.id))
+        match = re.fullmatch(r'db;dur=[\d.]+;desc="(\d+) queries, (\d+) duplicate", tpl;dur=([\d.]+), total;dur=[\d.]+',
+                             response['Server-Timing'])
+        self.assertIsNotNone(match, response['Server-Timing'])
+        self.assertGreater(float(match.group(3)), 0)
+        stats = registry.snapshot()['product-detail']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['queries_total'], int(match.group(1)))
+        self.assertEqual(stats['duplicate_queries_total'], int(match.group(2)))
+
+    def test_metrics_are_for_staff(self):
+        Client().get(reverse('home'))
+        self.assertEqual(Client().get(reverse('metrics')).status_code, 404)
+        staff = Client()
+        staff.force_login(User.objects.create_user('metrics', password='x', is_staff=True))
+        self.assertIn('home', staff.get(reverse('metrics')).json()['views'])
+        text = staff.get(reverse('metrics'), {'format': 'prometheus'}).content.decode()
+        self.assertIn('shop_request_duration_seconds_bucket{view="home",le="+Inf"} 1\n', text)
+
+
+class ProductDetailTests(ShopTestCase):
+
+    def test_unchanged_pages_revalidate_to_304_without_queries(self):
+        product = Product.objects.order_by('id').first()
+        client = Client()
+        response = client.get(product_url(product.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = client.get(product_url(product.id), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        product.title = 'Retitled'
+        product.save()
+        response = client.get(product_url(product.id), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_products_are_remembered_until_created(self):
+        pk = Product.objects.order_by('-id').values_list('id', flat=True)[0] + 100
+        self.assertEqual(Client().get(product_url(pk)).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(Client().get(product_url(pk)).status_code, 404)
+        source = Product.objects.order_by('id').first()
+        source.pk, source.id = pk, pk
+        source._state.adding = True
+        source.save()
+        self.assertEqual(Client().get(product_url(pk)).status_code, 200)
+
+
+class AsyncViewTests(ShopTestCase):
+    # the coroutine views Shop/urls.py wires in under SHOP_ASYNC_VIEWS, against the sync ones
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.order_by('id').first()
+        self.sync_pages = {url: self.page(Client().get(url)) for url in self.urls()}
+        self.use_async_views(True)
+        self.addCleanup(self.use_async_views, False)
+
+    def use_async_views(self, enabled):
+        with override_settings(SHOP_ASYNC_VIEWS=enabled):
+            importlib.reload(urls)
+            # the project URLconf holds a resolver over the old patterns
+            importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+        clear_url_caches()
+        cache.clear()
+
+    def urls(self):
+        category = reverse('category', args=[slugify(CATEGORY_LABELS[self.product.category])])
+        return [reverse('home'), product_url(self.product.id), category, category + '?sort=price-asc',
+                reverse('lehengaitem', args=['below'])]
+
+    @staticmethod
+    def page(response):
+        # the csrf token differs per client
+        return response.status_code, re.sub(r'value="[^"]{64}"', '', response.content.decode())
+
+    def test_pages_match_the_sync_views(self):
+        self.assertTrue(inspect.iscoroutinefunction(resolve(reverse('home')).func.view_class.get))
+        self.assertEqual({status for status, _ in self.sync_pages.values()}, {200})
+        client = AsyncClient()
+
+        async def pages():
+            return {url: self.page(await client.get(url)) for url in self.urls()}
+        self.assertEqual(async_to_sync(pages)(), self.sync_pages)
+
+    async def test_detail_revalidates_and_cart_changes_are_posts(self):
+        client = AsyncClient()
+        response = await client.get(product_url(self.product.id))
+        response = await client.get(product_url(self.product.id), headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual((await client.get(product_url(10 ** 6))).status_code, 404)
+        await client.aforce_login(self.user)
+        await Cart.objects.filter(user=self.user).adelete()
+        await Cart.objects.acreate(user=self.user, product=self.product)
+        self.assertEqual((await client.get(reverse('pluscart'), {'prod_id': self.product.id})).status_code, 405)
+        response = await client.post(reverse('pluscart'), {'prod_id': self.product.id})
+        self.assertEqual(response.json()['quantity'], 2)
+
+
+class MailTaskTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Task.objects.all().delete()
+
+    def test_reset_links_are_made_by_the_worker(self):
+        User.objects.filter(pk=self.user.pk).update(email='reset@example.com')
+        response = Client().post(reverse('password_reset'), {'email': 'reset@example.com'})
+        self.assertEqual(response.status_code, 302)
+        queued = Task.objects.get(name='shop.password_reset')
+        self.assertEqual(queued.payload['user_id'], self.user.pk)
+        self.assertNotIn('password_reset_confirm', json.dumps(queued.payload))
+        self.assertEqual(mail.outbox, [])
+        taskqueue.run_pending()
+        self.assertEqual(mail.outbox[0].to, ['reset@example.com'])
+        link = re.search(r'/password_reset_confirm/[^/]+/[^/]+/', mail.outbox[0].body).group()
+        # a valid token swaps itself for the set-password form
+        self.assertRedirects(Client().get(link), link.rsplit('/', 2)[0] + '/set-password/',
+                             fetch_redirect_response=False)
+
+    def test_batches_share_a_connection_and_failures_retry_alone(self):
+        for to in ('a@example.com', 'refused@example.com', 'b@example.com'):
+            tasks.enqueue_mail('Hello', 'Body', [to])
+        send_messages = EmailBackend.send_messages
+
+        def refuse(backend, messages):
+            if messages[0].to == ['refused@example.com']:
+                raise ConnectionRefusedError('refused')
+            return send_messages(backend, messages)
+        with mock.patch.object(EmailBackend, 'send_messages', refuse), \
+                mock.patch.object(tasks, 'get_connection', wraps=tasks.get_connection) as connections_opened:
+            started = timezone.now()
+            with self.assertLogs('Shop.taskqueue', 'WARNING'):
+                self.assertEqual(taskqueue.run_pending(), (2, 0))
+        self.assertEqual(connections_opened.call_count, 1)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['a@example.com', 'b@example.com'])
+        retry = Task.objects.get(status='queued')
+        self.assertEqual((retry.attempts, retry.payload['to']), (1, ['refused@example.com']))
+        self.assertIn('ConnectionRefusedError', retry.last_error)
+        wait = (retry.run_after - started).total_seconds()
+        self.assertTrue(taskqueue.RETRY_BASE * 0.75 <= wait <= taskqueue.RETRY_BASE * 1.25 + 1, wait)
+        # not due yet
+        self.assertEqual(taskqueue.run_pending(), (0, 0))
+
+    def test_backoff_doubles_and_gives_up_after_max_attempts(self):
+        with mock.patch('random.uniform', return_value=1):
+            self.assertEqual([taskqueue.retry_delay(n) for n in (1, 2, 3)],
+                             [taskqueue.RETRY_BASE, taskqueue.RETRY_BASE * 2, taskqueue.RETRY_BASE * 4])
+            self.assertEqual(taskqueue.retry_delay(100), taskqueue.RETRY_MAX)
+        queued = tasks.enqueue_mail('Hello', 'Body', ['x@example.com'])
+        Task.objects.filter(pk=queued.pk).update(attempts=queued.max_attempts - 1)
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=ConnectionRefusedError), \
+                self.assertLogs('Shop.taskqueue', 'WARNING'):
+            self.assertEqual(taskqueue.run_pending(), (0, 1))
+        self.assertEqual(Task.objects.get(pk=queued.pk).status, 'failed')
+
+
+class EstimatedCountPaginatorTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # the seeded catalog stands in for a big table
+        patched = mock.patch.object(paginator, 'EXACT_COUNT_BELOW', 10)
+        patched.start()
+        self.addCleanup(patched.stop)
+        Product.objects.filter(pk=Product.objects.order_by('id')[5].pk).delete()
+
+    def test_unfiltered_lists_are_estimated_and_filtered_ones_counted(self):
+        top = Product.objects.order_by('-id').values_list('id', flat=True)[0]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(paginator.EstimatedCountPaginator(Product.objects.order_by('id'), 20).count, top)
+        self.assertNotIn('COUNT(', ' '.join(q['sql'] for q in queries))
+        category = Product.objects.filter(category='L').order_by('id')
+        self.assertEqual(paginator.EstimatedCountPaginator(category, 20).count, category.count())
+
+    def test_small_tables_are_counted_exactly(self):
+        with mock.patch.object(paginator, 'EXACT_COUNT_BELOW', 10000):
+            self.assertEqual(paginator.EstimatedCountPaginator(Product.objects.order_by('id'), 20).count,
+                             Product.objects.count())
+
+    def test_admin_changelist_skips_the_full_count(self):
+        client = Client()
+        client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('admin:Shop_product_changelist'))
+        self.assertEqual(response.status_code, 200)
+        counts = [q['sql'] for q in queries if 'COUNT(' in q['sql'] and '"Shop_product"' in q['sql']]
+        self.assertEqual(counts, [])
+
+
+class AddressTests(ShopTestCase):
+
+    def form(self, **fields):
+        data = dict({'name': 'Rahim', 'division': 'Dhaka', 'district': 'Dhaka', 'thana': 'Dhanmondi',
+                     'villorroad': 'Road 27', 'zipcode': 1205}, **fields)
+        form = CustomerProfileForm(data)
+        form.is_valid()
+        return form
+
+    def test_old_spellings_and_case_resolve_to_the_canonical_names(self):
+        self.assertEqual(locations.district('chittagong'), ('Chattogram', 'Chattogram'))
+        form = self.form(division='Chattogram', district='Chittagong', thana='patenga', zipcode=4204)
+        self.assertEqual(form.errors, {})
+        self.assertEqual((form.cleaned_data['district'], form.cleaned_data['thana']), ('Chattogram', 'Patenga'))
+
+    def test_contradictions_the_index_can_prove_are_rejected(self):
+        self.assertIn('district', self.form(division='Sylhet').errors)
+        self.assertIn('is in Chattogram district', self.form(zipcode=4204).errors['zipcode'][0])
+        self.assertIn('belongs to Motijheel', self.form(zipcode=1000).errors['zipcode'][0])
+        self.assertIn('four digit', self.form(zipcode=120).errors['zipcode'][0])
+
+    def test_unknown_post_codes_pass_unless_strict(self):
+        self.assertEqual(self.form(zipcode=1299).errors, {})
+        with self.settings(SHOP_STRICT_ADDRESSES=True):
+            self.assertEqual(self.form(zipcode=1299).errors['zipcode'], ['Unknown post code.'])
+
+    def test_lookup_endpoints(self):
+        response = self.client.get(reverse('address-zipcode'), {'code': '1205'})
+        self.assertEqual(response.json(), {'division': 'Dhaka', 'district': 'Dhaka', 'thanas': ['Dhanmondi']})
+        self.assertIn('max-age=86400', response['Cache-Control'])
+        self.assertEqual(self.client.get(reverse('address-zipcode'), {'code': 'x'}).status_code, 404)
+        thanas = self.client.get(reverse('address-thanas'), {'q': 'dh', 'district': 'dhaka'}).json()['suggestions']
+        self.assertIn('Dhanmondi', thanas)
+        districts = self.client.get(reverse('address-districts'), {'q': 'co', 'division': 'Chattogram'}).json()
+        self.assertEqual(districts['suggestions'], ["Cox's Bazar"])
+
+
+class SessionAndAuthTests(ShopTestCase):
+
+    def test_anonymous_catalog_gets_never_save_a_session(self):
+        def view(request):
+            request.session['seen'] = True
+            return HttpResponse()
+        middleware = SessionMiddleware(view)
+
+        def get(path, method='get', user=None):
+            request = getattr(RequestFactory(), method)(path)
+            request.resolver_match = resolve(path)
+            middleware.process_request(request)
+            if user is not None:
+                request.session[SESSION_KEY] = str(user.pk)
+            return middleware.process_response(request, middleware.get_response(request))
+        product = Product.objects.order_by('id').first()
+        for path in (reverse('home'), product_url(product.id), reverse('lehengaitem', args=['below']),
+                     reverse('search')):
+            self.assertNotIn(settings.SESSION_COOKIE_NAME, get(path).cookies, path)
+        self.assertEqual(Session.objects.count(), 0)
+        # logged-in visitors, POSTs and pages off the list keep theirs
+        self.assertIn(settings.SESSION_COOKIE_NAME, get(reverse('home'), user=self.user).cookies)
+        self.assertIn(settings.SESSION_COOKIE_NAME, get(reverse('password_reset'), method='post').cookies)
+        self.assertIn(settings.SESSION_COOKIE_NAME, get(reverse('showcart')).cookies)
+
+    def test_users_come_from_the_shared_cache_and_leave_it_when_saved(self):
+        client = self.logged_in()
+        key = user_cache_key(self.user.pk)
+        client.get(reverse('profile'))
+        self.assertIsNone(cache.get(key))
+        with self.settings(SHOP_SHARED_CACHE=True):
+            client.get(reverse('profile'))
+            self.assertEqual(cache.get(key), self.user)
+            with CaptureQueriesContext(connection) as queries:
+                client.get(reverse('profile'))
+            self.assertFalse([q for q in queries if 'auth_user' in q['sql']])
+            self.user.is_active = False
+            self.user.save()
+            self.assertIsNone(cache.get(key))
+            self.assertEqual(client.get(reverse('orders')).status_code, 302)
+
+    def test_catalog_entries_are_short_lived_without_a_shared_cache(self):
+        product = Product.objects.order_by('id').first()
+        for shared, timeout in ((False, catalog.LOCAL_CACHE_TIMEOUT), (True, catalog.PRODUCT_PAGE_TIMEOUT)):
+            cache.clear()
+            with self.settings(SHOP_SHARED_CACHE=shared), mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+                product_page(product.id)
+            self.assertEqual(cache_set.call_args_list[-1].args[2], timeout)
+
+
+class NavbarFragmentTests(ShopTestCase):
+
+    def test_user_fragments_are_keyed_by_user(self):
+        other = User.objects.exclude(pk=self.user.pk).order_by('id').first()
+        first = self.logged_in().get(reverse('home')).content.decode()
+        self.assertIsNotNone(cache.get(make_template_fragment_key('shop_navbar_user',
+                                                                  [self.user.pk, self.user.username])))
+        second = Client()
+        second.force_login(other)
+        html = second.get(reverse('home')).content.decode()
+        self.assertIn(other.username.capitalize(), html)
+        self.assertNotIn(self.user.username.capitalize(), html)
+        self.assertIn(self.user.username.capitalize(), first)
+        User.objects.filter(pk=other.pk).update(username='renamed')
+        self.assertIn('Renamed', second.get(reverse('home')).content.decode())
+
+    def test_search_box_and_logout_token_are_rendered_every_time(self):
+        client = self.logged_in()
+        for q in ('kaftan', 'zebra'):
+            self.assertIn('value="%s"' % q, client.get(reverse('search'), {'q': q}).content.decode())
+        tokens = set()
+        for client in (self.logged_in(), self.logged_in()):
+            html = client.get(reverse('home')).content.decode()
+            tokens.add(re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', html).group(1))
+        self.assertEqual(len(tokens), 2)
+        self.assertIn('>Login</a>', Client().get(reverse('home')).content.decode())
+
+
+class RecommendationBuildTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        recommendations.build()
+        self.products = list(Product.objects.order_by('id')[:3])
+        checkout = Checkout.objects.create(user=self.user, idempotency_key='overlap')
+        OrderPlaced.objects.bulk_create([OrderPlaced(user=self.user, customer=self.customer, checkout=checkout,
+                                                     product=product) for product in self.products])
+
+    def counts(self):
+        ids = [product.id for product in self.products]
+        return dict(((pair.product_id, pair.other_id), pair.count)
+                    for pair in CoPurchase.objects.filter(product_id__in=ids, other_id__in=ids))
+
+    def test_overlapping_runs_count_each_order_once(self):
+        before = self.counts()
+        nested = []
+
+        def start_another_run(message):
+            # a second cron job starts while the first is between chunks
+            if not nested:
+                nested.append(recommendations.build(chunk_size=1))
+        first, _ = recommendations.build(chunk_size=1, log=start_another_run)
+        self.assertEqual(first.orders + nested[0][0].orders, 3)
+        after = self.counts()
+        self.assertEqual(len(after), 6)
+        self.assertEqual({pair: n - before.get(pair, 0) for pair, n in after.items()}, dict.fromkeys(after, 1))
+        self.assertEqual(recommendations.build()[0].orders, 0)
@@ -1,18 +1,39 @@
 
 from django.urls import path
-from Shop import views
+from Shop import async_views, views
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
 from .forms import LoginForm,MyPasswordChangeForm,MyPasswordReset,MySetPasswordForm
 
+# catalog pages and cart endpoints run as coroutines under ASGI, see Ecommerce/asgi.py
+catalog = async_views if getattr(settings, 'SHOP_ASYNC_VIEWS', False) else views
+
 urlpatterns = [
-    path('', views.ProductView.as_view(), name="home"),
-    path('product-detail/<int:pk>',views.ProductDetail.as_view(),name="product-detail"),
-    path('lehenga/', views.lehenga, name='lehenga'),
-    path('lehenga/<slug:data>',views.lehenga, name='lehengaitem'),
+    path('', catalog.ProductView.as_view(), name="home"),
+    path('product-detail/<int:pk>',catalog.ProductDetail.as_view(),name="product-detail"),
+    path('category/<slug:slug>/', catalog.category_listing, name='category'),
+    path('healthz/', views.health, name='health'),
+    path('_metrics/', views.metrics, name='metrics'),
+    path('_metrics/slow/', views.slow_requests, name='metrics-slow'),
+    path('products/export/', views.export_products, name='export-products'),
+    path('search/', views.search, name='search'),
+    path('search/autocomplete/', views.search_autocomplete, name='search-autocomplete'),
+    path('lehenga/', catalog.lehenga, name='lehenga'),
+    path('lehenga/<slug:data>',catalog.lehenga, name='lehengaitem'),
+    path('add-to-cart/', views.add_to_cart, name='add-to-cart'),
+    path('cart/', views.show_cart, name='showcart'),
+    path('pluscart', catalog.plus_cart, name='pluscart'),
+    path('minuscart', catalog.minus_cart, name='minuscart'),
+    path('removecart', catalog.remove_cart, name='removecart'),
+    path('buy/', views.buy_now, name='buy-now'),
+    path('checkout/', views.checkout, name='checkout'),
+    path('orders/', views.orders, name='orders'),
     path('profile/', views.CustomerProfileView.as_view(), name='profile'),
     path('address/', views.address, name='address'),
+    path('address/districts/', views.address_districts, name='address-districts'),
+    path('address/thanas/', views.address_thanas, name='address-thanas'),
+    path('address/zipcode/', views.address_zipcode, name='address-zipcode'),
     path('registration/',views.CustomerRegistrationView.as_view(),name='customerregistration'),
     path('accounts/login/',auth_views.LoginView.as_view(template_name='Shop/login.html',authentication_form=LoginForm),name='login'),
     path('passwordchange/', auth_views.PasswordChangeView.as_view(template_name ='Shop/passwordchange.html', form_class= MyPasswordChangeForm, success_url='/passwordchangedone/'), name="passwordchange"),
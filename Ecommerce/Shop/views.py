@@ -1,58 +1,225 @@
-from django.shortcuts import render
+from django.shortcuts import render, redirect, get_object_or_404
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_POST
+from django.middleware.csrf import get_token
 from . models import Customer, Product, Cart, OrderPlaced
 from django.views import View
 from.forms import CustomerRegistrationForm,CustomerProfileForm
 from django.contrib import messages
+from .catalog import homepage_fragments, product_page
+from .listing import CATEGORY_LABELS, CATEGORY_SLUGS, ListingQuery
+from .search import autocomplete, search_products
+from .locations import index as locations
+from . import cart
+from .checkout import CheckoutError, place_order
+from .inventory import OutOfStock
+from .orders import order_history, status_counts
+import uuid
+from decimal import Decimal
+import hashlib
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.utils.safestring import mark_safe
+from Ecommerce.database import check_databases
+from .instrumentation import registry, slow_profiles
+from .catalog_io import FORMATS as EXPORT_FORMATS, export_lines, export_queryset
 # Create your views here.
 class ProductView(View):
  def get(self, request):
-  gentspants = Product.objects.filter(category='GP')
-  sares = Product.objects.filter(category='S')
-  borkhs = Product.objects.filter(category='BK')
-  lehengas=Product.objects.filter(category='L')
-  babyfashions = Product.objects.filter(category='BF')
-  return render(request, 'Shop/home.html', {'gentspants':gentspants, 'sares':sares,'borkhs':borkhs,'lehengas':lehengas,'babyfashions':babyfashions})
+  # one grouped query on a cold cache, none once the fragments are cached
+  sliders = homepage_fragments()
+  return render(request, 'Shop/home.html', {'sliders':sliders})
 
 #def product_detail(request):
 # return render(request, 'Shop/productdetail.html')
 
+def detail_validators(page, user, request):
+ # the navbar user and the csrf token are rendered around the fragment, so they are part of the validator;
+ # get_token() settles the token first, so a first visit's ETag already matches the cookie sent with it
+ get_token(request)
+ variant='%s:%s' % (user.pk or '', request.META.get('CSRF_COOKIE', ''))
+ etag=quote_etag('%s-%s' % (page['etag'], hashlib.md5(variant.encode(), usedforsecurity=False).hexdigest()[:12]))
+ return etag, int(page['last_modified'])
+
+def not_modified(request, etag, last_modified):
+ # 304 without rendering when the browser copy is still current; pending messages must be shown
+ if len(messages.get_messages(request)):
+  return None
+ return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+def render_detail(request, page, pk, etag, last_modified):
+ response=render(request,'Shop/productdetail.html',{'product_html':mark_safe(page['html']),'also_bought_html':mark_safe(page.get('also_bought','')),'product_id':pk})
+ response.headers['ETag']=etag
+ response.headers['Last-Modified']=http_date(last_modified)
+ return response
+
+def detail_cache_headers(response):
+ patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+ patch_vary_headers(response, ('Cookie',))
+ return response
+
 class ProductDetail(View):
  def get(self,request,pk):
-  product=Product.objects.get(pk=pk)
-  return render (request,'Shop/productdetail.html',{'product':product})
-  
- 
+  # cached fragment; a warm page or a known-missing pk costs no product query
+  page=product_page(pk)
+  if page is None:
+   raise Http404('No such product')
+  etag,last_modified=detail_validators(page, request.user, request)
+  response=not_modified(request, etag, last_modified) or render_detail(request, page, pk, etag, last_modified)
+  return detail_cache_headers(response)
 
+def sold_out(request, product):
+ messages.error(request,'Sorry, %s is out of stock.' % product.title)
+ return redirect('showcart')
+
+@login_required
+@require_POST
 def add_to_cart(request):
- return render(request, 'Shop/addtocart.html')
+ product=get_object_or_404(Product.objects.only('id','title'), pk=request.POST.get('prod_id') or 0)
+ try:
+  cart.add_item(request.user, product.id)
+ except OutOfStock:
+  return sold_out(request, product)
+ return redirect('showcart')
+
+@login_required
+def show_cart(request):
+ lines=Cart.objects.filter(user=request.user).select_related('product').order_by('id')
+ return render(request, 'Shop/addtocart.html',{'carts':lines,'totals':cart.summary(request.user)})
 
+# JSON endpoints used by myscript.js; plain JsonResponse, no template rendering.
+# They change the cart and reserve stock, so they take CSRF-checked POSTs only.
+def cart_product_id(request):
+ try:
+  return int(request.POST['prod_id'])
+ except (KeyError, ValueError):
+  return None
+
+def cart_update(action):
+ @require_POST
+ def view(request):
+  if not request.user.is_authenticated:
+   return JsonResponse({'error':'login required'}, status=401)
+  product_id=cart_product_id(request)
+  if product_id is None:
+   return JsonResponse({'error':'prod_id is required'}, status=400)
+  try:
+   action(request.user, product_id)
+  except OutOfStock:
+   # the line keeps its quantity; myscript.js shows the error
+   return JsonResponse(dict(cart.summary(request.user, product_id), error='Out of stock'), status=409)
+  return JsonResponse(cart.summary(request.user, product_id))
+ return view
+
+plus_cart=cart_update(cart.increment)
+minus_cart=cart_update(cart.decrement)
+remove_cart=cart_update(cart.remove)
+
+@login_required
+@require_POST
 def buy_now(request):
- return render(request, 'Shop/buynow.html')
+ product=get_object_or_404(Product.objects.only('id','title'), pk=request.POST.get('prod_id') or 0)
+ try:
+  cart.add_item(request.user, product.id)
+ except OutOfStock:
+  return sold_out(request, product)
+ return redirect('checkout')
 
 def profile(request):
  return render(request, 'Shop/profile.html')
 
+@login_required
 def address(request):
- add=Customer.objects.filter(user=request.user)
+ # served by the index on customer.user_id, oldest address first
+ add=Customer.objects.filter(user=request.user).order_by('id')
  return render(request, 'Shop/address.html',{'add':add,'active':'btn-primary'})
 
+# Typeahead for the profile form, answered from the in-memory location index
+@cache_control(public=True, max_age=86400)
+def address_districts(request):
+ return JsonResponse({'suggestions':locations.complete_districts(request.GET.get('q',''), request.GET.get('division'))})
+
+@cache_control(public=True, max_age=86400)
+def address_thanas(request):
+ return JsonResponse({'suggestions':locations.complete_thanas(request.GET.get('q',''), request.GET.get('district',''))})
+
+@cache_control(public=True, max_age=86400)
+def address_zipcode(request):
+ found=locations.zipcode(request.GET.get('code'))
+ if found is None:
+  return JsonResponse({'error':'unknown post code'}, status=404)
+ division,district,thanas=found
+ return JsonResponse({'division':division,'district':district,'thanas':list(thanas)})
+
 
+@login_required
 def orders(request):
- return render(request, 'Shop/orders.html')
+ status=request.GET.get('status') or None
+ order_placed,next_cursor=order_history(request.user, status, request.GET.get('cursor'))
+ context={
+  'order_placed':order_placed,
+  'next_cursor':next_cursor,
+  'status':status,
+  'status_counts':status_counts(request.user),
+ }
+ return render(request, 'Shop/orders.html',context)
 
 def change_password(request):
  return render(request, 'Shop/changepassword.html')
 
+def listing_context(query, products, next_cursor, facets):
+ return {
+  'products':products,
+  'next_cursor':next_cursor,
+  'next_query':query.params(cursor=next_cursor),
+  'facets':facets,
+  'category_label':CATEGORY_LABELS[query.category],
+  'categories':[(slug, CATEGORY_LABELS[code]) for slug, code in CATEGORY_SLUGS.items()],
+ }
+
+def render_listing(request, query):
+ products,next_cursor=query.products()
+ return render(request, 'Shop/category.html', listing_context(query, products, next_cursor, query.facets()))
+
+def category_query(slug, params):
+ code=CATEGORY_SLUGS.get(slug)
+ if code is None:
+  raise Http404('Unknown category')
+ return ListingQuery.from_params(code, params)
+
+def category_listing(request, slug):
+ return render_listing(request, category_query(slug, request.GET))
+
+# old /lehenga/<data> links, kept as presets of the generic listing
+LEHENGA_PRESETS = {
+ 'pakija': {'brands': ['pakija']},
+ 'ponnoala': {'brands': ['ponnoala']},
+ 'below': {'max_price': 2000},
+ # prices have two decimals, so this is the old "more than 2000": exactly 2000 is in neither list
+ 'above': {'min_price': Decimal('2000.01')},
+}
+
+def lehenga_query(data, params):
+ if data is None:
+  return ListingQuery.from_params('L', params)
+ if data in LEHENGA_PRESETS:
+  return ListingQuery('L', sort=params.get('sort'), cursor=params.get('cursor'), **LEHENGA_PRESETS[data])
+ raise Http404('Unknown lehenga filter')
+
 def lehenga(request,data=None):
- if data==None:
-  lehengas=Product.objects.filter(category='L')
- elif data=="pakija" or data=="ponnoala":
-  lehengas=Product.objects.filter(category='L').filter(brand=data)
- elif data=="below":
-  lehengas=Product.objects.filter(category='L').filter(discounted_price__lt=2000)
- elif data=="above":
-  lehengas=Product.objects.filter(category='L').filter(discounted_price__gt=2000)
- return render(request, 'Shop/lehenga.html',{'lehengas':lehengas})
+ return render_listing(request, lehenga_query(data, request.GET))
+
+def search(request):
+ q=request.GET.get('q','').strip()
+ products=search_products(q) if q else []
+ return render(request, 'Shop/search.html',{'q':q,'products':products})
+
+def search_autocomplete(request):
+ return JsonResponse({'suggestions':autocomplete(request.GET.get('q',''))})
 
 #def login(request):
      #return render(request, 'Shop/login.html')
@@ -96,6 +263,52 @@ class CustomerProfileView(View):
    messages.success(request,'Congratulations profile updated successfully')
   return render(request, 'Shop/profile.html',{'form':form,'active':'btn-primary'})
    
+@login_required
 def checkout(request):
- 
- return render(request, 'Shop/checkout.html')
+ if request.method=='POST':
+  # a retried POST carries the same key and lands on the order it already placed
+  key=request.POST.get('idempotency_key') or request.headers.get('Idempotency-Key')
+  if not key:
+   return redirect('checkout')
+  try:
+   place_order(request.user, request.POST.get('custid'), key[:64])
+  except CheckoutError as e:
+   messages.error(request, str(e))
+   return redirect('checkout')
+  messages.success(request,'Your order has been placed')
+  return redirect('orders')
+ add=Customer.objects.filter(user=request.user)
+ lines=Cart.objects.filter(user=request.user).select_related('product').order_by('id')
+ context={'add':add,'carts':lines,'totals':cart.summary(request.user),'idempotency_key':uuid.uuid4().hex}
+ return render(request, 'Shop/checkout.html',context)
+
+def health(request):
+ databases=check_databases()
+ return JsonResponse({'databases':databases}, status=200 if all(databases.values()) else 503)
+
+# in-process request metrics, for staff (or anyone while DEBUG is on)
+def metrics(request):
+ if not (settings.DEBUG or request.user.is_staff):
+  raise Http404
+ if request.GET.get('format')=='prometheus':
+  return HttpResponse(registry.prometheus(), content_type='text/plain; version=0.0.4')
+ return JsonResponse({'views':registry.snapshot()})
+
+def slow_requests(request):
+ if not (settings.DEBUG or request.user.is_staff):
+  raise Http404
+ return JsonResponse({'slowest':slow_profiles.slowest()})
+
+# whole catalog as CSV or JSON lines, streamed so neither the rows nor the body are held in memory
+@staff_member_required
+def export_products(request):
+ fmt=request.GET.get('format','csv')
+ if fmt not in EXPORT_FORMATS:
+  return HttpResponseBadRequest('format must be one of: %s' % ', '.join(EXPORT_FORMATS))
+ category=request.GET.get('category') or None
+ if category and category not in CATEGORY_LABELS:
+  return HttpResponseBadRequest('unknown category')
+ response=StreamingHttpResponse(export_lines(export_queryset(category), fmt),
+                                content_type='text/csv; charset=utf-8' if fmt=='csv' else 'application/x-ndjson')
+ response['Content-Disposition']='attachment; filename="products.%s"' % fmt
+ return response